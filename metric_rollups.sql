@@ -0,0 +1,78 @@
+-- Multi-resolution rollups of ecs_schema.metrics for the Streamlit dashboards.
+--
+-- Each table holds one row per series (metric name + attributes) and time bucket with
+-- count/sum/min/max and a mergeable quantile sketch (APPROX_PERCENTILE_ACCUMULATE), so the
+-- coarser tables are built from the finer ones instead of from the raw rows:
+--
+--   ecs_schema.metrics      raw, written by ecs_transform_task
+--   ecs_schema.metrics_1m   1-minute buckets
+--   ecs_schema.metrics_1h   1-hour buckets, from metrics_1m
+--   ecs_schema.metrics_1d   1-day buckets, from metrics_1h
+--
+-- Dynamic tables keep them up to date incrementally as the transformation task appends.
+-- load_data/load_data_promql in streamlit_in_snowflake pick the coarsest table that still
+-- yields enough points for the selected time window.
+
+use role oteltest;
+
+CREATE OR REPLACE DYNAMIC TABLE ecs_schema.metrics_1m
+  TARGET_LAG = '1 minute'
+  WAREHOUSE = otelwh
+  CLUSTER BY (TO_DATE("@timestamp"), "metricset.name")
+AS
+SELECT
+    DATE_TRUNC('minute', "@timestamp") AS "@timestamp",
+    "metricset.name",
+    "attributes",
+    COUNT("metric.value") AS "metric.count",
+    SUM("metric.value") AS "metric.sum",
+    MIN("metric.value") AS "metric.min",
+    MAX("metric.value") AS "metric.max",
+    APPROX_PERCENTILE_ACCUMULATE("metric.value") AS "metric.sketch"
+FROM ecs_schema.metrics
+GROUP BY 1, 2, 3;
+
+CREATE OR REPLACE DYNAMIC TABLE ecs_schema.metrics_1h
+  TARGET_LAG = '10 minutes'
+  WAREHOUSE = otelwh
+  CLUSTER BY (TO_DATE("@timestamp"), "metricset.name")
+AS
+SELECT
+    DATE_TRUNC('hour', "@timestamp") AS "@timestamp",
+    "metricset.name",
+    "attributes",
+    SUM("metric.count") AS "metric.count",
+    SUM("metric.sum") AS "metric.sum",
+    MIN("metric.min") AS "metric.min",
+    MAX("metric.max") AS "metric.max",
+    APPROX_PERCENTILE_COMBINE("metric.sketch") AS "metric.sketch"
+FROM ecs_schema.metrics_1m
+GROUP BY 1, 2, 3;
+
+CREATE OR REPLACE DYNAMIC TABLE ecs_schema.metrics_1d
+  TARGET_LAG = '1 hour'
+  WAREHOUSE = otelwh
+  CLUSTER BY ("@timestamp", "metricset.name")
+AS
+SELECT
+    DATE_TRUNC('day', "@timestamp") AS "@timestamp",
+    "metricset.name",
+    "attributes",
+    SUM("metric.count") AS "metric.count",
+    SUM("metric.sum") AS "metric.sum",
+    MIN("metric.min") AS "metric.min",
+    MAX("metric.max") AS "metric.max",
+    APPROX_PERCENTILE_COMBINE("metric.sketch") AS "metric.sketch"
+FROM ecs_schema.metrics_1h
+GROUP BY 1, 2, 3;
+
+-- Example: hourly p95 of one metric over the last week
+SELECT "@timestamp",
+       "metric.sum" / NULLIF("metric.count", 0) AS "metric.value",
+       APPROX_PERCENTILE_ESTIMATE("metric.sketch", 0.95) AS "metric.p95"
+FROM ecs_schema.metrics_1h
+WHERE "metricset.name" = 'http.server.duration'
+  AND "@timestamp" >= DATEADD('day', -7, CURRENT_TIMESTAMP())
+ORDER BY "@timestamp";
+
+SHOW DYNAMIC TABLES IN SCHEMA ecs_schema;
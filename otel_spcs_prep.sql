@@ -19,19 +19,32 @@ use role oteltest;
 create database otel;
 create schema otelschema;
 
+-- Tables are clustered by date first so dashboard time windows prune whole days; keep the
+-- keys in sync with TABLE_LAYOUTS in snowflake_otel_receiver/table_layout.py, which also
+-- applies them to existing tables and enforces retention (python3 table_layout.py apply|retention)
+
 CREATE or replace TABLE metrics (
       timestamp TIMESTAMP_NTZ,
       metric_name STRING,
       value DOUBLE,
       attributes VARCHAR
-);
+) CLUSTER BY (TO_DATE(timestamp), metric_name);
 
 CREATE or replace TABLE logs (
       timestamp TIMESTAMP_NTZ,
       log_level STRING,
       message STRING,
       attributes varchar
-);
+) CLUSTER BY (TO_DATE(timestamp), log_level);
+
+-- Log search index written by the receiver next to logs: one row per distinct token of a
+-- log record (message words and "key=value" for LOG_INDEX_ATTRIBUTES), with the record's
+-- time bucket and its timestamp, which locates the record in logs
+CREATE or replace TABLE log_tokens (
+      token STRING,
+      bucket TIMESTAMP_NTZ,
+      log_timestamp TIMESTAMP_NTZ
+) CLUSTER BY (TO_DATE(bucket), token);
 
 
 CREATE or replace TABLE  traces (
@@ -41,7 +54,40 @@ CREATE or replace TABLE  traces (
       start_time TIMESTAMP_NTZ,
       end_time TIMESTAMP_NTZ,
       attributes varchar
-);
+) CLUSTER BY (TO_DATE(start_time), name, SUBSTR(trace_id, 1, 2));
+
+-- Pre-aggregated RED metrics written by the receiver's span metrics stage
+-- (one row per service, span name, kind and status per flush window)
+CREATE or replace TABLE span_metrics (
+      window_start TIMESTAMP_NTZ,
+      window_end TIMESTAMP_NTZ,
+      service_name STRING,
+      span_name STRING,
+      span_kind STRING,
+      status_code STRING,
+      call_count NUMBER,
+      error_count NUMBER,
+      duration_sum_ms DOUBLE,
+      duration_min_ms DOUBLE,
+      duration_max_ms DOUBLE,
+      bucket_bounds_ms varchar,
+      bucket_counts varchar
+) CLUSTER BY (TO_DATE(window_start), service_name);
+
+-- Service map edges (caller service -> callee service) joined by the receiver from parent/child spans
+CREATE or replace TABLE service_graph_edges (
+      window_start TIMESTAMP_NTZ,
+      window_end TIMESTAMP_NTZ,
+      caller STRING,
+      callee STRING,
+      call_count NUMBER,
+      error_count NUMBER,
+      duration_sum_ms DOUBLE,
+      duration_min_ms DOUBLE,
+      duration_max_ms DOUBLE,
+      bucket_bounds_ms varchar,
+      bucket_counts varchar
+) CLUSTER BY (TO_DATE(window_start), caller);
 
 CREATE IMAGE REPOSITORY IF NOT EXISTS oteltestimages;
 
@@ -59,7 +105,7 @@ GRANT BIND SERVICE ENDPOINT ON ACCOUNT TO ROLE oteltest;
 
 CREATE  COMPUTE POOL IF NOT EXISTS OTEL_COMPUTE_POOL
   MIN_NODES = 1
-  MAX_NODES = 1
+  MAX_NODES = 3
   INSTANCE_FAMILY = CPU_X64_S
   AUTO_RESUME = true;
 
@@ -76,7 +122,7 @@ use role oteltest;
   CREATE SERVICE otel_service
   IN COMPUTE POOL OTEL_COMPUTE_POOL
   MIN_INSTANCES=1
-  MAX_INSTANCES=1
+  MAX_INSTANCES=3
   FROM SPECIFICATION
   $$
    spec:
@@ -88,6 +134,12 @@ use role oteltest;
          SNOWFLAKE_WAREHOUSE: "otelwh"
          SNOWFLAKE_SCHEMA: "otelschema"
          SPCS: "True"
+         # Replicas find each other through the instances.<service DNS name> record and forward
+         # spans to the replica owning their trace_id, so the service can scale past one instance
+         TRACE_AFFINITY_DNS: "instances.otel-service.otelschema.otel.snowflakecomputing.internal"
+       readinessProbe:
+         port: 4318
+         path: /readyz
           
      endpoints:
      - name: otelhttp
@@ -107,3 +159,5 @@ SHOW ENDPOINTS IN SERVICE otel_service;
 select * from metrics;
 select * from logs;
 select * from traces;
+select * from span_metrics;
+select * from service_graph_edges;
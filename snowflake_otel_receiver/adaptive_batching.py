@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveBatchController:
+    """
+    Tunes a BatchWriter's batch size, flush interval and number of active connections from
+    the latency of the batches it writes, within operator-set bounds.
+
+    Batch size grows additively while the per-row cost of full batches keeps dropping and is
+    cut multiplicatively (AIMD) when a batch fails or exceeds the latency target. Once bigger
+    batches stop paying off and rows are still backing up, another connection is added
+    instead. The flush interval follows the time it takes the observed arrival rate to fill
+    one batch.
+    """
+
+    def __init__(self, min_batch_size=100, max_batch_size=20000, min_flush_interval=0.2,
+                 max_flush_interval=5.0, min_connections=1, max_connections=4,
+                 latency_target_seconds=2.0, batch_size=None, connections=None, flush_interval=None):
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.min_flush_interval = min_flush_interval
+        self.max_flush_interval = max_flush_interval
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.latency_target_seconds = latency_target_seconds
+        self.additive_step = max(min_batch_size, 100)
+        self.batch_size = self.clamp(batch_size or min_batch_size, min_batch_size, max_batch_size)
+        self.connections = self.clamp(connections or min_connections, min_connections, max_connections)
+        # Start from the configured settings, within the bounds, until batches are observed
+        self.flush_interval = self.clamp(flush_interval or max_flush_interval, min_flush_interval, max_flush_interval)
+        self.lock = threading.Lock()
+        # Per-row cost (seconds) of full batches at the current and the previous batch size
+        self.row_cost = None
+        self.previous_row_cost = None
+        self.arrival_rate = 0.0
+        self.last_rows_submitted = 0
+        self.last_observed_at = time.monotonic()
+        self.decision = "initial"
+
+    @staticmethod
+    def clamp(value, low, high):
+        return max(low, min(high, value))
+
+    def observe(self, rows, seconds, failed, queued_rows, rows_submitted):
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.last_observed_at
+            if elapsed > 0:
+                rate = (rows_submitted - self.last_rows_submitted) / elapsed
+                self.arrival_rate = 0.7 * self.arrival_rate + 0.3 * rate if self.arrival_rate else rate
+            self.last_rows_submitted = rows_submitted
+            self.last_observed_at = now
+
+            if failed:
+                self.decrease("insert failed", 0.5)
+            elif seconds > self.latency_target_seconds:
+                self.decrease(f"latency {seconds:.2f}s over target {self.latency_target_seconds:.2f}s", 0.7)
+            elif rows >= self.batch_size:
+                self.increase(seconds / rows, queued_rows)
+
+            if self.arrival_rate > 0:
+                fill_time = self.batch_size / self.arrival_rate
+                self.flush_interval = self.clamp(fill_time, self.min_flush_interval, self.max_flush_interval)
+            else:
+                self.flush_interval = self.max_flush_interval
+            return self.batch_size, self.flush_interval, self.connections
+
+    def decrease(self, reason, factor):
+        self.batch_size = self.clamp(int(self.batch_size * factor), self.min_batch_size, self.max_batch_size)
+        self.connections = self.clamp(self.connections - 1, self.min_connections, self.max_connections)
+        self.row_cost = self.previous_row_cost = None
+        self.set_decision(f"back off: {reason}")
+
+    def increase(self, row_cost, queued_rows):
+        self.row_cost = row_cost if self.row_cost is None else 0.7 * self.row_cost + 0.3 * row_cost
+        if self.previous_row_cost is None or self.row_cost < 0.95 * self.previous_row_cost:
+            if self.batch_size < self.max_batch_size:
+                self.previous_row_cost = self.row_cost
+                self.batch_size = self.clamp(self.batch_size + self.additive_step, self.min_batch_size,
+                                             self.max_batch_size)
+                self.set_decision(f"grow batch: {self.row_cost * 1e6:.1f}us per row and dropping")
+                return
+        if queued_rows > self.batch_size and self.connections < self.max_connections:
+            self.connections += 1
+            self.set_decision(
+                f"add connection: {self.row_cost * 1e6:.1f}us per row flat, {queued_rows} rows backed up"
+            )
+
+    def set_decision(self, decision):
+        self.decision = decision
+        logger.info(
+            f"Adaptive batching: {decision} -> batch size {self.batch_size}, "
+            f"{self.connections} connection(s)"
+        )
+
+    def state(self):
+        with self.lock:
+            return {
+                "batch_size": self.batch_size,
+                "flush_interval": round(self.flush_interval, 3),
+                "connections": self.connections,
+                "row_cost_us": round(self.row_cost * 1e6, 2) if self.row_cost is not None else None,
+                "arrival_rate": round(self.arrival_rate, 1),
+                "decision": self.decision,
+                "bounds": {
+                    "batch_size": [self.min_batch_size, self.max_batch_size],
+                    "flush_interval": [self.min_flush_interval, self.max_flush_interval],
+                    "connections": [self.min_connections, self.max_connections],
+                    "latency_target_seconds": self.latency_target_seconds,
+                },
+            }
@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Pressure levels derived from a writer's queue fill ratio and insert latency
+NORMAL, ELEVATED, HIGH, CRITICAL = 0, 1, 2, 3
+
+# OTLP SeverityNumber ranges start at TRACE=1, DEBUG=5, INFO=9, WARN=13, ERROR=17, FATAL=21
+SEVERITY_TEXT_NUMBERS = {
+    "TRACE": 1, "DEBUG": 5, "INFO": 9, "WARN": 13, "WARNING": 13, "ERROR": 17, "FATAL": 21, "CRITICAL": 21,
+}
+# Lowest severity still admitted at each pressure level; ERROR and FATAL are never shed
+LOG_MIN_SEVERITY = (0, 9, 13, 17)
+
+# Fraction of non-error traces still admitted at each pressure level; error spans are never shed
+SPAN_KEEP_RATIO = (1.0, 0.5, 0.1, 0.0)
+
+DEFAULT_CORE_METRIC_PREFIXES = (
+    "http.server.", "http.client.", "rpc.server.", "rpc.client.", "process.runtime.", "system.cpu.",
+    "system.memory.",
+)
+
+
+class AdmissionController:
+    """
+    Sheds lower-value telemetry in front of the tenant writers once their queue fills up or
+    batch inserts slow down. Shedding is graded by pressure level: DEBUG/INFO logs go before
+    WARN, non-error traces are sampled down by trace_id before error spans are touched, and
+    non-core metrics (high-cardinality ones first) go before core metrics.
+
+    A writer's latency average only moves when a batch is written, so it is read decayed by
+    the time since, halving every latency_half_life seconds: after a slow spell shedding
+    ends even when little is left to write.
+    """
+
+    def __init__(self, queue_thresholds=(0.5, 0.75, 0.9), latency_target_seconds=2.0,
+                 core_metric_prefixes=DEFAULT_CORE_METRIC_PREFIXES, high_cardinality_attributes=8,
+                 latency_half_life=30.0):
+        self.queue_thresholds = queue_thresholds
+        self.latency_target_seconds = latency_target_seconds
+        self.latency_half_life = latency_half_life
+        self.core_metric_prefixes = tuple(core_metric_prefixes)
+        self.high_cardinality_attributes = high_cardinality_attributes
+        self.lock = threading.Lock()
+        self.rejected = {"spans": 0, "log_records": 0, "data_points": 0}
+
+    def level(self, writer):
+        fill_ratio = writer.fill_ratio()
+        queue_level = sum(1 for threshold in self.queue_thresholds if fill_ratio >= threshold)
+        latency_level = 0
+        if self.latency_target_seconds:
+            latency = writer.latency_ewma
+            if latency and self.latency_half_life:
+                latency *= 0.5 ** ((time.monotonic() - writer.latency_updated_at) / self.latency_half_life)
+            if latency >= 4 * self.latency_target_seconds:
+                latency_level = CRITICAL
+            elif latency >= 2 * self.latency_target_seconds:
+                latency_level = HIGH
+            elif latency >= self.latency_target_seconds:
+                latency_level = ELEVATED
+        return max(queue_level, latency_level)
+
+    def admit_span(self, level, trace_id, status_code):
+        if status_code == 2:
+            return True
+        keep_ratio = SPAN_KEEP_RATIO[level]
+        if keep_ratio >= 1.0:
+            return True
+        # The low 8 bytes of a W3C trace id are random, so whole traces are kept or shed together
+        return int.from_bytes(trace_id[-8:], "big") < keep_ratio * 2 ** 64
+
+    def admit_log(self, level, severity_number, severity_text):
+        if not severity_number:
+            severity_number = SEVERITY_TEXT_NUMBERS.get((severity_text or "INFO").upper(), 9)
+        return severity_number >= LOG_MIN_SEVERITY[level]
+
+    def admit_metric(self, level, metric_name, attribute_count):
+        if level == NORMAL or metric_name.startswith(self.core_metric_prefixes):
+            return True
+        if level == ELEVATED:
+            return attribute_count <= self.high_cardinality_attributes
+        return False
+
+    def count_rejected(self, signal, count):
+        if count:
+            with self.lock:
+                self.rejected[signal] += count
+            logger.warning(f"Load shedding rejected {count} {signal}")
+
+    def stats(self):
+        with self.lock:
+            return dict(self.rejected)
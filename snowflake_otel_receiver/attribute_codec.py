@@ -0,0 +1,105 @@
+import base64
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _array(any_value):
+    return [parse_any_value(value) for value in any_value.array_value.values]
+
+
+def _kvlist(any_value):
+    return {kv.key: parse_any_value(kv.value) for kv in any_value.kvlist_value.values}
+
+
+# AnyValue oneof field -> decoder, so each value costs one WhichOneof instead of a HasField chain
+DECODERS = {
+    "string_value": lambda any_value: any_value.string_value,
+    "bool_value": lambda any_value: any_value.bool_value,
+    "int_value": lambda any_value: any_value.int_value,
+    "double_value": lambda any_value: any_value.double_value,
+    "array_value": _array,
+    "kvlist_value": _kvlist,
+    "bytes_value": lambda any_value: any_value.bytes_value,
+}
+
+
+def parse_any_value(any_value):
+    decoder = DECODERS.get(any_value.WhichOneof("value"))
+    return decoder(any_value) if decoder is not None else None
+
+
+def attributes_to_dict(attributes):
+    return {kv.key: parse_any_value(kv.value) for kv in attributes}
+
+
+def _default(value):
+    # bytes attributes are written base64 encoded, as in OTLP/JSON
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value, default=_default).decode()
+else:
+    def dumps(value):
+        return json.dumps(value, default=_default)
+
+
+def encode_dict(attributes_dict):
+    return dumps(attributes_dict) if attributes_dict else "{}"
+
+
+class AttributeCodec:
+    """
+    Encodes repeated KeyValue attributes to the JSON written to the attributes columns.
+    Spans and logs from one service mostly carry identical attribute sets, so the encoded
+    JSON is kept in a bounded LRU keyed by the serialized KeyValue messages and each
+    distinct set is decoded and encoded once.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, attributes):
+        if not attributes:
+            return "{}"
+        if not self.max_entries:
+            return encode_dict(attributes_to_dict(attributes))
+        key = tuple(kv.SerializeToString() for kv in attributes)
+        with self.lock:
+            encoded = self.cache.get(key)
+            if encoded is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return encoded
+            self.misses += 1
+        encoded = encode_dict(attributes_to_dict(attributes))
+        with self.lock:
+            self.cache[key] = encoded
+            if len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return encoded
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "encoder": "orjson" if orjson is not None else "json",
+                "entries": len(self.cache),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
@@ -0,0 +1,357 @@
+# Offline backfill of OTLP dumps written by the collector's file exporter.
+#
+# To run this on the command line, enter:
+#   python3 backfill.py /path/to/dumps --checkpoint backfill.checkpoint.json
+#
+# Files are read as a stream, flattened into rows in a process pool with the receiver's own
+# row builders (and log_tokens postings when ENABLE_LOG_INDEX is on) and loaded with PUT + COPY INTO through the table stage (or multi-row INSERT
+# with --method insert). Progress is checkpointed after every load so an interrupted run
+# continues where it stopped.
+
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from compact_rows import materialize_batch
+from otlp_json import hex_ids_to_base64
+
+logger = logging.getLogger(__name__)
+
+JSON_SUFFIXES = (".json", ".jsonl", ".ndjson")
+PROTO_SUFFIXES = (".binpb", ".pb", ".proto")
+
+# Target table and column list per signal, in the column order of the receiver's INSERTs
+BULK_TABLES = {
+    "traces": ("traces", "trace_id, span_id, name, start_time, end_time, attributes"),
+    "metrics": ("metrics", "timestamp, metric_name, value, attributes"),
+    "logs": ("logs", "timestamp, log_level, message, attributes"),
+    "log_tokens": ("log_tokens", "token, bucket, log_timestamp"),
+}
+
+
+def file_format(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(JSON_SUFFIXES):
+        return "json"
+    if name.endswith(PROTO_SUFFIXES):
+        return "proto"
+    return None
+
+
+def signal_from_name(path):
+    name = os.path.basename(path).lower()
+    for signal, hint in (("traces", "trace"), ("metrics", "metric"), ("logs", "log")):
+        if hint in name:
+            return signal
+    return None
+
+
+def list_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if file_format(name):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def open_dump(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def read_records(f, fmt, path=None):
+    # Yields (record, offset after the record) so progress can be checkpointed exactly. A dump
+    # cut off mid-record (the collector was killed while writing it) ends at the last whole
+    # record, as does a truncated gzip stream.
+    try:
+        if fmt == "json":
+            for line in iter(f.readline, b""):
+                if line.strip():
+                    yield line, f.tell()
+        else:
+            while True:
+                header = f.read(4)
+                if not header:
+                    return
+                if len(header) < 4:
+                    logger.warning(f"{path}: ignoring a truncated record header at the end of the file")
+                    return
+                (length,) = struct.unpack(">I", header)
+                record = f.read(length)
+                if len(record) < length:
+                    logger.warning(
+                        f"{path}: ignoring a truncated record at the end of the file "
+                        f"({len(record)} of {length} bytes)"
+                    )
+                    return
+                yield record, f.tell()
+    except EOFError as e:
+        logger.warning(f"{path}: compressed stream ends early, stopping at the last whole record: {e}")
+
+
+def iter_chunks(files, checkpoint, chunk_records, signal_override):
+    for path in files:
+        state = checkpoint.files.get(path, {})
+        if state.get("done"):
+            continue
+        fmt = file_format(path)
+        signal = signal_override or signal_from_name(path)
+        if fmt == "proto" and signal is None:
+            logger.error(f"Skipping {path}: cannot tell the signal of a protobuf dump, pass --signal")
+            continue
+        with open_dump(path) as f:
+            f.seek(state.get("offset", 0))
+            records = []
+            offset = state.get("offset", 0)
+            for record, offset in read_records(f, fmt, path):
+                records.append(record)
+                if len(records) >= chunk_records:
+                    yield path, offset, fmt, signal, records, False
+                    records = []
+            yield path, offset, fmt, signal, records, True
+
+
+def init_worker():
+    # The receiver logs every row at DEBUG, which would dominate a bulk load
+    logging.getLogger("otel_server_python_http_tcp_snowflake_fastapi").setLevel(logging.INFO)
+
+
+def flatten_chunk(task):
+    import otel_server_python_http_tcp_snowflake_fastapi as receiver
+    from google.protobuf import json_format
+
+    path, offset, fmt, signal, records, done = task
+    request_classes = {
+        "traces": receiver.trace_service_pb2.ExportTraceServiceRequest,
+        "metrics": receiver.metrics_service_pb2.ExportMetricsServiceRequest,
+        "logs": receiver.logs_service_pb2.ExportLogsServiceRequest,
+    }
+    rows = {
+        "traces": receiver.TraceRows(),
+        "metrics": receiver.MetricRows(),
+        "logs": receiver.LogRows(),
+    }
+    log_index = None
+    if receiver.ENABLE_LOG_INDEX:
+        # The same postings the receiver writes, so backfilled logs are searchable
+        log_index = receiver.LogIndexer(receiver.LOG_INDEX_ATTRIBUTES, receiver.LOG_INDEX_BUCKET_SECONDS)
+        rows["log_tokens"] = receiver.LogTokenRows()
+    for record in records:
+        record_signal = signal
+        if fmt == "json":
+            data = json.loads(record)
+            if "resourceSpans" in data:
+                record_signal = "traces"
+            elif "resourceMetrics" in data:
+                record_signal = "metrics"
+            elif "resourceLogs" in data:
+                record_signal = "logs"
+            if record_signal is None:
+                continue
+            request = json_format.ParseDict(
+                hex_ids_to_base64(data), request_classes[record_signal](), ignore_unknown_fields=True
+            )
+        else:
+            request = request_classes[record_signal]()
+            request.ParseFromString(record)
+        flatten_request(receiver, record_signal, request, rows[record_signal], log_index, rows.get("log_tokens"))
+    return path, offset, done, len(records), {signal: r for signal, r in rows.items() if len(r)}
+
+
+def flatten_request(receiver, signal, request, rows, log_index=None, token_rows=None):
+    if signal == "traces":
+        for resource_span in request.resource_spans:
+            for scope_span in resource_span.scope_spans:
+                for span in scope_span.spans:
+                    receiver.append_span_row(rows, span)
+    elif signal == "metrics":
+        for resource_metric in request.resource_metrics:
+            for scope_metric in resource_metric.scope_metrics:
+                for metric in scope_metric.metrics:
+                    value, metric_attributes = receiver.metric_value_and_attributes(metric)
+                    if value is not None:
+                        # Keep the recorded time; the live receiver stamps metrics on arrival
+                        receiver.append_metric_row(
+                            rows, metric.name or "unknown", value, receiver.attributes_to_dict(metric_attributes),
+                            data_point_time(metric),
+                        )
+    else:
+        for resource_log in request.resource_logs:
+            for scope_log in resource_log.scope_logs:
+                for log in scope_log.log_records:
+                    timestamp, message = receiver.append_log_row(rows, log)
+                    if log_index is not None:
+                        log_index.index(token_rows, timestamp, message, log.attributes)
+
+
+def data_point_time(metric):
+    points = metric.gauge.data_points if metric.HasField("gauge") else metric.sum.data_points
+    return points[0].time_unix_nano if points else None
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.rows_loaded = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.files = state.get("files", {})
+            self.rows_loaded = state.get("rows_loaded", 0)
+            logger.info(f"Resuming from {path}: {self.rows_loaded} rows already loaded")
+
+    def save(self):
+        if not self.path:
+            return
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"files": self.files, "rows_loaded": self.rows_loaded}, f)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class BulkLoader:
+    def __init__(self, conn, method, insert_sql):
+        self.conn = conn
+        self.method = method
+        self.insert_sql = insert_sql
+        self.sequence = 0
+
+    def load(self, signal, chunks):
+        rows = materialize_batch(chunks)
+        if self.method == "copy":
+            self.copy(signal, rows)
+        else:
+            self.insert(signal, rows)
+        return len(rows)
+
+    def insert(self, signal, rows):
+        cursor = self.conn.cursor()
+        try:
+            cursor.executemany(self.insert_sql[signal], rows)
+        finally:
+            cursor.close()
+
+    def copy(self, signal, rows):
+        table, columns = BULK_TABLES[signal]
+        self.sequence += 1
+        name = f"backfill-{os.getpid()}-{self.sequence}.csv.gz"
+        path = os.path.join(tempfile.gettempdir(), name)
+        with gzip.open(path, "wt", newline="", compresslevel=1) as f:
+            csv.writer(f, quoting=csv.QUOTE_ALL).writerows(rows)
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(f"PUT 'file://{path}' @%{table}/backfill/ AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
+            cursor.execute(
+                f"COPY INTO {table} ({columns}) FROM @%{table}/backfill/ FILES=('{name}') "
+                f"FILE_FORMAT=(TYPE=CSV FIELD_OPTIONALLY_ENCLOSED_BY='\"' COMPRESSION=GZIP) PURGE=TRUE"
+            )
+        finally:
+            cursor.close()
+            os.remove(path)
+
+
+def run(args):
+    import otel_server_python_http_tcp_snowflake_fastapi as receiver
+
+    init_worker()
+    checkpoint = Checkpoint(args.checkpoint)
+    connect = receiver.connect_to_snowflake_spcs if os.getenv("SPCS") == "True" else receiver.connect_to_snowflake
+    insert_sql = {
+        "traces": receiver.TRACES_INSERT_SQL,
+        "metrics": receiver.METRICS_INSERT_SQL,
+        "logs": receiver.LOGS_INSERT_SQL,
+        "log_tokens": receiver.LOG_TOKENS_INSERT_SQL,
+    }
+    loader = BulkLoader(connect(), args.method, insert_sql)
+    files = list(list_files(args.paths))
+    logger.info(f"Backfilling {len(files)} files with {args.workers} workers")
+
+    started = last_report = time.monotonic()
+    rows_loaded = records_read = 0
+    pending = {}
+    pending_rows = 0
+    # file -> (offset, done) reached by flattened chunks that are not loaded yet
+    pending_offsets = {}
+
+    def flush():
+        nonlocal rows_loaded, pending_rows
+        for signal, chunks in pending.items():
+            loaded = loader.load(signal, chunks)
+            rows_loaded += loaded
+            checkpoint.rows_loaded += loaded
+        pending.clear()
+        pending_rows = 0
+        for path, (offset, done) in pending_offsets.items():
+            checkpoint.files[path] = {"offset": offset, "done": done}
+        pending_offsets.clear()
+        checkpoint.save()
+
+    def flattened(pool):
+        # Executor.map would read every chunk up front; keep at most max_chunks_in_flight
+        # submitted and take their results in submission order, so checkpoint offsets only
+        # move forward and memory stays bounded however large the dumps are
+        futures = deque()
+        for task in iter_chunks(files, checkpoint, args.chunk_records, args.signal):
+            futures.append(pool.submit(flatten_chunk, task))
+            if len(futures) >= max_chunks_in_flight:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+    max_chunks_in_flight = args.chunks_in_flight or 2 * args.workers
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+        for path, offset, done, records, rows in flattened(pool):
+            records_read += records
+            for signal, chunk in rows.items():
+                pending.setdefault(signal, []).append(chunk)
+                pending_rows += len(chunk)
+            pending_offsets[path] = (offset, done)
+            if pending_rows >= args.load_rows:
+                flush()
+            now = time.monotonic()
+            if now - last_report >= args.progress_interval:
+                last_report = now
+                logger.info(
+                    f"{records_read} records read, {rows_loaded} rows loaded, "
+                    f"{rows_loaded / (now - started):.0f} rows/sec"
+                )
+    flush()
+    elapsed = time.monotonic() - started
+    logger.info(
+        f"Backfill finished: {len(files)} files, {records_read} records, {rows_loaded} rows in "
+        f"{elapsed:.1f}s ({rows_loaded / elapsed if elapsed else 0:.0f} rows/sec)"
+    )
+
+
+def _parse_args():
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    cli_parser = argparse.ArgumentParser(description="Load OTLP file exporter dumps into Snowflake.")
+    cli_parser.add_argument("paths", nargs="+", help="Dump files or directories (.json/.jsonl/.binpb, optionally .gz).")
+    cli_parser.add_argument("--signal", choices=("traces", "metrics", "logs"),
+                            help="Signal of protobuf dumps whose file names do not mention it.")
+    cli_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Parser processes.")
+    cli_parser.add_argument("--chunk-records", type=int, default=200,
+                            help="Export requests handed to a worker at a time.")
+    cli_parser.add_argument("--chunks-in-flight", type=int, default=0,
+                            help="Chunks read ahead of the loader (default: twice the workers).")
+    cli_parser.add_argument("--load-rows", type=int, default=200000, help="Rows per bulk load and checkpoint.")
+    cli_parser.add_argument("--method", choices=("copy", "insert"), default="copy",
+                            help="PUT + COPY INTO through the table stage, or multi-row INSERT.")
+    cli_parser.add_argument("--checkpoint", help="Checkpoint file used to resume an interrupted backfill.")
+    cli_parser.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress lines.")
+    return cli_parser.parse_args()
+
+
+if __name__ == "__main__":
+    run(_parse_args())
@@ -0,0 +1,619 @@
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from threading import Thread
+
+from compact_rows import materialize_batch
+
+logger = logging.getLogger(__name__)
+
+
+class WriterBusy(Exception):
+    """Raised when a writer's queue cannot take more rows without blocking the caller."""
+
+
+def multi_row_statement(insert_sql, rows):
+    # One INSERT with a VALUES tuple per row, as executemany builds it, for execute_async
+    head, values = insert_sql.rsplit("VALUES", 1)
+    statement = f"{head}VALUES " + ", ".join([values.strip()] * len(rows))
+    return statement, [value for row in rows for value in row]
+
+
+def table_name(insert_sql):
+    match = re.search(r"INSERT\s+INTO\s+(\S+)", insert_sql, re.IGNORECASE)
+    return match.group(1) if match else insert_sql
+
+
+class InFlightStatement:
+    def __init__(self, query_id, insert_sql, chunks, fingerprints, attempt=0):
+        self.query_id = query_id
+        self.insert_sql = insert_sql
+        # Kept until the statement succeeded so a failed one can be retried
+        self.chunks = chunks
+        self.rows = sum(len(chunk) for chunk in chunks)
+        self.fingerprints = fingerprints
+        self.attempt = attempt
+        self.submitted_at = time.monotonic()
+
+
+class FailedBatch:
+    def __init__(self, batch, fingerprints, attempt, due_at):
+        self.batch = batch
+        self.fingerprints = fingerprints
+        self.attempt = attempt
+        self.due_at = due_at
+        self.rows = sum(len(chunk) for chunks in batch.values() for chunk in chunks)
+
+
+class BatchWriter:
+    """
+    Queues rows per INSERT statement and writes them in multi-row batches with executemany
+    from a small pool of writer threads, each holding its own Snowflake connection.
+
+    A batch is flushed once batch_size rows are queued or the oldest queued rows are
+    flush_interval seconds old. submit() never blocks: once max_queued_rows are waiting it
+    raises WriterBusy so callers can push back instead of stalling a request thread.
+
+    With an AdaptiveBatchController the batch size, flush interval and number of active
+    connections are retuned after every batch; threads beyond the active count stay idle
+    and do not hold a connection until they are first needed.
+
+    Queued rows are CompactRows buffers whose estimated size is reserved from the shared
+    MemoryBudget. A buffer that does not fit is spilled to the SpillStore when one is
+    configured and re-queued once the writer has room again, otherwise it is refused with
+    WriterBusy.
+
+    Rows are acknowledged to the client once queued, so an INSERT that fails is not dropped:
+    its rows are retried with exponential backoff up to max_attempts times and then spilled
+    to the SpillStore, from which they are written once Snowflake accepts them again. Only
+    rows that cannot be spilled (no SpillStore, or it is full) are lost, counted in
+    rows_lost.
+
+    With a RequestDeduplicator each submitted request is kept whole within one batch and a
+    batch written synchronously is written in a single transaction, so a request's rows are
+    committed atomically. The request fingerprints are marked committed once their rows are
+    written or spilled; a failed batch is retried with its fingerprints still in flight, so
+    duplicates that arrive meanwhile are acknowledged without being queued again.
+
+    With max_in_flight above 1 each connection submits its statements with execute_async
+    (one multi-row INSERT per table and batch) and keeps taking batches while up to
+    max_in_flight of them run, polling the query ids for completion; at most
+    max_in_flight_per_table statements run per table across all connections. The tables
+    are append-only and every row carries its own timestamp, so statements may complete in
+    any order. What stays ordered is per statement: rows are counted as written and request
+    fingerprints marked committed only after their query id succeeded, and a writer thread
+    closes its connection only after its statements finished. Every request's rows go to
+    one table and thus one statement, which commits atomically without BEGIN/COMMIT.
+    """
+
+    def __init__(self, name, connect, batch_size=1000, flush_interval=1.0, max_queued_rows=100000,
+                 connections=1, controller=None, budget=None, spill=None, dedup=None,
+                 max_in_flight=1, max_in_flight_per_table=0, poll_interval=0.1,
+                 max_attempts=5, retry_backoff=1.0, max_retry_backoff=30.0):
+        self.name = name
+        self.connect = connect
+        self.controller = controller
+        self.budget = budget
+        self.spill = spill
+        self.dedup = dedup
+        if controller is not None:
+            batch_size, flush_interval = controller.batch_size, controller.flush_interval
+            connections = controller.max_connections
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queued_rows = max_queued_rows
+        self.connections = connections
+        self.active_connections = controller.connections if controller is not None else connections
+        self.rows_submitted = 0
+        self.cond = threading.Condition()
+        # (insert_sql, rows, enqueued_at, fingerprint)
+        self.pending = deque()
+        self.queued_rows = 0
+        self.stopping = False
+        # Set with stopping, so backoff waits end as soon as a drain starts
+        self.stop_event = threading.Event()
+        # Set once a drain ran out of time: nothing more is handed to the writer threads
+        self.closed = False
+        self.threads = []
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.rows_spilled = 0
+        self.batches_written = 0
+        self.last_batch_seconds = 0.0
+        # Exponentially weighted moving average of batch insert latency, as of latency_updated_at
+        self.latency_ewma = 0.0
+        self.latency_updated_at = time.monotonic()
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_table = max_in_flight_per_table
+        self.poll_interval = poll_interval
+        # insert_sql -> statements running on any connection, query_id -> insert_sql
+        self.table_in_flight = {}
+        self.statements_in_flight = {}
+        self.statements_failed = 0
+        # Outcome per query id of the most recent asynchronous statements
+        self.recent_statements = deque(maxlen=50)
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        # FailedBatch waiting for their next attempt; their rows hold no budget reservation
+        self.retries = []
+        self.retry_rows = 0
+        self.rows_retried = 0
+        self.rows_lost = 0
+
+    def start(self):
+        for i in range(self.connections):
+            thread = Thread(target=self.run, args=(i,), name=f"writer-{self.name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(
+            f"Writer '{self.name}' started with {self.active_connections} of {self.connections} connection(s), "
+            f"batch size {self.batch_size}, flush interval {self.flush_interval}s"
+        )
+        return self
+
+    def submit(self, insert_sql, rows, fingerprint=None):
+        reservation = self.offer(insert_sql, rows, fingerprint)
+        if reservation is not None:
+            self.commit_spill(reservation, rows)
+
+    def offer(self, insert_sql, rows, fingerprint=None):
+        # First half of submit(): queues the rows or, when the writer is busy, reserves room
+        # for them in the SpillStore. Returns None once queued, otherwise the reservation to
+        # pass to commit_spill(); either way cancel() takes the rows back. Raises WriterBusy
+        # when there is no room for them.
+        if not rows:
+            return None
+        try:
+            self.enqueue(insert_sql, rows, fingerprint)
+            return None
+        except WriterBusy:
+            reservation = self.spill.reserve(insert_sql, rows) if self.spill is not None else None
+            if reservation is None:
+                raise
+            return reservation
+
+    def commit_spill(self, reservation, rows):
+        self.spill.commit(reservation)
+        self.rows_spilled += len(rows)
+
+    def cancel(self, rows, reservation=None):
+        # Takes back offered rows. Queued rows can only be taken back while the caller has
+        # held self.cond since offer(), so no writer thread took them in between.
+        if reservation is not None:
+            self.spill.cancel(reservation)
+            return
+        with self.cond:
+            for index, entry in enumerate(self.pending):
+                if entry[1] is rows:
+                    del self.pending[index]
+                    self.queued_rows -= len(rows)
+                    self.rows_submitted -= len(rows)
+                    if self.budget is not None:
+                        self.budget.release(rows.signal, rows.nbytes)
+                    return
+
+    def enqueue(self, insert_sql, rows, fingerprint=None):
+        with self.cond:
+            if self.queued_rows + len(rows) > self.max_queued_rows:
+                raise WriterBusy(f"Writer '{self.name}' has {self.queued_rows} rows queued")
+            if self.budget is not None and not self.budget.try_reserve(rows.signal, rows.nbytes):
+                raise WriterBusy(f"Memory budget for {rows.signal} is exhausted")
+            self.pending.append((insert_sql, rows, time.monotonic(), fingerprint))
+            self.queued_rows += len(rows)
+            self.rows_submitted += len(rows)
+            if self.queued_rows >= self.batch_size:
+                self.cond.notify()
+
+    def take_batch(self, index=0, timeout=None):
+        # Returns an empty batch if nothing is due within timeout, None once stopped and drained
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                if self.closed:
+                    return None
+                if index >= self.active_connections:
+                    if self.stopping:
+                        # Idle threads hold no connection; the active ones drain the queue
+                        return None
+                    wait = self.flush_interval
+                elif self.queued_rows >= self.batch_size or (self.pending and self.stopping):
+                    break
+                elif self.pending:
+                    age = time.monotonic() - self.pending[0][2]
+                    if age >= self.flush_interval:
+                        break
+                    wait = self.flush_interval - age
+                elif self.stopping and not self.retries:
+                    return None
+                else:
+                    wait = self.flush_interval
+                if self.retries and index < self.active_connections:
+                    # Return to the caller when a failed batch is due for its next attempt
+                    due = min(retry.due_at for retry in self.retries) - time.monotonic()
+                    if due <= 0:
+                        return {}, {}
+                    wait = min(wait, due)
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        return {}, {}
+                self.cond.wait(wait)
+            batch = {}
+            fingerprints = {}
+            taken = 0
+            while self.pending and taken < self.batch_size:
+                insert_sql, rows, enqueued_at, fingerprint = self.pending[0]
+                room = self.batch_size - taken
+                if self.dedup is not None and len(rows) > room:
+                    # Requests are committed whole: start the next batch with this one
+                    if taken:
+                        break
+                    room = len(rows)
+                self.pending.popleft()
+                if len(rows) > room:
+                    # Split large requests so every batch matches the current batch size
+                    head, rest = rows.slice(0, room), rows.slice(room)
+                    # Keep the byte accounting exact across the split
+                    head.nbytes = rows.nbytes - rest.nbytes
+                    self.pending.appendleft((insert_sql, rest, enqueued_at, fingerprint))
+                    rows = head
+                batch.setdefault(insert_sql, []).append(rows)
+                if fingerprint is not None:
+                    fingerprints.setdefault(insert_sql, []).append(fingerprint)
+                taken += len(rows)
+            self.queued_rows -= taken
+            return batch, fingerprints
+
+    def run(self, index=0):
+        conn = None
+        if index < self.active_connections:
+            # Log in while the receiver starts up rather than when the first batch is due
+            conn = self.connect_with_retry()
+        in_flight = []
+        while True:
+            try:
+                self.restore_spilled()
+            except Exception as e:
+                # A spill file that cannot be read must not end the writer thread
+                logger.error(f"Writer '{self.name}' could not restore a spilled buffer: {e}")
+            if in_flight:
+                self.collect(conn, in_flight)
+                if len(in_flight) >= self.max_in_flight:
+                    time.sleep(self.poll_interval)
+                    continue
+            retry = self.take_retry(index)
+            if retry is not None:
+                batch, fingerprints, attempt = retry.batch, retry.fingerprints, retry.attempt
+            else:
+                # While statements run, come back to poll them at least every poll_interval
+                taken = self.take_batch(index, self.poll_interval if in_flight else None)
+                if taken is None:
+                    break
+                batch, fingerprints = taken
+                attempt = 0
+                if not batch:
+                    continue
+            if conn is None:
+                conn = self.connect_with_retry()
+                if conn is None:
+                    # Stopping while Snowflake is unreachable: keep the rows for the next start
+                    if not attempt:
+                        self.release(batch)
+                    self.persist(batch, fingerprints)
+                    break
+            if self.max_in_flight > 1:
+                self.submit_async(conn, batch, fingerprints, in_flight, attempt)
+            else:
+                self.write(conn, batch, fingerprints, attempt)
+        while in_flight:
+            self.collect(conn, in_flight)
+            if in_flight:
+                time.sleep(self.poll_interval)
+        if conn is not None:
+            conn.close()
+
+    def restore_spilled(self):
+        # Spilled buffers stay on disk during shutdown and are loaded by the next start
+        if self.spill is None or self.stopping or not self.spill.has_pending() or self.fill_ratio() >= 0.5:
+            return
+        restored = self.spill.restore()
+        if restored is None:
+            return
+        insert_sql, rows = restored
+        try:
+            self.enqueue(insert_sql, rows)
+            self.rows_spilled -= len(rows)
+        except WriterBusy:
+            self.spill.spill(insert_sql, rows)
+
+    def connect_with_retry(self):
+        # While stopping, one attempt is still made so queued rows can be written
+        delay = 1.0
+        while True:
+            try:
+                return self.connect()
+            except Exception as e:
+                logger.error(f"Writer '{self.name}' could not connect to Snowflake: {e}")
+                if self.stop_event.wait(delay):
+                    return None
+                delay = min(delay * 2, 30.0)
+
+    def write(self, conn, batch, fingerprints=None, attempt=0):
+        started = time.monotonic()
+        written = 0
+        failed = {}
+        error = None
+        cursor = conn.cursor()
+        try:
+            if self.dedup is not None:
+                try:
+                    written = self.write_transaction(cursor, batch, fingerprints)
+                except Exception as e:
+                    failed, error = batch, e
+            else:
+                for insert_sql, chunks in batch.items():
+                    rows = materialize_batch(chunks)
+                    try:
+                        cursor.executemany(insert_sql, rows)
+                        written += len(rows)
+                    except Exception as e:
+                        failed[insert_sql], error = chunks, e
+        finally:
+            cursor.close()
+            # Retried batches gave up their reservation when they first failed
+            if not attempt:
+                self.release(batch)
+        failed_rows = sum(len(chunk) for chunks in failed.values() for chunk in chunks)
+        if failed:
+            failed_fingerprints = {insert_sql: (fingerprints or {}).get(insert_sql, []) for insert_sql in failed}
+            self.retry_later(failed, failed_fingerprints, attempt + 1, error)
+        self.record(written, failed_rows, time.monotonic() - started)
+
+    def release(self, batch):
+        if self.budget is not None:
+            for chunks in batch.values():
+                for chunk in chunks:
+                    self.budget.release(chunk.signal, chunk.nbytes)
+
+    def retry_later(self, batch, fingerprints, attempt, error):
+        # attempt: failed attempts so far. The batch must no longer hold a budget reservation.
+        retry = FailedBatch(batch, fingerprints, attempt, 0.0)
+        with self.cond:
+            if (not self.closed and attempt < self.max_attempts
+                    and self.retry_rows + retry.rows <= self.max_queued_rows):
+                delay = min(self.retry_backoff * 2 ** (attempt - 1), self.max_retry_backoff)
+                # Jitter keeps the writers of several tenants and replicas from retrying in step
+                retry.due_at = time.monotonic() + random.uniform(delay / 2, delay)
+                self.retries.append(retry)
+                self.retry_rows += retry.rows
+                self.cond.notify_all()
+                logger.warning(
+                    f"Writer '{self.name}' failed to insert {retry.rows} rows (attempt {attempt} of "
+                    f"{self.max_attempts}), retrying in {delay:.1f}s: {error}"
+                )
+                return
+        logger.error(f"Writer '{self.name}' gave up on {retry.rows} rows after {attempt} attempt(s): {error}")
+        self.persist(batch, fingerprints)
+
+    def take_retry(self, index=0):
+        with self.cond:
+            if self.closed or index >= self.active_connections:
+                return None
+            now = time.monotonic()
+            for retry in self.retries:
+                if retry.due_at <= now:
+                    self.retries.remove(retry)
+                    self.retry_rows -= retry.rows
+                    self.rows_retried += retry.rows
+                    return retry
+            return None
+
+    def persist(self, batch, fingerprints=None):
+        # Rows that cannot be written now go to the SpillStore, from which the writer (or the
+        # next start) writes them later. Returns (rows persisted, rows lost).
+        persisted = lost = 0
+        for insert_sql, chunks in batch.items():
+            for rows in chunks:
+                if self.spill is not None and self.spill.spill(insert_sql, rows):
+                    persisted += len(rows)
+                else:
+                    lost += len(rows)
+        if self.dedup is not None and not lost:
+            # Stored durably, so retries of these requests are still duplicates
+            for table_fingerprints in (fingerprints or {}).values():
+                for fingerprint in table_fingerprints:
+                    self.dedup.committed(fingerprint)
+        with self.cond:
+            self.rows_spilled += persisted
+            self.rows_lost += lost
+        if lost:
+            logger.error(
+                f"Writer '{self.name}' lost {lost} rows "
+                f"({'spill store full' if self.spill is not None else 'no SPILL_DIR configured'})"
+            )
+        return persisted, lost
+
+    def record(self, written, failed, seconds):
+        with self.cond:
+            self.rows_written += written
+            self.rows_failed += failed
+            self.batches_written += 1
+            self.last_batch_seconds = seconds
+            self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * self.last_batch_seconds
+            self.latency_updated_at = time.monotonic()
+            if self.controller is not None:
+                self.batch_size, self.flush_interval, self.active_connections = self.controller.observe(
+                    written + failed, self.last_batch_seconds, failed, self.queued_rows, self.rows_submitted
+                )
+                self.cond.notify_all()
+
+    def write_transaction(self, cursor, batch, fingerprints):
+        # Raises after rolling back, so the whole batch is retried
+        fingerprints = [fingerprint for table in (fingerprints or {}).values() for fingerprint in table]
+        total = 0
+        try:
+            cursor.execute("BEGIN")
+            for insert_sql, chunks in batch.items():
+                rows = materialize_batch(chunks)
+                cursor.executemany(insert_sql, rows)
+                total += len(rows)
+            cursor.execute("COMMIT")
+        except Exception:
+            try:
+                cursor.execute("ROLLBACK")
+            except Exception:
+                pass
+            raise
+        for fingerprint in fingerprints:
+            self.dedup.committed(fingerprint)
+        return total
+
+    def submit_async(self, conn, batch, fingerprints, in_flight, attempt=0):
+        for insert_sql, chunks in batch.items():
+            self.wait_for_capacity(conn, insert_sql, in_flight)
+            rows = materialize_batch(chunks)
+            statement, params = multi_row_statement(insert_sql, rows)
+            request_fingerprints = list((fingerprints or {}).get(insert_sql, ()))
+            cursor = conn.cursor()
+            try:
+                cursor.execute_async(statement, params)
+                query_id = cursor.sfqid
+            except Exception as e:
+                self.finish(InFlightStatement(None, insert_sql, chunks, request_fingerprints, attempt), e)
+                continue
+            finally:
+                cursor.close()
+                # The statement text now holds the rows, so their buffers no longer count
+                if not attempt:
+                    self.release({insert_sql: chunks})
+            with self.cond:
+                self.table_in_flight[insert_sql] = self.table_in_flight.get(insert_sql, 0) + 1
+                self.statements_in_flight[query_id] = insert_sql
+            in_flight.append(InFlightStatement(query_id, insert_sql, chunks, request_fingerprints, attempt))
+
+    def wait_for_capacity(self, conn, insert_sql, in_flight):
+        while True:
+            if len(in_flight) < self.max_in_flight:
+                with self.cond:
+                    running = self.table_in_flight.get(insert_sql, 0)
+                if not self.max_in_flight_per_table or running < self.max_in_flight_per_table:
+                    return
+            time.sleep(self.poll_interval)
+            self.collect(conn, in_flight)
+
+    def collect(self, conn, in_flight):
+        for statement in list(in_flight):
+            error = None
+            try:
+                if conn.is_still_running(conn.get_query_status(statement.query_id)):
+                    continue
+                conn.get_query_status_throw_if_error(statement.query_id)
+            except Exception as e:
+                error = e
+            in_flight.remove(statement)
+            with self.cond:
+                self.table_in_flight[statement.insert_sql] -= 1
+                self.statements_in_flight.pop(statement.query_id, None)
+            self.finish(statement, error)
+
+    def finish(self, statement, error):
+        seconds = time.monotonic() - statement.submitted_at if statement.query_id is not None else 0.0
+        if error is None:
+            written, failed = statement.rows, 0
+        else:
+            written, failed = 0, statement.rows
+        if self.dedup is not None and error is None:
+            for fingerprint in statement.fingerprints:
+                self.dedup.committed(fingerprint)
+        with self.cond:
+            if error is not None:
+                self.statements_failed += 1
+            self.recent_statements.append({
+                "query_id": statement.query_id,
+                "table": table_name(statement.insert_sql),
+                "rows": statement.rows,
+                "seconds": round(seconds, 3),
+                "error": str(error) if error is not None else None,
+            })
+        if error is not None:
+            self.retry_later(
+                {statement.insert_sql: statement.chunks}, {statement.insert_sql: statement.fingerprints},
+                statement.attempt + 1, f"statement {statement.query_id}: {error}",
+            )
+        self.record(written, failed, seconds)
+
+    def stop(self, timeout=None):
+        # Writer threads drain whatever is still queued before they exit
+        self.begin_stop()
+        return self.join(timeout)
+
+    def begin_stop(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        self.stop_event.set()
+
+    def join(self, timeout=None):
+        # True once every writer thread has exited
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return not any(thread.is_alive() for thread in self.threads)
+
+    def persist_pending(self):
+        # After the drain deadline: rows still queued or waiting for a retry go to the
+        # SpillStore, from which the next start writes them. Returns (rows persisted, rows lost).
+        with self.cond:
+            self.closed = True
+            pending = list(self.pending)
+            self.pending.clear()
+            self.queued_rows = 0
+            retries, self.retries = self.retries, []
+            self.retry_rows = 0
+            self.cond.notify_all()
+        persisted = lost = 0
+        for insert_sql, rows, _, fingerprint in pending:
+            batch = {insert_sql: [rows]}
+            self.release(batch)
+            batch_persisted, batch_lost = self.persist(batch, {insert_sql: [fingerprint]} if fingerprint else None)
+            persisted += batch_persisted
+            lost += batch_lost
+        for retry in retries:
+            batch_persisted, batch_lost = self.persist(retry.batch, retry.fingerprints)
+            persisted += batch_persisted
+            lost += batch_lost
+        return persisted, lost
+
+    def fill_ratio(self):
+        queued = self.queued_rows + self.retry_rows
+        ratio = queued / self.max_queued_rows if self.max_queued_rows else 0.0
+        if self.budget is not None:
+            ratio = max(ratio, self.budget.utilization())
+        return ratio
+
+    def stats(self):
+        return {
+            "queued_rows": self.queued_rows,
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "rows_spilled": self.rows_spilled,
+            "rows_retried": self.rows_retried,
+            "retry_rows": self.retry_rows,
+            "rows_lost": self.rows_lost,
+            "batches_written": self.batches_written,
+            "last_batch_seconds": self.last_batch_seconds,
+            "latency_ewma": self.latency_ewma,
+            "statements_in_flight": len(self.statements_in_flight),
+            "statements_failed": self.statements_failed,
+            "recent_statements": list(self.recent_statements)[-10:],
+            "operating_point": self.controller.state() if self.controller is not None else {
+                "batch_size": self.batch_size,
+                "flush_interval": self.flush_interval,
+                "connections": self.active_connections,
+            },
+        }
+
@@ -0,0 +1,312 @@
+# Benchmarks for the receiver.
+#
+# To run this on the command line, enter:
+#   python3 benchmark.py startup --runs 5
+#   python3 benchmark.py codec --spans 100000 --distinct 50
+#   python3 benchmark.py encoding --spans 20000
+#
+# startup: import time of the receiver module (and the slowest imports it pulls in), time
+# until the first OTLP/HTTP request is accepted and time until /readyz reports ready. The
+# receiver is started as a subprocess with the current environment, so set SPCS and the
+# SNOWFLAKE_* variables as in production to include the Snowflake login.
+#
+# codec: attribute decoding and JSON encoding per span, the previous HasField chain with
+# json.dumps against attribute_codec with and without its cache, over synthetic spans that
+# repeat a given number of distinct attribute sets.
+#
+# encoding: OTLP/HTTP request bodies to trace rows per encoding, protobuf against OTLP/JSON
+# through otlp_json's direct decoder and through json_format into a protobuf message.
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RECEIVER_MODULE = "otel_server_python_http_tcp_snowflake_fastapi"
+
+
+def summarize(name, values, unit="s"):
+    if not values:
+        print(f"{name:<34} n/a")
+        return
+    print(
+        f"{name:<34} median {statistics.median(values):8.3f}{unit}   "
+        f"min {min(values):8.3f}{unit}   max {max(values):8.3f}{unit}"
+    )
+
+
+def measure_import(env):
+    code = f"import time; t = time.perf_counter(); import {RECEIVER_MODULE}; print(time.perf_counter() - t)"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=HERE, env=env, capture_output=True, text=True,
+        check=True,
+    )
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    imports = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if match and len(match.group(3)) == 1:
+            imports.append((int(match.group(2)), match.group(4)))
+    return float(result.stdout.strip().splitlines()[-1]), sorted(imports, reverse=True)
+
+
+def request(port, method, path, body=None, headers=None, timeout=1.0):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def measure_startup(env, port, timeout):
+    started = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, f"{RECEIVER_MODULE}.py"], cwd=HERE, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    first_accepted = ready = None
+    try:
+        while time.monotonic() - started < timeout and ready is None:
+            try:
+                if first_accepted is None:
+                    # An empty body is a valid, empty ExportLogsServiceRequest
+                    status = request(port, "POST", "/v1/logs", b"", {"Content-Type": "application/x-protobuf"})
+                    if status == 200:
+                        first_accepted = time.monotonic() - started
+                if request(port, "GET", "/readyz") == 200:
+                    ready = time.monotonic() - started
+            except OSError:
+                pass
+            time.sleep(0.02)
+    finally:
+        process.terminate()
+        process.wait(10)
+    return first_accepted, ready
+
+
+def startup(args):
+    env = dict(os.environ, PYTHONPATH=HERE)
+    import_times, first_accepted, ready = [], [], []
+    slowest = []
+    for run in range(args.runs):
+        seconds, slowest = measure_import(env)
+        import_times.append(seconds)
+        accepted_after, ready_after = measure_startup(env, args.port, args.timeout)
+        if accepted_after is not None:
+            first_accepted.append(accepted_after)
+        if ready_after is not None:
+            ready.append(ready_after)
+        print(f"run {run + 1}: import {seconds:.3f}s, first accepted {accepted_after}, ready {ready_after}")
+    print()
+    summarize("import receiver module", import_times)
+    summarize("time to first accepted request", first_accepted)
+    summarize("time to ready", ready)
+    print("\nslowest top-level imports (cumulative):")
+    for micros, name in slowest[:args.top]:
+        print(f"  {micros / 1e3:9.1f}ms  {name}")
+
+
+def baseline_any_value(any_value):
+    # parse_any_value as it was before attribute_codec
+    if any_value.HasField("string_value"):
+        return any_value.string_value
+    elif any_value.HasField("bool_value"):
+        return any_value.bool_value
+    elif any_value.HasField("int_value"):
+        return any_value.int_value
+    elif any_value.HasField("double_value"):
+        return any_value.double_value
+    elif any_value.HasField("array_value"):
+        return [baseline_any_value(val) for val in any_value.array_value.values]
+    elif any_value.HasField("kvlist_value"):
+        return {kv.key: baseline_any_value(kv.value) for kv in any_value.kvlist_value.values}
+    elif any_value.HasField("bytes_value"):
+        return any_value.bytes_value
+    else:
+        return None
+
+
+def baseline_encode(attributes):
+    attributes_dict = {kv.key: baseline_any_value(kv.value) for kv in attributes}
+    return json.dumps(attributes_dict) if attributes_dict else "{}"
+
+
+def synthetic_spans(count, distinct):
+    from opentelemetry.proto.trace.v1 import trace_pb2
+    templates = []
+    for i in range(distinct):
+        span = trace_pb2.Span(name=f"GET /api/{i}")
+        for key, value in (
+            ("http.method", "GET"), ("http.route", f"/api/{i}"), ("net.peer.name", f"backend-{i % 7}"),
+            ("deployment.environment", "production"), ("k8s.pod.name", f"api-{i % 13}"),
+        ):
+            span.attributes.add(key=key, value={"string_value": value})
+        span.attributes.add(key="http.status_code", value={"int_value": 200 + i % 5})
+        span.attributes.add(key="sampled", value={"bool_value": True})
+        span.attributes.add(key="http.duration", value={"double_value": 0.25})
+        tags = span.attributes.add(key="tags").value.array_value
+        tags.values.add(string_value="web")
+        tags.values.add(int_value=i)
+        templates.append(span)
+    return [templates[i % distinct] for i in range(count)]
+
+
+def codec(args):
+    sys.path.insert(0, HERE)
+    from attribute_codec import AttributeCodec, orjson
+    spans = synthetic_spans(args.spans, args.distinct)
+    uncached, cached = AttributeCodec(0), AttributeCodec(args.cache_size)
+    candidates = (
+        ("HasField chain + json.dumps", baseline_encode),
+        (f"WhichOneof + {'orjson' if orjson is not None else 'json'}", uncached.encode),
+        ("WhichOneof + LRU cache", cached.encode),
+    )
+    if baseline_encode(spans[0].attributes) != json.dumps(json.loads(uncached.encode(spans[0].attributes))):
+        print("warning: encoders disagree on the first span")
+    results = {}
+    for name, encode in candidates:
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            for span in spans:
+                encode(span.attributes)
+            timings.append((time.perf_counter() - started) / len(spans) * 1e6)
+        results[name] = statistics.median(timings)
+        summarize(name, timings, "us")
+    baseline = results[candidates[0][0]]
+    print()
+    for name, micros in results.items():
+        print(f"{name:<34} {baseline / micros:6.2f}x")
+    print(f"\ncache: {cached.stats()}")
+
+
+def trace_request(spans):
+    from opentelemetry.proto.collector.trace.v1 import trace_service_pb2
+    request = trace_service_pb2.ExportTraceServiceRequest()
+    resource_spans = request.resource_spans.add()
+    resource_spans.resource.attributes.add(key="service.name", value={"string_value": "benchmark"})
+    scope_spans = resource_spans.scope_spans.add()
+    for i, template in enumerate(spans):
+        span = scope_spans.spans.add()
+        span.CopyFrom(template)
+        span.trace_id = i.to_bytes(16, "big")
+        span.span_id = i.to_bytes(8, "big")
+        span.start_time_unix_nano = 1700000000000000000 + i
+        span.end_time_unix_nano = span.start_time_unix_nano + 250000
+    return request
+
+
+def ids_to_hex(value):
+    # protobuf's JSON mapping writes bytes as base64, OTLP/JSON writes ids as hex
+    from otlp_json import ID_KEYS
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in ID_KEYS:
+                value[key] = base64.b64decode(item).hex()
+            else:
+                ids_to_hex(item)
+    elif isinstance(value, list):
+        for item in value:
+            ids_to_hex(item)
+    return value
+
+
+def encoding(args):
+    sys.path.insert(0, HERE)
+    import logging
+    import otlp_json
+    import otel_server_python_http_tcp_snowflake_fastapi as receiver
+    from google.protobuf import json_format
+    # The receiver logs every row at DEBUG
+    logging.getLogger(RECEIVER_MODULE).setLevel(logging.INFO)
+
+    request = trace_request(synthetic_spans(args.spans, args.distinct))
+    protobuf_body = request.SerializeToString()
+    json_body = json.dumps(ids_to_hex(json_format.MessageToDict(request))).encode()
+
+    def from_protobuf():
+        trace_data = receiver.trace_service_pb2.ExportTraceServiceRequest()
+        trace_data.ParseFromString(protobuf_body)
+        rows = receiver.TraceRows()
+        for resource_span in trace_data.resource_spans:
+            for scope_span in resource_span.scope_spans:
+                for span in scope_span.spans:
+                    receiver.append_span_row(rows, span)
+        return rows
+
+    def from_json():
+        payload = otlp_json.decode_payload(json_body)
+        rows = receiver.TraceRows()
+        for resource_span in payload["resourceSpans"]:
+            for scope_span in resource_span["scopeSpans"]:
+                for span in scope_span["spans"]:
+                    otlp_json.append_span_row(rows, span)
+        return rows
+
+    def from_json_format():
+        payload = otlp_json.decode_payload(json_body)
+        trace_data = otlp_json.parse_request(payload, receiver.trace_service_pb2.ExportTraceServiceRequest())
+        rows = receiver.TraceRows()
+        for resource_span in trace_data.resource_spans:
+            for scope_span in resource_span.scope_spans:
+                for span in scope_span.spans:
+                    receiver.append_span_row(rows, span)
+        return rows
+
+    candidates = (
+        ("protobuf", protobuf_body, from_protobuf),
+        ("OTLP/JSON direct", json_body, from_json),
+        ("OTLP/JSON via json_format", json_body, from_json_format),
+    )
+    if from_protobuf().materialize() != from_json().materialize():
+        print("warning: protobuf and OTLP/JSON rows differ")
+    print(f"{args.spans} spans, {args.distinct} distinct attribute sets\n")
+    for name, body, decode in candidates:
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            decode()
+            timings.append(time.perf_counter() - started)
+        seconds = statistics.median(timings)
+        print(
+            f"{name:<34} {args.spans / seconds:10.0f} spans/s   {len(body) / seconds / 1e6:7.1f} MB/s   "
+            f"{len(body) / args.spans:6.0f} bytes/span"
+        )
+
+
+def _parse_args():
+    cli_parser = argparse.ArgumentParser(description="Receiver benchmarks.")
+    commands = cli_parser.add_subparsers(dest="command", required=True)
+    startup_parser = commands.add_parser("startup", help="Import time and time to first accepted request.")
+    startup_parser.add_argument("--runs", type=int, default=5)
+    startup_parser.add_argument("--port", type=int, default=4318)
+    startup_parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for readiness.")
+    startup_parser.add_argument("--top", type=int, default=10, help="Slowest imports to list.")
+    startup_parser.set_defaults(run=startup)
+    codec_parser = commands.add_parser("codec", help="Attribute decoding and JSON encoding per span.")
+    codec_parser.add_argument("--spans", type=int, default=100000)
+    codec_parser.add_argument("--distinct", type=int, default=50, help="Distinct attribute sets among the spans.")
+    codec_parser.add_argument("--cache-size", type=int, default=10000)
+    codec_parser.add_argument("--runs", type=int, default=3)
+    codec_parser.set_defaults(run=codec)
+    encoding_parser = commands.add_parser("encoding", help="Trace rows per second for protobuf and OTLP/JSON bodies.")
+    encoding_parser.add_argument("--spans", type=int, default=20000)
+    encoding_parser.add_argument("--distinct", type=int, default=50, help="Distinct attribute sets among the spans.")
+    encoding_parser.add_argument("--runs", type=int, default=3)
+    encoding_parser.set_defaults(run=encoding)
+    return cli_parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    args.run(args)
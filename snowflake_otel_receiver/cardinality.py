@@ -0,0 +1,173 @@
+import json
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_VALUE = "__overflow__"
+HASH_MASK = (1 << 64) - 1
+
+
+def hash64(value):
+    # str hashes are SipHash, well mixed and stable for the life of the process
+    return hash(value) & HASH_MASK
+
+
+class HyperLogLog:
+    """Distinct-count sketch in 2**precision bytes with ~1.04/sqrt(2**precision) relative error."""
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, hashed):
+        width = 64 - self.precision
+        index = hashed >> width
+        rank = width - (hashed & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        m = len(self.registers)
+        estimate = (0.7213 / (1 + 1.079 / m)) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while most registers are still empty
+            estimate = m * math.log(m / zeros)
+        return int(estimate)
+
+
+class MetricSeries:
+    __slots__ = ("series", "previous", "sketch", "key_sketches", "points_limited")
+
+    def __init__(self, previous=None):
+        # Series admitted unchanged in this window, and those of the last window that have
+        # not reported again yet; together they are capped at the limit. The sketch counts
+        # every series seen in this window.
+        self.series = set()
+        self.previous = previous or set()
+        self.sketch = HyperLogLog()
+        self.key_sketches = {}
+        self.points_limited = 0
+
+
+class CardinalityLimiter:
+    """
+    Caps the number of distinct attribute sets (series) per metric name. Up to max_series
+    series per metric pass unchanged; data points of any further series have their
+    high-cardinality keys either folded to "__overflow__" (mode "fold") or removed (mode
+    "drop"). A key counts as high-cardinality once its distinct values exceed
+    max_values_per_key, otherwise the key with the most distinct values is used.
+
+    Series and sketches are kept per window of window_seconds. At the end of a window the
+    series of the finished window keep their place while they report again in the next one;
+    series that stopped reporting (pods that went away, finished jobs) expire and free room
+    for new ones, and metrics that stopped reporting are forgotten.
+
+    Memory is bounded per metric by the capped series set plus small HyperLogLog sketches,
+    one for the metric and one per attribute key (up to max_keys), which also provide the
+    per-metric cardinality stats.
+    """
+
+    def __init__(self, max_series=2000, mode="fold", max_values_per_key=200, max_metrics=10000, max_keys=64,
+                 window_seconds=3600.0):
+        if mode not in ("fold", "drop"):
+            raise ValueError(f"Unknown cardinality limit mode '{mode}'")
+        self.max_series = max_series
+        self.mode = mode
+        self.max_values_per_key = max_values_per_key
+        self.max_metrics = max_metrics
+        self.max_keys = max_keys
+        self.window_seconds = window_seconds
+        self.window_ends = time.monotonic() + window_seconds
+        self.windows = 0
+        self.metrics = {}
+        self.untracked_points = 0
+        self.lock = threading.Lock()
+
+    def rotate(self, now):
+        # Called with the lock held
+        self.metrics = {
+            name: MetricSeries(state.series)
+            for name, state in self.metrics.items() if state.series or state.points_limited
+        }
+        self.window_ends = now + self.window_seconds
+        self.windows += 1
+
+    def limit(self, metric_name, attributes):
+        series_key = json.dumps(attributes, sort_keys=True, default=str)
+        series_hash = hash64(series_key)
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.window_ends:
+                self.rotate(now)
+            state = self.metrics.get(metric_name)
+            if state is None:
+                if len(self.metrics) >= self.max_metrics:
+                    self.untracked_points += 1
+                    return attributes
+                state = self.metrics[metric_name] = MetricSeries()
+            state.sketch.add(series_hash)
+            for key, value in attributes.items():
+                key_sketch = state.key_sketches.get(key)
+                if key_sketch is None:
+                    if len(state.key_sketches) >= self.max_keys:
+                        continue
+                    key_sketch = state.key_sketches[key] = HyperLogLog(8)
+                key_sketch.add(hash64(f"{key}={value!r}"))
+            if series_hash in state.series:
+                return attributes
+            if series_hash in state.previous:
+                state.previous.discard(series_hash)
+                state.series.add(series_hash)
+                return attributes
+            # Room held by last window's series is only released when the window ends
+            if len(state.series) + len(state.previous) < self.max_series:
+                state.series.add(series_hash)
+                return attributes
+            state.points_limited += 1
+            offenders = self.offending_keys(state, attributes)
+        if self.mode == "drop":
+            return {key: value for key, value in attributes.items() if key not in offenders}
+        return {key: OVERFLOW_VALUE if key in offenders else value for key, value in attributes.items()}
+
+    def offending_keys(self, state, attributes):
+        estimates = {
+            key: state.key_sketches[key].estimate() for key in attributes if key in state.key_sketches
+        }
+        offenders = {key for key, estimate in estimates.items() if estimate > self.max_values_per_key}
+        if not offenders and estimates:
+            offenders = {max(estimates, key=estimates.get)}
+        return offenders
+
+    def stats(self, top=20):
+        with self.lock:
+            metrics = [
+                {
+                    "metric_name": name,
+                    "estimated_series": state.sketch.estimate(),
+                    "admitted_series": len(state.series),
+                    "expiring_series": len(state.previous),
+                    "points_limited": state.points_limited,
+                    "top_keys": dict(sorted(
+                        ((key, sketch.estimate()) for key, sketch in state.key_sketches.items()),
+                        key=lambda item: item[1], reverse=True,
+                    )[:5]),
+                }
+                for name, state in self.metrics.items()
+            ]
+            untracked_points = self.untracked_points
+        metrics.sort(key=lambda m: m["estimated_series"], reverse=True)
+        return {
+            "max_series": self.max_series,
+            "mode": self.mode,
+            "window_seconds": self.window_seconds,
+            "windows": self.windows,
+            "tracked_metrics": len(metrics),
+            "untracked_points": untracked_points,
+            "metrics": metrics[:top],
+        }
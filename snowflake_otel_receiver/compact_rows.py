@@ -0,0 +1,212 @@
+import sys
+from array import array
+from datetime import datetime
+from operator import itemgetter
+
+# Approximate CPython object overhead of a str that is not shared with other rows
+STR_OVERHEAD = 49
+POINTER_SIZE = 8
+FLOAT_OBJECT_SIZE = sys.getsizeof(0.0)
+
+
+class StringInterner:
+    """
+    Bounded intern table so repeated strings (span names, log levels, identical attribute
+    JSON) are held once no matter how many buffered rows reference them. Returns the shared
+    instance and the number of bytes the reference adds to the buffer.
+    """
+
+    def __init__(self, max_entries=65536):
+        self.max_entries = max_entries
+        self.table = {}
+
+    def __call__(self, value):
+        shared = self.table.get(value)
+        if shared is not None:
+            return shared, POINTER_SIZE
+        if len(self.table) >= self.max_entries:
+            self.table.clear()
+        self.table[value] = value
+        return value, POINTER_SIZE + STR_OVERHEAD + len(value)
+
+
+attribute_interner = StringInterner()
+
+
+def intern_name(value):
+    return sys.intern(value), POINTER_SIZE
+
+
+def fixed_id(value, width):
+    # Ids are stored as fixed-width raw bytes; an all-zero id stands for a missing one
+    if len(value) == width:
+        return value
+    return bytes(width)
+
+
+def id_hex(buffer, width, index):
+    value = buffer[index * width:(index + 1) * width]
+    return value.hex() if any(value) else ""
+
+
+def ns_to_datetime(ns):
+    return datetime.fromtimestamp(ns / 1e9)
+
+
+class CompactRows:
+    """
+    Column-oriented buffer for the rows of one INSERT statement. Timestamps are kept as
+    nanoseconds in an array('q'), numeric values in an array('d'), trace and span ids as
+    fixed-width bytes in a bytearray and repeated strings interned, so buffered telemetry
+    stays close to its wire size. Rows are materialized into tuples only when written.
+    A numeric column becomes a list once it gets an integer a double cannot hold exactly,
+    so int64 values above 2**53 keep every digit.
+    """
+
+    __slots__ = ("columns", "count", "nbytes")
+    signal = None
+    # One kind per column: "ts", "float", "id16", "id8", "str" or "json"
+    kinds = ()
+    # Columns matching the target table's clustering key after its date (see table_layout.py)
+    sort_columns = ()
+
+    def __init__(self, columns=None, count=0, nbytes=0):
+        self.columns = columns if columns is not None else [self.new_column(kind) for kind in self.kinds]
+        self.count = count
+        self.nbytes = nbytes
+
+    @staticmethod
+    def new_column(kind):
+        if kind == "ts":
+            return array("q")
+        if kind == "float":
+            return array("d")
+        if kind in ("id16", "id8"):
+            return bytearray()
+        return []
+
+    def __len__(self):
+        return self.count
+
+    def append_number(self, index, value):
+        # Returns the bytes the value adds beyond its 8-byte array slot, which callers count
+        column = self.columns[index]
+        extra = 0
+        if isinstance(column, array):
+            if not isinstance(value, int) or float(value) == value:
+                column.append(value)
+                return 0
+            # Every value already buffered becomes an object as well
+            column = self.columns[index] = column.tolist()
+            extra = len(column) * FLOAT_OBJECT_SIZE
+        column.append(value)
+        return extra + sys.getsizeof(value)
+
+    def slice(self, start, stop=None):
+        stop = self.count if stop is None else min(stop, self.count)
+        columns = []
+        for kind, column in zip(self.kinds, self.columns):
+            width = 16 if kind == "id16" else 8 if kind == "id8" else 1
+            columns.append(column[start * width:stop * width] if width > 1 else column[start:stop])
+        count = stop - start
+        return type(self)(columns, count, self.nbytes * count // self.count if self.count else 0)
+
+    def materialize(self):
+        columns = []
+        for kind, column in zip(self.kinds, self.columns):
+            if kind == "ts":
+                columns.append([ns_to_datetime(ns) for ns in column])
+            elif kind in ("id16", "id8"):
+                width = 16 if kind == "id16" else 8
+                columns.append([id_hex(column, width, i) for i in range(self.count)])
+            else:
+                columns.append(column)
+        return list(zip(*columns))
+
+    def __getstate__(self):
+        return self.columns, self.count, self.nbytes
+
+    def __setstate__(self, state):
+        self.columns, self.count, self.nbytes = state
+
+
+def materialize_batch(chunks):
+    # Rows sorted by the clustering key land in fewer micro-partitions per key, which keeps
+    # pruning effective without waiting for automatic reclustering
+    rows = [row for chunk in chunks for row in chunk.materialize()]
+    if chunks and chunks[0].sort_columns:
+        rows.sort(key=itemgetter(*chunks[0].sort_columns))
+    return rows
+
+
+class TraceRows(CompactRows):
+    __slots__ = ()
+    signal = "traces"
+    kinds = ("id16", "id8", "str", "ts", "ts", "json")
+    sort_columns = (2, 0)
+
+    def append(self, trace_id, span_id, name, start_ns, end_ns, attributes):
+        trace_ids, span_ids, names, starts, ends, attribute_column = self.columns
+        trace_ids += fixed_id(trace_id, 16)
+        span_ids += fixed_id(span_id, 8)
+        name, name_bytes = intern_name(name)
+        names.append(name)
+        starts.append(start_ns)
+        ends.append(end_ns)
+        attributes, attribute_bytes = attribute_interner(attributes)
+        attribute_column.append(attributes)
+        self.count += 1
+        self.nbytes += 40 + name_bytes + attribute_bytes
+
+
+class MetricRows(CompactRows):
+    __slots__ = ()
+    signal = "metrics"
+    kinds = ("ts", "str", "float", "json")
+    sort_columns = (1, 0)
+
+    def append(self, timestamp_ns, metric_name, value, attributes):
+        timestamps, names, _, attribute_column = self.columns
+        timestamps.append(timestamp_ns)
+        metric_name, name_bytes = intern_name(metric_name)
+        names.append(metric_name)
+        value_bytes = self.append_number(2, value)
+        attributes, attribute_bytes = attribute_interner(attributes)
+        attribute_column.append(attributes)
+        self.count += 1
+        self.nbytes += 16 + name_bytes + value_bytes + attribute_bytes
+
+
+class LogRows(CompactRows):
+    __slots__ = ()
+    signal = "logs"
+    kinds = ("ts", "str", "str", "json")
+    sort_columns = (1, 0)
+
+    def append(self, timestamp_ns, log_level, message, attributes):
+        timestamps, levels, messages, attribute_column = self.columns
+        timestamps.append(timestamp_ns)
+        log_level, level_bytes = intern_name(log_level)
+        levels.append(log_level)
+        messages.append(message)
+        attributes, attribute_bytes = attribute_interner(attributes)
+        attribute_column.append(attributes)
+        self.count += 1
+        self.nbytes += 8 + level_bytes + POINTER_SIZE + STR_OVERHEAD + len(message) + attribute_bytes
+
+
+class LogTokenRows(CompactRows):
+    __slots__ = ()
+    signal = "logs"
+    kinds = ("str", "ts", "ts")
+    sort_columns = (0, 1)
+
+    def append(self, token, bucket_ns, timestamp_ns):
+        tokens, buckets, timestamps = self.columns
+        # Tokens repeat across records but include ids, so the bounded interner is used
+        token, token_bytes = attribute_interner(token)
+        tokens.append(token)
+        buckets.append(bucket_ns)
+        timestamps.append(timestamp_ns)
+        self.count += 1
+        self.nbytes += 16 + token_bytes
@@ -0,0 +1,96 @@
+import contextvars
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+# Fingerprint of the export request being handled on this thread or task, picked up by the
+# services when they hand rows to the tenant writers
+current_fingerprint = contextvars.ContextVar("current_fingerprint", default=None)
+
+IN_FLIGHT, COMMITTED = 0, 1
+
+
+def request_fingerprint(signal, body, tenant_header=None, idempotency_key=None):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (signal, tenant_header or "", idempotency_key or ""):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    digest.update(body)
+    return digest.digest()
+
+
+class RequestDeduplicator:
+    """
+    Remembers the fingerprints (content hash plus optional idempotency key) of recently
+    accepted export requests so a collector retry of a request that was already accepted is
+    acknowledged without being written again. A fingerprint stays in flight while the
+    writers retry its rows, is marked committed once they are written or spilled and then
+    kept for ttl_seconds, bounded to max_entries. A request that is not accepted (e.g.
+    throttled) is forgotten so the client's retry goes through.
+    """
+
+    def __init__(self, max_entries=100000, ttl_seconds=900):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        # fingerprint -> (state, recorded_at)
+        self.entries = OrderedDict()
+        self.hits_in_flight = 0
+        self.hits_committed = 0
+        self.requests_committed = 0
+        self.requests_forgotten = 0
+
+    def begin(self, fingerprint):
+        # True when the request is new and now in flight, False for a duplicate
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+            if entry is not None and now - entry[1] < self.ttl_seconds:
+                if entry[0] == COMMITTED:
+                    self.hits_committed += 1
+                else:
+                    self.hits_in_flight += 1
+                return False
+            self.entries[fingerprint] = (IN_FLIGHT, now)
+            self.entries.move_to_end(fingerprint)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+
+    def committed(self, fingerprint):
+        with self.lock:
+            if fingerprint in self.entries:
+                self.entries[fingerprint] = (COMMITTED, time.monotonic())
+                self.requests_committed += 1
+
+    def forget(self, fingerprint):
+        with self.lock:
+            if self.entries.pop(fingerprint, None) is not None:
+                self.requests_forgotten += 1
+
+    def run(self, fingerprint, export):
+        if fingerprint is None:
+            return export()
+        if not self.begin(fingerprint):
+            return 0
+        token = current_fingerprint.set(fingerprint)
+        try:
+            return export()
+        except BaseException:
+            # Not accepted (e.g. throttled), so the client's retry must go through
+            self.forget(fingerprint)
+            raise
+        finally:
+            current_fingerprint.reset(token)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "duplicate_hits_in_flight": self.hits_in_flight,
+                "duplicate_hits_committed": self.hits_committed,
+                "requests_committed": self.requests_committed,
+                "requests_forgotten": self.requests_forgotten,
+            }
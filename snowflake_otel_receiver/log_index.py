@@ -0,0 +1,101 @@
+import re
+import threading
+
+# Tokens are lower-cased runs of letters, digits, "_" and "-", so request ids and UUIDs stay
+# whole. The dashboard search tokenizes its query the same way with a copy of these
+# definitions in streamlit_in_snowflake/dashboard_common.py; change both together.
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9_\-]*[a-z0-9]")
+MIN_TOKEN_LENGTH = 3
+MAX_TOKEN_LENGTH = 64
+# Postings kept per log record, the longest tokens first
+MAX_TOKENS_PER_RECORD = 64
+STOPWORDS = frozenset((
+    "and", "are", "but", "for", "from", "has", "have", "into", "not", "the", "this", "that",
+    "was", "were", "will", "with",
+))
+
+# Attributes whose values are indexed as "key=value" tokens
+DEFAULT_ATTRIBUTE_KEYS = ("error.code", "exception.type", "http.request_id", "request.id", "user.id", "enduser.id")
+
+
+def message_tokens(message):
+    tokens = set()
+    for token in TOKEN_PATTERN.findall(message.lower()):
+        if MIN_TOKEN_LENGTH <= len(token) <= MAX_TOKEN_LENGTH and token not in STOPWORDS:
+            tokens.add(token)
+    return tokens
+
+
+def attribute_token(key, value):
+    return f"{key}={value}".lower()[:MAX_TOKEN_LENGTH * 2]
+
+
+class LogIndexer:
+    """
+    Builds the log_tokens postings table next to the logs: one row per distinct token of a
+    log record with the record's time bucket and timestamp, which locates the row in the
+    logs table. A search looks up its terms here first and then reads only the matching
+    buckets of logs instead of scanning the message column with LIKE.
+    """
+
+    def __init__(self, attribute_keys=DEFAULT_ATTRIBUTE_KEYS, bucket_seconds=300, max_tokens=MAX_TOKENS_PER_RECORD):
+        self.attribute_keys = frozenset(attribute_keys)
+        self.bucket_ns = int(bucket_seconds * 1e9)
+        self.max_tokens = max_tokens
+        self.lock = threading.Lock()
+        self.records_indexed = 0
+        self.postings = 0
+        self.postings_bytes = 0
+        self.message_bytes = 0
+        self.postings_dropped = 0
+
+    def tokens(self, message, attributes):
+        tokens = message_tokens(message)
+        if isinstance(attributes, dict):
+            # Already decoded, from an OTLP/JSON request
+            for key in self.attribute_keys.intersection(attributes):
+                value = attributes[key]
+                if isinstance(value, (str, int)) and not isinstance(value, bool):
+                    tokens.add(attribute_token(key, value))
+            return tokens
+        for kv in attributes:
+            if kv.key in self.attribute_keys:
+                value = kv.value
+                kind = value.WhichOneof("value")
+                if kind == "string_value":
+                    tokens.add(attribute_token(kv.key, value.string_value))
+                elif kind == "int_value":
+                    tokens.add(attribute_token(kv.key, value.int_value))
+        return tokens
+
+    def index(self, rows, timestamp_ns, message, attributes):
+        tokens = self.tokens(message, attributes)
+        if len(tokens) > self.max_tokens:
+            tokens = sorted(tokens, key=len, reverse=True)[:self.max_tokens]
+        bucket_ns = timestamp_ns - timestamp_ns % self.bucket_ns
+        # Written volume: the token plus two 8-byte timestamps per posting
+        nbytes = 0
+        for token in tokens:
+            rows.append(token, bucket_ns, timestamp_ns)
+            nbytes += len(token) + 16
+        with self.lock:
+            self.records_indexed += 1
+            self.postings += len(tokens)
+            self.postings_bytes += nbytes
+            self.message_bytes += len(message)
+
+    def count_dropped(self, postings):
+        with self.lock:
+            self.postings_dropped += postings
+
+    def stats(self):
+        with self.lock:
+            return {
+                "bucket_seconds": self.bucket_ns / 1e9,
+                "records_indexed": self.records_indexed,
+                "postings": self.postings,
+                "postings_per_record": round(self.postings / self.records_indexed, 2) if self.records_indexed else None,
+                "postings_bytes": self.postings_bytes,
+                "message_bytes": self.message_bytes,
+                "postings_dropped": self.postings_dropped,
+            }
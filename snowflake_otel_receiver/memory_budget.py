@@ -0,0 +1,141 @@
+import logging
+import os
+import pickle
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBudget:
+    """
+    Byte accounting for telemetry buffered between parse and write, with one global limit
+    and optional per-signal limits. Writers reserve the estimated size of a buffer before
+    queueing it and release it once the rows have been written or dropped.
+    """
+
+    def __init__(self, total_bytes, signal_bytes=None):
+        self.total_bytes = total_bytes
+        self.signal_bytes = {signal: limit for signal, limit in (signal_bytes or {}).items() if limit}
+        self.used_bytes = 0
+        self.used_signal_bytes = {}
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def try_reserve(self, signal, nbytes):
+        with self.lock:
+            used_signal = self.used_signal_bytes.get(signal, 0)
+            signal_limit = self.signal_bytes.get(signal)
+            if self.used_bytes + nbytes > self.total_bytes or (
+                signal_limit is not None and used_signal + nbytes > signal_limit
+            ):
+                self.rejected += 1
+                return False
+            self.used_bytes += nbytes
+            self.used_signal_bytes[signal] = used_signal + nbytes
+            return True
+
+    def release(self, signal, nbytes):
+        with self.lock:
+            self.used_bytes -= nbytes
+            self.used_signal_bytes[signal] = self.used_signal_bytes.get(signal, 0) - nbytes
+
+    def utilization(self, signal=None):
+        utilization = self.used_bytes / self.total_bytes if self.total_bytes else 0.0
+        signal_limit = self.signal_bytes.get(signal)
+        if signal_limit:
+            utilization = max(utilization, self.used_signal_bytes.get(signal, 0) / signal_limit)
+        return utilization
+
+    def stats(self):
+        with self.lock:
+            return {
+                "total_bytes": self.total_bytes,
+                "used_bytes": self.used_bytes,
+                "signal_bytes": dict(self.signal_bytes),
+                "used_signal_bytes": dict(self.used_signal_bytes),
+                "rejected_reservations": self.rejected,
+            }
+
+
+class SpillStore:
+    """
+    Spills buffers that do not fit the memory budget to local files and hands them back,
+    oldest first, once the writer has room again. Files left behind by a previous process
+    are picked up on start.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.quarantined = 0
+        os.makedirs(directory, exist_ok=True)
+        self.files = sorted(f for f in os.listdir(directory) if f.endswith(".spill"))
+        self.spilled_bytes = sum(os.path.getsize(os.path.join(directory, f)) for f in self.files)
+        if self.files:
+            logger.info(f"Found {len(self.files)} spilled buffers ({self.spilled_bytes} bytes) in {directory}")
+
+    def has_pending(self):
+        return bool(self.files)
+
+    def spill(self, insert_sql, rows):
+        reservation = self.reserve(insert_sql, rows)
+        if reservation is None:
+            return False
+        self.commit(reservation)
+        return True
+
+    def reserve(self, insert_sql, rows):
+        # Claims room for the buffer without writing it: commit() writes it, cancel() gives
+        # the room back. Returns None when the store is full.
+        data = pickle.dumps((insert_sql, rows), protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            if self.spilled_bytes + len(data) > self.max_bytes:
+                return None
+            self.sequence += 1
+            name = f"{time.time_ns():020d}-{self.sequence:06d}.spill"
+            self.spilled_bytes += len(data)
+        return name, data
+
+    def cancel(self, reservation):
+        with self.lock:
+            self.spilled_bytes -= len(reservation[1])
+
+    def commit(self, reservation):
+        name, data = reservation
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        with self.lock:
+            self.files.append(name)
+            self.files.sort()
+        return True
+
+    def restore(self):
+        # The file is removed only once it loads; one that does not (corrupt, or written by a
+        # version with another buffer layout) is renamed to .spill.bad and skipped
+        with self.lock:
+            if not self.files:
+                return None
+            name = self.files.pop(0)
+        path = os.path.join(self.directory, name)
+        with open(path, "rb") as f:
+            data = f.read()
+        with self.lock:
+            self.spilled_bytes -= len(data)
+        try:
+            restored = pickle.loads(data)
+        except Exception as e:
+            logger.error(f"Could not load spilled buffer {path}, moved to {path}.bad: {e}")
+            os.replace(path, path + ".bad")
+            self.quarantined += 1
+            return None
+        os.remove(path)
+        return restored
+
+    def stats(self):
+        with self.lock:
+            return {"files": len(self.files), "bytes": self.spilled_bytes, "quarantined": self.quarantined}
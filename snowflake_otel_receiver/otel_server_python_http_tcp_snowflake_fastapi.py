@@ -1,34 +1,41 @@
-import grpc
-import json
 import logging
 import asyncio
-from concurrent import futures
-from datetime import datetime
-from threading import Thread
+import time
+from threading import Event, Thread
 import os
+import hmac
 
-import snowflake.connector
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import Response
-import uvicorn
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# grpc, the Snowflake connector and FastAPI/uvicorn are imported where they are first used,
+# so SPCS mode never loads gRPC and the ports open before the connector is imported
 
 # Import OpenTelemetry Protobuf definitions
-from opentelemetry.proto.collector.trace.v1 import (
-    trace_service_pb2_grpc,
-    trace_service_pb2,
-)
-from opentelemetry.proto.collector.metrics.v1 import (
-    metrics_service_pb2_grpc,
-    metrics_service_pb2,
-)
-from opentelemetry.proto.collector.logs.v1 import (
-    logs_service_pb2_grpc,
-    logs_service_pb2,
-)
-from opentelemetry.proto.metrics.v1 import metrics_pb2
-from opentelemetry.proto.logs.v1 import logs_pb2
+from opentelemetry.proto.collector.trace.v1 import trace_service_pb2
+from opentelemetry.proto.collector.metrics.v1 import metrics_service_pb2
+from opentelemetry.proto.collector.logs.v1 import logs_service_pb2
 from opentelemetry.proto.trace.v1 import trace_pb2
 
+from span_metrics import SpanMetricsAggregator, start_span_metrics_flusher
+from service_graph import ServiceGraphAggregator, start_service_graph_flusher
+from tenant_routing import TenantBatch, TenantThrottled, load_tenant_router
+from admission import AdmissionController
+from compact_rows import LogRows, LogTokenRows, MetricRows, TraceRows
+from memory_budget import MemoryBudget
+from sinks import SnowflakeSink, load_export_pipeline
+from profiling import ProfilerBusy, RequestTimings, allocation_snapshot, mark_stage, sample_stacks
+from startup import ConnectionWarmup, check_readiness
+from trace_affinity import FORWARDED_HEADER, build_trace_forwarder
+from cardinality import CardinalityLimiter
+from dedup import RequestDeduplicator, current_fingerprint, request_fingerprint
+from attribute_codec import AttributeCodec, attributes_to_dict, encode_dict
+from log_index import DEFAULT_ATTRIBUTE_KEYS, LogIndexer
+import otlp_json
+from shutdown import DrainCoordinator, Draining, install_signal_handlers
+
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -36,15 +43,16 @@ logger = logging.getLogger(__name__)
 # Configure Snowflake connection
 
 # Configure Snowflake connection
-def connect_to_snowflake():
+def connect_to_snowflake(database=None, schema=None, warehouse=None):
+    import snowflake.connector
     return snowflake.connector.connect(
         user=os.getenv('SNOWFLAKE_USER'),
         password=os.getenv('SNOWFLAKE_PASSWORD'),
         account=os.getenv('SNOWFLAKE_ACCOUNT'),
-        database=os.getenv('SNOWFLAKE_DATABASE'),
-        schema=os.getenv('SNOWFLAKE_SCHEMA'),
+        database=database or os.getenv('SNOWFLAKE_DATABASE'),
+        schema=schema or os.getenv('SNOWFLAKE_SCHEMA'),
         role=os.getenv('SNOWFLAKE_ROLE'),
-        warehouse=os.getenv("SNOWFLAKE_WAREHOUSE"),
+        warehouse=warehouse or os.getenv("SNOWFLAKE_WAREHOUSE"),
     )
 
 #SPCS
@@ -53,13 +61,14 @@ def get_login_token():
   with open('/snowflake/session/token', 'r') as f:
       return f.read()
 
-def connect_to_snowflake_spcs():
+def connect_to_snowflake_spcs(database=None, schema=None, warehouse=None):
+    import snowflake.connector
     return snowflake.connector.connect(
         host=os.getenv('SNOWFLAKE_HOST'),
         account = os.getenv('SNOWFLAKE_ACCOUNT'),
-        warehouse= os.getenv("SNOWFLAKE_WAREHOUSE"),
-        database= os.getenv('SNOWFLAKE_DATABASE'),
-        schema= os.getenv('SNOWFLAKE_SCHEMA'),
+        warehouse= warehouse or os.getenv("SNOWFLAKE_WAREHOUSE"),
+        database= database or os.getenv('SNOWFLAKE_DATABASE'),
+        schema= schema or os.getenv('SNOWFLAKE_SCHEMA'),
         token = get_login_token(),
         authenticator = 'oauth'
     )
@@ -67,152 +76,607 @@ def connect_to_snowflake_spcs():
 # Configuration options for compression
 ENABLE_GRPC_COMPRESSION = True  # Set to False to disable gRPC compression support
 ENABLE_HTTP_COMPRESSION = True  # Set to False to disable HTTP compression support
+# Upper bound for zstd bodies that do not declare their decompressed size
+MAX_DECOMPRESSED_BYTES = int(os.getenv("MAX_DECOMPRESSED_BYTES", str(64 * 1024 ** 2)))
 
-# Function to parse AnyValue objects
-def parse_any_value(any_value):
-    if any_value.HasField("string_value"):
-        return any_value.string_value
-    elif any_value.HasField("bool_value"):
-        return any_value.bool_value
-    elif any_value.HasField("int_value"):
-        return any_value.int_value
-    elif any_value.HasField("double_value"):
-        return any_value.double_value
-    elif any_value.HasField("array_value"):
-        return [parse_any_value(val) for val in any_value.array_value.values]
-    elif any_value.HasField("kvlist_value"):
-        return {kv.key: parse_any_value(kv.value) for kv in any_value.kvlist_value.values}
-    elif any_value.HasField("bytes_value"):
-        return any_value.bytes_value  # Handle bytes as needed
-    else:
+# Span-derived RED metrics (rate, errors, duration) flushed to the span_metrics table
+ENABLE_SPAN_METRICS = os.getenv("ENABLE_SPAN_METRICS", "True") == "True"
+SPAN_METRICS_FLUSH_INTERVAL = int(os.getenv("SPAN_METRICS_FLUSH_INTERVAL", "60"))
+
+# Service dependency edges joined from parent/child spans, flushed to service_graph_edges
+ENABLE_SERVICE_GRAPH = os.getenv("ENABLE_SERVICE_GRAPH", "True") == "True"
+SERVICE_GRAPH_FLUSH_INTERVAL = int(os.getenv("SERVICE_GRAPH_FLUSH_INTERVAL", "60"))
+SERVICE_GRAPH_MAX_SPANS = int(os.getenv("SERVICE_GRAPH_MAX_SPANS", "100000"))
+SERVICE_GRAPH_SPAN_TTL = int(os.getenv("SERVICE_GRAPH_SPAN_TTL", "120"))
+
+# Tenant routing rules (JSON file, see tenant_routing.load_tenant_router) and the default
+# batch writer settings every tenant starts from. With WRITER_ADAPTIVE the batch size,
+# flush interval and connection count are tuned at runtime within the min/max bounds.
+# With WRITER_MAX_IN_FLIGHT above 1 every connection overlaps that many INSERTs through
+# execute_async, and at most WRITER_MAX_IN_FLIGHT_PER_TABLE run per table (0: no limit).
+# Failed INSERTs are retried WRITER_MAX_ATTEMPTS times with backoff and then spilled to SPILL_DIR.
+TENANT_ROUTING_CONFIG = os.getenv("TENANT_ROUTING_CONFIG")
+WRITER_DEFAULTS = {
+    "batch_size": int(os.getenv("WRITER_BATCH_SIZE", "1000")),
+    "flush_interval": float(os.getenv("WRITER_FLUSH_INTERVAL", "1.0")),
+    "max_queued_rows": int(os.getenv("WRITER_MAX_QUEUED_ROWS", "100000")),
+    "connections": int(os.getenv("WRITER_CONNECTIONS", "1")),
+    "adaptive": os.getenv("WRITER_ADAPTIVE", "True") == "True",
+    "min_batch_size": int(os.getenv("WRITER_MIN_BATCH_SIZE", "100")),
+    "max_batch_size": int(os.getenv("WRITER_MAX_BATCH_SIZE", "20000")),
+    "min_flush_interval": float(os.getenv("WRITER_MIN_FLUSH_INTERVAL", "0.2")),
+    "max_flush_interval": float(os.getenv("WRITER_MAX_FLUSH_INTERVAL", "5.0")),
+    "max_connections": int(os.getenv("WRITER_MAX_CONNECTIONS", "4")),
+    "latency_target": float(os.getenv("WRITER_LATENCY_TARGET", "2.0")),
+    "max_in_flight": int(os.getenv("WRITER_MAX_IN_FLIGHT", "4")),
+    "max_in_flight_per_table": int(os.getenv("WRITER_MAX_IN_FLIGHT_PER_TABLE", "8")),
+    "poll_interval": float(os.getenv("WRITER_POLL_INTERVAL", "0.1")),
+    "max_attempts": int(os.getenv("WRITER_MAX_ATTEMPTS", "5")),
+    "retry_backoff": float(os.getenv("WRITER_RETRY_BACKOFF", "1.0")),
+    "max_retry_backoff": float(os.getenv("WRITER_MAX_RETRY_BACKOFF", "30.0")),
+    "spill_dir": os.getenv("SPILL_DIR"),
+    "spill_max_bytes": int(os.getenv("SPILL_MAX_BYTES", str(2 * 1024 ** 3))),
+}
+
+# Byte budget for rows buffered between parse and write, globally and per signal. Buffers
+# over budget are spilled to SPILL_DIR when set, otherwise refused with 429/RESOURCE_EXHAUSTED.
+MEMORY_BUDGET_BYTES = int(os.getenv("MEMORY_BUDGET_BYTES", str(256 * 1024 ** 2)))
+MEMORY_BUDGET_SIGNAL_BYTES = {
+    "traces": int(os.getenv("MEMORY_BUDGET_TRACES_BYTES", "0")),
+    "metrics": int(os.getenv("MEMORY_BUDGET_METRICS_BYTES", "0")),
+    "logs": int(os.getenv("MEMORY_BUDGET_LOGS_BYTES", "0")),
+}
+
+# Additional sinks (file archive, OTLP forwarder, ...) and per-signal routes, see
+# sinks.load_export_pipeline. Without it everything goes to Snowflake only.
+SINKS_CONFIG = os.getenv("SINKS_CONFIG")
+
+# Priority-aware load shedding once a tenant writer's queue fills up or inserts slow down
+ENABLE_LOAD_SHEDDING = os.getenv("ENABLE_LOAD_SHEDDING", "True") == "True"
+ADMISSION_QUEUE_THRESHOLDS = tuple(
+    float(t) for t in os.getenv("ADMISSION_QUEUE_THRESHOLDS", "0.5,0.75,0.9").split(",")
+)
+ADMISSION_LATENCY_TARGET = float(os.getenv("ADMISSION_LATENCY_TARGET", "2.0"))
+# Seconds in which the insert latency average halves while no batch is written
+ADMISSION_LATENCY_HALF_LIFE = float(os.getenv("ADMISSION_LATENCY_HALF_LIFE", "30"))
+ADMISSION_CORE_METRICS = os.getenv("ADMISSION_CORE_METRICS")
+
+# Trace affinity: with several replicas, spans are forwarded to the replica that owns their
+# trace_id on a consistent hash ring. Peers come from a static "host:port,..." list or DNS.
+TRACE_AFFINITY_PEERS = os.getenv("TRACE_AFFINITY_PEERS")
+TRACE_AFFINITY_DNS = os.getenv("TRACE_AFFINITY_DNS")
+TRACE_AFFINITY_SELF = os.getenv("TRACE_AFFINITY_SELF")
+TRACE_AFFINITY_REFRESH = float(os.getenv("TRACE_AFFINITY_REFRESH", "15"))
+
+# Metric cardinality guard: at most METRIC_MAX_SERIES attribute sets per metric name pass
+# unchanged; further series get their high-cardinality keys folded to "__overflow__" ("fold")
+# or removed ("drop"). 0 disables the guard. Series that stop reporting for a whole
+# METRIC_CARDINALITY_WINDOW (seconds) expire and free their place.
+METRIC_MAX_SERIES = int(os.getenv("METRIC_MAX_SERIES", "2000"))
+METRIC_CARDINALITY_MODE = os.getenv("METRIC_CARDINALITY_MODE", "fold")
+METRIC_MAX_VALUES_PER_KEY = int(os.getenv("METRIC_MAX_VALUES_PER_KEY", "200"))
+METRIC_CARDINALITY_WINDOW = float(os.getenv("METRIC_CARDINALITY_WINDOW", "3600"))
+
+# Idempotent exports: requests are fingerprinted by content (plus the IDEMPOTENCY_HEADER
+# value when the client sends one) and a retry of a recently accepted request is
+# acknowledged without being written again. Each request is committed in one transaction.
+ENABLE_DEDUP = os.getenv("ENABLE_DEDUP", "True") == "True"
+IDEMPOTENCY_HEADER = os.getenv("IDEMPOTENCY_HEADER", "Idempotency-Key")
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", "900"))
+
+# Encoded attribute JSON of the most recent distinct span/log attribute sets; 0 disables the cache
+ATTRIBUTE_CACHE_SIZE = int(os.getenv("ATTRIBUTE_CACHE_SIZE", "10000"))
+
+# Token index for log search: message tokens and the values of LOG_INDEX_ATTRIBUTES are
+# written to log_tokens with the record's LOG_INDEX_BUCKET_SECONDS time bucket
+ENABLE_LOG_INDEX = os.getenv("ENABLE_LOG_INDEX", "True") == "True"
+LOG_INDEX_ATTRIBUTES = tuple(
+    key for key in os.getenv("LOG_INDEX_ATTRIBUTES", ",".join(DEFAULT_ATTRIBUTE_KEYS)).split(",") if key
+)
+LOG_INDEX_BUCKET_SECONDS = int(os.getenv("LOG_INDEX_BUCKET_SECONDS", "300"))
+
+# OTLP/HTTP request encodings; JSON requests are answered in JSON
+PROTOBUF_MEDIA_TYPE = "application/x-protobuf"
+JSON_MEDIA_TYPE = "application/json"
+
+# Admin endpoints (/admin/...) require "Authorization: Bearer <ADMIN_TOKEN>" and are disabled without it
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_REQUEST_HISTORY = int(os.getenv("PROFILE_REQUEST_HISTORY", "200"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+
+# /readyz fails while any tenant writer's queue or memory share is at least this full
+READY_MAX_FILL_RATIO = float(os.getenv("READY_MAX_FILL_RATIO", "0.8"))
+
+# On SIGTERM the receiver finishes in-flight requests and flushes its writers for up to
+# DRAIN_TIMEOUT seconds; rows still queued then go to SPILL_DIR for the next start
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25"))
+request_timings = RequestTimings(PROFILE_REQUEST_HISTORY)
+drain_coordinator = DrainCoordinator()
+attribute_codec = AttributeCodec(ATTRIBUTE_CACHE_SIZE)
+
+def get_service_name(resource):
+    for kv in resource.attributes:
+        if kv.key == "service.name":
+            return kv.value.string_value or "unknown"
+    return "unknown"
+
+# Row builders shared by the services and the offline backfill (backfill.py)
+def append_span_row(rows, span):
+    name = span.name or "unknown"
+    start_time = span.start_time_unix_nano or time.time_ns()
+    end_time = span.end_time_unix_nano or time.time_ns()
+    attributes = attribute_codec.encode(span.attributes)
+    logger.debug(
+        f"Inserting trace: {span.trace_id.hex()}, {span.span_id.hex()}, {name}, {start_time}, {end_time}, {attributes}"
+    )
+    rows.append(span.trace_id, span.span_id, name, start_time, end_time, attributes)
+
+def metric_value_and_attributes(metric):
+    value = None
+    metric_attributes = []
+    if metric.HasField("gauge"):
+        data_points = metric.gauge.data_points
+        if data_points:
+            dp = data_points[0]
+            value = dp.as_double if dp.HasField("as_double") else dp.as_int
+            metric_attributes = dp.attributes
+    elif metric.HasField("sum"):
+        data_points = metric.sum.data_points
+        if data_points:
+            dp = data_points[0]
+            value = dp.as_double if dp.HasField("as_double") else dp.as_int
+            metric_attributes = dp.attributes
+    return value, metric_attributes
+
+def append_metric_row(rows, metric_name, value, attributes_dict, timestamp=None):
+    timestamp = timestamp or time.time_ns()
+    attributes = encode_dict(attributes_dict)
+    logger.debug(
+        f"Inserting metric: {timestamp}, {metric_name}, {value}, {attributes}"
+    )
+    rows.append(timestamp, metric_name, value, attributes)
+
+def append_log_row(rows, log):
+    timestamp = log.time_unix_nano or time.time_ns()
+    log_level = log.severity_text or "INFO"
+    message = (
+        log.body.string_value
+        if log.body.HasField("string_value")
+        else "No message"
+    )
+    attributes = attribute_codec.encode(log.attributes)
+    logger.debug(
+        f"Inserting log: {timestamp}, {log_level}, {message}, {attributes}"
+    )
+    rows.append(timestamp, log_level, message, attributes)
+    return timestamp, message
+
+# INSERT statements for the receiver tables, batched per tenant by the tenant writers
+TRACES_INSERT_SQL = """
+    INSERT INTO traces (trace_id, span_id, name, start_time, end_time, attributes)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+METRICS_INSERT_SQL = """
+    INSERT INTO metrics (timestamp, metric_name, value, attributes)
+    VALUES (%s, %s, %s, %s)
+"""
+LOGS_INSERT_SQL = """
+    INSERT INTO logs (timestamp, log_level, message, attributes)
+    VALUES (%s, %s, %s, %s)
+"""
+LOG_TOKENS_INSERT_SQL = """
+    INSERT INTO log_tokens (token, bucket, log_timestamp)
+    VALUES (%s, %s, %s)
+"""
+
+def tenant_batch(batches, tenant, rows_class):
+    batch = batches.get(tenant)
+    if batch is None:
+        batch = batches[tenant] = TenantBatch(rows_class())
+    return batch
+
+def pressure_level(admission, router, tenant):
+    return admission.level(router.writer_for(tenant)) if admission is not None else 0
+
+def http_fingerprint(dedup, signal, body, tenant_header, headers):
+    if dedup is None:
+        return None
+    return request_fingerprint(signal, body, tenant_header, headers.get(IDEMPOTENCY_HEADER))
+
+def grpc_fingerprint(dedup, signal, request, tenant_header, metadata):
+    if dedup is None:
         return None
+    header = IDEMPOTENCY_HEADER.lower()
+    idempotency_key = next((value for key, value in metadata or () if key == header), None)
+    body = request.SerializeToString(deterministic=True)
+    return request_fingerprint(signal, body, tenant_header, idempotency_key)
+
+def primary_only(pipeline, signal):
+    # OTLP/JSON rows are built without a protobuf message unless another sink needs one
+    return pipeline is None or pipeline.primary_only(signal)
+
+def deduplicated(dedup, fingerprint, export):
+    # Retries of a request that was already accepted are acknowledged without exporting again
+    if dedup is None:
+        return export()
+    return dedup.run(fingerprint, export)
+
+# Responses report anything shed by the admission controller as an OTLP partial success
+def trace_response(rejected_spans=0):
+    response = trace_service_pb2.ExportTraceServiceResponse()
+    if rejected_spans:
+        response.partial_success.rejected_spans = rejected_spans
+        response.partial_success.error_message = "Receiver overloaded, non-error spans were shed"
+    return response
+
+def metrics_response(rejected_data_points=0):
+    response = metrics_service_pb2.ExportMetricsServiceResponse()
+    if rejected_data_points:
+        response.partial_success.rejected_data_points = rejected_data_points
+        response.partial_success.error_message = "Receiver overloaded, non-core metrics were shed"
+    return response
+
+def logs_response(rejected_log_records=0):
+    response = logs_service_pb2.ExportLogsServiceResponse()
+    if rejected_log_records:
+        response.partial_success.rejected_log_records = rejected_log_records
+        response.partial_success.error_message = "Receiver overloaded, low-severity logs were shed"
+    return response
 
 # gRPC server for handling OTLP data
-class TraceService(trace_service_pb2_grpc.TraceServiceServicer):
-    def __init__(self, snowflake_conn):
-        self.snowflake_conn = snowflake_conn
+class TraceService:
+    def __init__(self, router, span_metrics=None, service_graph=None, admission=None):
+        self.router = router
+        self.span_metrics = span_metrics
+        self.service_graph = service_graph
+        self.admission = admission
+        self.pipeline = None
+        self.forwarder = None
+        self.dedup = None
 
     def Export(self, request, context):
-        self.process_trace(request)
-        return trace_service_pb2.ExportTraceServiceResponse()
-
-    def process_trace(self, trace_data):
-        cursor = self.snowflake_conn.cursor()
-        insert_sql = """
-            INSERT INTO traces (trace_id, span_id, name, start_time, end_time, attributes)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
+        with request_timings.request("traces", "grpc"):
+            try:
+                with drain_coordinator.request():
+                    metadata = context.invocation_metadata()
+                    forwarded = any(key == FORWARDED_HEADER.lower() for key, _ in metadata or ())
+                    tenant_header = self.router.grpc_header_value(metadata)
+                    fingerprint = grpc_fingerprint(self.dedup, "traces", request, tenant_header, metadata)
+                    rejected = self.export(request, tenant_header, forwarded, fingerprint)
+            except TenantThrottled as e:
+                import grpc
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+            except Draining as e:
+                import grpc
+                context.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+            return trace_response(rejected)
+
+    def export(self, trace_data, tenant_header=None, forwarded=False, fingerprint=None):
+        return deduplicated(self.dedup, fingerprint, lambda: self.deliver(trace_data, tenant_header, forwarded))
+
+    def export_json(self, payload, tenant_header=None, forwarded=False, fingerprint=None):
+        if (self.forwarder is None or forwarded) and primary_only(self.pipeline, "traces"):
+            return deduplicated(self.dedup, fingerprint, lambda: self.process_trace_json(payload, tenant_header))
+        trace_data = otlp_json.parse_request(payload, trace_service_pb2.ExportTraceServiceRequest())
+        return self.export(trace_data, tenant_header, forwarded, fingerprint)
+
+    def deliver(self, trace_data, tenant_header=None, forwarded=False):
+        if self.forwarder is not None and not forwarded:
+            trace_data = self.forwarder.forward(trace_data, tenant_header)
+            mark_stage("forward")
+        # With an export pipeline the Snowflake sink calls process_trace in turn
+        if self.pipeline is not None:
+            return self.pipeline.export("traces", trace_data, tenant_header)
+        return self.process_trace(trace_data, tenant_header)
+
+    def process_trace(self, trace_data, tenant_header=None):
+        batches = {}
+        rejected = 0
+        span_stats = [] if self.span_metrics is not None or self.service_graph is not None else None
         for resource_span in trace_data.resource_spans:
+            service_name = get_service_name(resource_span.resource)
+            tenant = self.router.resolve(tenant_header, resource_span.resource)
+            level = pressure_level(self.admission, self.router, tenant)
+            batch = tenant_batch(batches, tenant, TraceRows)
+            batch.nbytes += resource_span.ByteSize()
             for scope_span in resource_span.scope_spans:
                 for span in scope_span.spans:
-                    trace_id = span.trace_id.hex() if span.trace_id else ""
-                    span_id = span.span_id.hex() if span.span_id else ""
-                    name = span.name or "unknown"
-                    start_time = (
-                        datetime.fromtimestamp(span.start_time_unix_nano / 1e9)
-                        if span.start_time_unix_nano
-                        else datetime.now()
-                    )
-                    end_time = (
-                        datetime.fromtimestamp(span.end_time_unix_nano / 1e9)
-                        if span.end_time_unix_nano
-                        else datetime.now()
-                    )
-                    attributes_dict = {kv.key: parse_any_value(kv.value) for kv in span.attributes}
-                    attributes = json.dumps(attributes_dict) if attributes_dict else "{}"
-                    logger.debug(
-                        f"Inserting trace: {trace_id}, {span_id}, {name}, {start_time}, {end_time}, {attributes}"
-                    )
-                    cursor.execute(
-                        insert_sql,
-                        (trace_id, span_id, name, start_time, end_time, attributes),
-                    )
-        cursor.close()
-
-class MetricsService(metrics_service_pb2_grpc.MetricsServiceServicer):
-    def __init__(self, snowflake_conn):
-        self.snowflake_conn = snowflake_conn
+                    if span_stats is not None:
+                        span_stats.append((
+                            service_name, span.name, span.kind, span.status.code, span.start_time_unix_nano,
+                            span.end_time_unix_nano, span.span_id, span.parent_span_id,
+                        ))
+                    if level and not self.admission.admit_span(level, span.trace_id, span.status.code):
+                        rejected += 1
+                        continue
+                    append_span_row(batch.rows, span)
+        mark_stage("flatten")
+        self.router.submit(TRACES_INSERT_SQL, batches, current_fingerprint.get())
+        mark_stage("submit")
+        # Only once the request is accepted, so a throttled request the client retries is counted once
+        for stats in span_stats or ():
+            self.record_span_stats(*stats)
+        if rejected:
+            self.admission.count_rejected("spans", rejected)
+        return rejected
+
+    def process_trace_json(self, payload, tenant_header=None):
+        # process_trace for a decoded OTLP/JSON request
+        batches = {}
+        rejected = 0
+        span_stats = [] if self.span_metrics is not None or self.service_graph is not None else None
+        with otlp_json.structure_errors():
+            for resource_span in payload.get("resourceSpans", ()):
+                resource = resource_span.get("resource")
+                service_name = otlp_json.get_service_name(resource)
+                tenant = self.router.resolve_json(tenant_header, resource)
+                level = pressure_level(self.admission, self.router, tenant)
+                batch = tenant_batch(batches, tenant, TraceRows)
+                for scope_span in resource_span.get("scopeSpans", ()):
+                    for span in scope_span.get("spans", ()):
+                        status_code = (span.get("status") or {}).get("code", 0)
+                        if span_stats is not None:
+                            span_stats.append((
+                                service_name, span.get("name"), span.get("kind", 0), status_code,
+                                otlp_json.decode_int(span.get("startTimeUnixNano")),
+                                otlp_json.decode_int(span.get("endTimeUnixNano")),
+                                otlp_json.decode_id(span.get("spanId")), otlp_json.decode_id(span.get("parentSpanId")),
+                            ))
+                        if level and not self.admission.admit_span(
+                            level, otlp_json.decode_id(span.get("traceId")), status_code
+                        ):
+                            rejected += 1
+                            continue
+                        otlp_json.append_span_row(batch.rows, span)
+        for batch in batches.values():
+            batch.nbytes = batch.rows.nbytes
+        mark_stage("flatten")
+        self.router.submit(TRACES_INSERT_SQL, batches, current_fingerprint.get())
+        mark_stage("submit")
+        # Only once the request is accepted, so a throttled request the client retries is counted once
+        for stats in span_stats or ():
+            self.record_span_stats(*stats)
+        if rejected:
+            self.admission.count_rejected("spans", rejected)
+        return rejected
+
+    def record_span_stats(self, service_name, name, kind, status_code, start_time, end_time, span_id, parent_span_id):
+        # Recorded for every accepted span, including those the admission controller sheds
+        if start_time and end_time:
+            duration_ms = max(end_time - start_time, 0) / 1e6
+        else:
+            duration_ms = 0.0
+        if self.span_metrics is not None:
+            self.span_metrics.record(
+                service_name,
+                name or "unknown",
+                trace_pb2.Span.SpanKind.Name(kind),
+                status_code,
+                duration_ms,
+            )
+        if self.service_graph is not None:
+            self.service_graph.record(
+                span_id,
+                parent_span_id,
+                service_name,
+                duration_ms,
+                status_code == trace_pb2.Status.STATUS_CODE_ERROR,
+            )
+
+class MetricsService:
+    def __init__(self, router, admission=None, cardinality=None):
+        self.router = router
+        self.admission = admission
+        self.cardinality = cardinality
+        self.pipeline = None
+        self.dedup = None
 
     def Export(self, request, context):
-        self.process_metrics(request)
-        return metrics_service_pb2.ExportMetricsServiceResponse()
-
-    def process_metrics(self, metrics_data):
-        cursor = self.snowflake_conn.cursor()
-        insert_sql = """
-            INSERT INTO metrics (timestamp, metric_name, value, attributes)
-            VALUES (%s, %s, %s, %s)
-        """
+        with request_timings.request("metrics", "grpc"):
+            try:
+                with drain_coordinator.request():
+                    metadata = context.invocation_metadata()
+                    tenant_header = self.router.grpc_header_value(metadata)
+                    fingerprint = grpc_fingerprint(self.dedup, "metrics", request, tenant_header, metadata)
+                    rejected = self.export(request, tenant_header, fingerprint)
+            except TenantThrottled as e:
+                import grpc
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+            except Draining as e:
+                import grpc
+                context.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+            return metrics_response(rejected)
+
+    def export(self, metrics_data, tenant_header=None, fingerprint=None):
+        return deduplicated(self.dedup, fingerprint, lambda: self.deliver(metrics_data, tenant_header))
+
+    def export_json(self, payload, tenant_header=None, fingerprint=None):
+        if primary_only(self.pipeline, "metrics"):
+            return deduplicated(self.dedup, fingerprint, lambda: self.process_metrics_json(payload, tenant_header))
+        metrics_data = otlp_json.parse_request(payload, metrics_service_pb2.ExportMetricsServiceRequest())
+        return self.export(metrics_data, tenant_header, fingerprint)
+
+    def deliver(self, metrics_data, tenant_header=None):
+        if self.pipeline is not None:
+            return self.pipeline.export("metrics", metrics_data, tenant_header)
+        return self.process_metrics(metrics_data, tenant_header)
+
+    def process_metrics(self, metrics_data, tenant_header=None):
+        batches = {}
+        rejected = 0
         for resource_metric in metrics_data.resource_metrics:
+            tenant = self.router.resolve(tenant_header, resource_metric.resource)
+            level = pressure_level(self.admission, self.router, tenant)
+            batch = tenant_batch(batches, tenant, MetricRows)
+            batch.nbytes += resource_metric.ByteSize()
             for scope_metric in resource_metric.scope_metrics:
                 for metric in scope_metric.metrics:
-                    timestamp = datetime.now()
                     metric_name = metric.name or "unknown"
-                    value = None
-                    metric_attributes = []
-                    if metric.HasField("gauge"):
-                        data_points = metric.gauge.data_points
-                        if data_points:
-                            dp = data_points[0]
-                            value = dp.as_double if dp.HasField("as_double") else dp.as_int
-                            metric_attributes = dp.attributes
-                    elif metric.HasField("sum"):
-                        data_points = metric.sum.data_points
-                        if data_points:
-                            dp = data_points[0]
-                            value = dp.as_double if dp.HasField("as_double") else dp.as_int
-                            metric_attributes = dp.attributes
-                    attributes_dict = {kv.key: parse_any_value(kv.value) for kv in metric_attributes}
-                    attributes = json.dumps(attributes_dict) if attributes_dict else "{}"
-                    if value is not None:
-                        logger.debug(
-                            f"Inserting metric: {timestamp}, {metric_name}, {value}, {attributes}"
-                        )
-                        cursor.execute(
-                            insert_sql, (timestamp, metric_name, value, attributes)
-                        )
-        cursor.close()
-
-class LogsService(logs_service_pb2_grpc.LogsServiceServicer):
-    def __init__(self, snowflake_conn):
-        self.snowflake_conn = snowflake_conn
+                    value, metric_attributes = metric_value_and_attributes(metric)
+                    if value is None:
+                        continue
+                    if level and not self.admission.admit_metric(level, metric_name, len(metric_attributes)):
+                        rejected += 1
+                        continue
+                    attributes_dict = attributes_to_dict(metric_attributes)
+                    if self.cardinality is not None:
+                        attributes_dict = self.cardinality.limit(metric_name, attributes_dict)
+                    append_metric_row(batch.rows, metric_name, value, attributes_dict)
+        mark_stage("flatten")
+        self.router.submit(METRICS_INSERT_SQL, batches, current_fingerprint.get())
+        mark_stage("submit")
+        if rejected:
+            self.admission.count_rejected("data_points", rejected)
+        return rejected
+
+    def process_metrics_json(self, payload, tenant_header=None):
+        # process_metrics for a decoded OTLP/JSON request
+        batches = {}
+        rejected = 0
+        with otlp_json.structure_errors():
+            for resource_metric in payload.get("resourceMetrics", ()):
+                tenant = self.router.resolve_json(tenant_header, resource_metric.get("resource"))
+                level = pressure_level(self.admission, self.router, tenant)
+                batch = tenant_batch(batches, tenant, MetricRows)
+                for scope_metric in resource_metric.get("scopeMetrics", ()):
+                    for metric in scope_metric.get("metrics", ()):
+                        metric_name = metric.get("name") or "unknown"
+                        value, attributes_dict = otlp_json.metric_value_and_attributes(metric)
+                        if value is None:
+                            continue
+                        if level and not self.admission.admit_metric(level, metric_name, len(attributes_dict)):
+                            rejected += 1
+                            continue
+                        if self.cardinality is not None:
+                            attributes_dict = self.cardinality.limit(metric_name, attributes_dict)
+                        append_metric_row(batch.rows, metric_name, value, attributes_dict)
+        for batch in batches.values():
+            batch.nbytes = batch.rows.nbytes
+        mark_stage("flatten")
+        self.router.submit(METRICS_INSERT_SQL, batches, current_fingerprint.get())
+        mark_stage("submit")
+        if rejected:
+            self.admission.count_rejected("data_points", rejected)
+        return rejected
+
+class LogsService:
+    def __init__(self, router, admission=None, log_index=None):
+        self.router = router
+        self.admission = admission
+        self.log_index = log_index
+        self.pipeline = None
+        self.dedup = None
 
     def Export(self, request, context):
-        self.process_logs(request)
-        return logs_service_pb2.ExportLogsServiceResponse()
-
-    def process_logs(self, logs_data):
-        cursor = self.snowflake_conn.cursor()
-        insert_sql = """
-            INSERT INTO logs (timestamp, log_level, message, attributes)
-            VALUES (%s, %s, %s, %s)
-        """
+        with request_timings.request("logs", "grpc"):
+            try:
+                with drain_coordinator.request():
+                    metadata = context.invocation_metadata()
+                    tenant_header = self.router.grpc_header_value(metadata)
+                    fingerprint = grpc_fingerprint(self.dedup, "logs", request, tenant_header, metadata)
+                    rejected = self.export(request, tenant_header, fingerprint)
+            except TenantThrottled as e:
+                import grpc
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+            except Draining as e:
+                import grpc
+                context.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+            return logs_response(rejected)
+
+    def export(self, logs_data, tenant_header=None, fingerprint=None):
+        return deduplicated(self.dedup, fingerprint, lambda: self.deliver(logs_data, tenant_header))
+
+    def export_json(self, payload, tenant_header=None, fingerprint=None):
+        if primary_only(self.pipeline, "logs"):
+            return deduplicated(self.dedup, fingerprint, lambda: self.process_logs_json(payload, tenant_header))
+        logs_data = otlp_json.parse_request(payload, logs_service_pb2.ExportLogsServiceRequest())
+        return self.export(logs_data, tenant_header, fingerprint)
+
+    def deliver(self, logs_data, tenant_header=None):
+        if self.pipeline is not None:
+            return self.pipeline.export("logs", logs_data, tenant_header)
+        return self.process_logs(logs_data, tenant_header)
+
+    def process_logs(self, logs_data, tenant_header=None):
+        batches = {}
+        token_batches = {}
+        rejected = 0
         for resource_log in logs_data.resource_logs:
+            tenant = self.router.resolve(tenant_header, resource_log.resource)
+            level = pressure_level(self.admission, self.router, tenant)
+            batch = tenant_batch(batches, tenant, LogRows)
+            batch.nbytes += resource_log.ByteSize()
             for scope_log in resource_log.scope_logs:
                 for log in scope_log.log_records:
-                    timestamp = (
-                        datetime.fromtimestamp(log.time_unix_nano / 1e9)
-                        if log.time_unix_nano
-                        else datetime.now()
-                    )
-                    log_level = log.severity_text or "INFO"
-                    message = (
-                        log.body.string_value
-                        if log.body.HasField("string_value")
-                        else "No message"
-                    )
-                    attributes_dict = {kv.key: parse_any_value(kv.value) for kv in log.attributes}
-                    attributes = json.dumps(attributes_dict) if attributes_dict else "{}"
-                    logger.debug(
-                        f"Inserting log: {timestamp}, {log_level}, {message}, {attributes}"
-                    )
-                    cursor.execute(
-                        insert_sql, (timestamp, log_level, message, attributes)
-                    )
-        cursor.close()
+                    if level and not self.admission.admit_log(level, log.severity_number, log.severity_text):
+                        rejected += 1
+                        continue
+                    timestamp, message = append_log_row(batch.rows, log)
+                    if self.log_index is not None:
+                        token_batch = tenant_batch(token_batches, tenant, LogTokenRows)
+                        self.log_index.index(token_batch.rows, timestamp, message, log.attributes)
+        mark_stage("flatten")
+        self.router.submit(LOGS_INSERT_SQL, batches, current_fingerprint.get())
+        if token_batches:
+            self.submit_tokens(token_batches)
+        mark_stage("submit")
+        if rejected:
+            self.admission.count_rejected("log_records", rejected)
+        return rejected
+
+    def process_logs_json(self, payload, tenant_header=None):
+        # process_logs for a decoded OTLP/JSON request
+        batches = {}
+        token_batches = {}
+        rejected = 0
+        with otlp_json.structure_errors():
+            for resource_log in payload.get("resourceLogs", ()):
+                tenant = self.router.resolve_json(tenant_header, resource_log.get("resource"))
+                level = pressure_level(self.admission, self.router, tenant)
+                batch = tenant_batch(batches, tenant, LogRows)
+                for scope_log in resource_log.get("scopeLogs", ()):
+                    for log in scope_log.get("logRecords", ()):
+                        if level and not self.admission.admit_log(
+                            level, log.get("severityNumber", 0), log.get("severityText", "")
+                        ):
+                            rejected += 1
+                            continue
+                        timestamp, message, attributes = otlp_json.append_log_row(batch.rows, log)
+                        if self.log_index is not None:
+                            token_batch = tenant_batch(token_batches, tenant, LogTokenRows)
+                            self.log_index.index(token_batch.rows, timestamp, message, attributes)
+        for batch in batches.values():
+            batch.nbytes = batch.rows.nbytes
+        mark_stage("flatten")
+        self.router.submit(LOGS_INSERT_SQL, batches, current_fingerprint.get())
+        if token_batches:
+            self.submit_tokens(token_batches)
+        mark_stage("submit")
+        if rejected:
+            self.admission.count_rejected("log_records", rejected)
+        return rejected
+
+    def submit_tokens(self, token_batches):
+        # The index is derived from rows that are already accepted, so it must not fail the
+        # request (a retry would write the logs again); postings that do not fit are dropped
+        for token_batch in token_batches.values():
+            token_batch.nbytes = token_batch.rows.nbytes
+        try:
+            self.router.submit(LOG_TOKENS_INSERT_SQL, token_batches)
+        except TenantThrottled:
+            self.log_index.count_dropped(sum(len(token_batch.rows) for token_batch in token_batches.values()))
 
 # Start the gRPC server
-def start_grpc_server(snowflake_conn):
+def start_grpc_server(trace_service, metrics_service, logs_service):
+    # The services implement the Export methods grpc looks up; they do not subclass the
+    # generated servicers so that HTTP-only (SPCS) mode never has to import grpc
+    import grpc
+    from concurrent import futures
+    from opentelemetry.proto.collector.trace.v1 import trace_service_pb2_grpc
+    from opentelemetry.proto.collector.metrics.v1 import metrics_service_pb2_grpc
+    from opentelemetry.proto.collector.logs.v1 import logs_service_pb2_grpc
+
     if ENABLE_GRPC_COMPRESSION:
         compression_option = grpc.Compression.Gzip
         logger.info("gRPC server will accept compressed data.")
@@ -227,13 +691,13 @@ def start_grpc_server(snowflake_conn):
 
     # Register each OTLP service individually
     trace_service_pb2_grpc.add_TraceServiceServicer_to_server(
-        TraceService(snowflake_conn), server
+        trace_service, server
     )
     metrics_service_pb2_grpc.add_MetricsServiceServicer_to_server(
-        MetricsService(snowflake_conn), server
+        metrics_service, server
     )
     logs_service_pb2_grpc.add_LogsServiceServicer_to_server(
-        LogsService(snowflake_conn), server
+        logs_service, server
     )
 
     server.add_insecure_port("[::]:4317")
@@ -242,101 +706,263 @@ def start_grpc_server(snowflake_conn):
     return server
 
 # Start the FastAPI HTTP server
-def start_http_server(snowflake_conn):
+def start_http_server(trace_service, metrics_service, logs_service, budget=None, readiness=None):
+    from fastapi import FastAPI, Request, HTTPException
+    from fastapi.responses import JSONResponse, Response
+    import uvicorn
+
     app = FastAPI()
+    router = trace_service.router
+
+    def decompress(data, encoding):
+        if not encoding:
+            return data  # No compression
+        if not ENABLE_HTTP_COMPRESSION:
+            raise HTTPException(status_code=415, detail="Compression not supported")
+        if encoding == "gzip":
+            import gzip
+            return gzip.decompress(data)
+        if encoding == "zstd" and zstandard is not None:
+            # Sent by spcs_gateway.py when the zstandard package is installed on both ends
+            return zstandard.ZstdDecompressor().decompress(data, max_output_size=MAX_DECOMPRESSED_BYTES)
+        raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
+
+    def media_type(request):
+        content_type = request.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type not in (PROTOBUF_MEDIA_TYPE, JSON_MEDIA_TYPE):
+            raise HTTPException(status_code=400, detail="Unsupported Media Type")
+        return content_type
+
+    def encode_response(response, content_type):
+        # Answered in the encoding of the request
+        if content_type == JSON_MEDIA_TYPE:
+            from google.protobuf import json_format
+            return JSONResponse(json_format.MessageToDict(response))
+        return Response(content=response.SerializeToString(), media_type=PROTOBUF_MEDIA_TYPE)
+
+    @app.exception_handler(Draining)
+    async def refuse_while_draining(request: Request, e: Draining):
+        # Retryable, so the client sends the request to another replica
+        return JSONResponse({"detail": str(e)}, status_code=503, headers={"Retry-After": str(e.retry_after)})
 
     @app.post("/v1/traces")
     async def receive_traces(request: Request):
-        if request.headers.get("Content-Type") != "application/x-protobuf":
-            raise HTTPException(status_code=400, detail="Unsupported Media Type")
-        try:
-            data = await request.body()
-            encoding = request.headers.get("Content-Encoding", "").lower()
-            if encoding == "gzip":
-                if ENABLE_HTTP_COMPRESSION:
-                    import gzip
-                    data = gzip.decompress(data)
+        with request_timings.request("traces", "http"), drain_coordinator.request():
+            content_type = media_type(request)
+            try:
+                data = await request.body()
+                mark_stage("read")
+                data = decompress(data, request.headers.get("Content-Encoding", "").lower())
+                mark_stage("decompress")
+
+                tenant_header = router.http_header_value(request.headers)
+                fingerprint = http_fingerprint(trace_service.dedup, "traces", data, tenant_header, request.headers)
+                forwarded = FORWARDED_HEADER in request.headers
+                if content_type == JSON_MEDIA_TYPE:
+                    payload = otlp_json.decode_payload(data)
+                    mark_stage("parse")
+                    rejected = trace_service.export_json(payload, tenant_header, forwarded, fingerprint)
                 else:
-                    raise HTTPException(status_code=415, detail="Compression not supported")
-            elif encoding:
-                raise HTTPException(
-                    status_code=415, detail=f"Unsupported Content-Encoding: {encoding}"
-                )
-            else:
-                pass  # No compression
-
-            trace_data = trace_service_pb2.ExportTraceServiceRequest()
-            trace_data.ParseFromString(data)
-            trace_service = TraceService(snowflake_conn)
-            trace_service.process_trace(trace_data)
-            response = trace_service_pb2.ExportTraceServiceResponse()
-            return Response(content=response.SerializeToString(), media_type="application/x-protobuf")
-        except Exception as e:
-            logger.error(f"Error processing traces: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+                    trace_data = trace_service_pb2.ExportTraceServiceRequest()
+                    trace_data.ParseFromString(data)
+                    mark_stage("parse")
+                    rejected = trace_service.export(trace_data, tenant_header, forwarded, fingerprint)
+                mark_stage("sinks")
+                return encode_response(trace_response(rejected), content_type)
+            except TenantThrottled as e:
+                raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+            except otlp_json.InvalidPayload as e:
+                # Malformed OTLP/JSON: bad syntax or structure, hex ids or integer strings
+                raise HTTPException(status_code=400, detail=str(e))
+            except Exception as e:
+                logger.error(f"Error processing traces: {e}")
+                raise HTTPException(status_code=500, detail="Internal Server Error")
 
     @app.post("/v1/metrics")
     async def receive_metrics(request: Request):
-        if request.headers.get("Content-Type") != "application/x-protobuf":
-            raise HTTPException(status_code=400, detail="Unsupported Media Type")
-        try:
-            data = await request.body()
-            encoding = request.headers.get("Content-Encoding", "").lower()
-            if encoding == "gzip":
-                if ENABLE_HTTP_COMPRESSION:
-                    import gzip
-                    data = gzip.decompress(data)
+        with request_timings.request("metrics", "http"), drain_coordinator.request():
+            content_type = media_type(request)
+            try:
+                data = await request.body()
+                mark_stage("read")
+                data = decompress(data, request.headers.get("Content-Encoding", "").lower())
+                mark_stage("decompress")
+
+                tenant_header = router.http_header_value(request.headers)
+                fingerprint = http_fingerprint(metrics_service.dedup, "metrics", data, tenant_header, request.headers)
+                if content_type == JSON_MEDIA_TYPE:
+                    payload = otlp_json.decode_payload(data)
+                    mark_stage("parse")
+                    rejected = metrics_service.export_json(payload, tenant_header, fingerprint)
                 else:
-                    raise HTTPException(status_code=415, detail="Compression not supported")
-            elif encoding:
-                raise HTTPException(
-                    status_code=415, detail=f"Unsupported Content-Encoding: {encoding}"
-                )
-            else:
-                pass  # No compression
-
-            metrics_data = metrics_service_pb2.ExportMetricsServiceRequest()
-            metrics_data.ParseFromString(data)
-            metrics_service = MetricsService(snowflake_conn)
-            metrics_service.process_metrics(metrics_data)
-            response = metrics_service_pb2.ExportMetricsServiceResponse()
-            return Response(content=response.SerializeToString(), media_type="application/x-protobuf")
-        except Exception as e:
-            logger.error(f"Error processing metrics: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+                    metrics_data = metrics_service_pb2.ExportMetricsServiceRequest()
+                    metrics_data.ParseFromString(data)
+                    mark_stage("parse")
+                    rejected = metrics_service.export(metrics_data, tenant_header, fingerprint)
+                mark_stage("sinks")
+                return encode_response(metrics_response(rejected), content_type)
+            except TenantThrottled as e:
+                raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+            except otlp_json.InvalidPayload as e:
+                # Malformed OTLP/JSON: bad syntax or structure, hex ids or integer strings
+                raise HTTPException(status_code=400, detail=str(e))
+            except Exception as e:
+                logger.error(f"Error processing metrics: {e}")
+                raise HTTPException(status_code=500, detail="Internal Server Error")
 
     @app.post("/v1/logs")
     async def receive_logs(request: Request):
-        if request.headers.get("Content-Type") != "application/x-protobuf":
-            raise HTTPException(status_code=400, detail="Unsupported Media Type")
-        try:
-            data = await request.body()
-            encoding = request.headers.get("Content-Encoding", "").lower()
-            if encoding == "gzip":
-                if ENABLE_HTTP_COMPRESSION:
-                    import gzip
-                    data = gzip.decompress(data)
+        with request_timings.request("logs", "http"), drain_coordinator.request():
+            content_type = media_type(request)
+            try:
+                data = await request.body()
+                mark_stage("read")
+                data = decompress(data, request.headers.get("Content-Encoding", "").lower())
+                mark_stage("decompress")
+
+                tenant_header = router.http_header_value(request.headers)
+                fingerprint = http_fingerprint(logs_service.dedup, "logs", data, tenant_header, request.headers)
+                if content_type == JSON_MEDIA_TYPE:
+                    payload = otlp_json.decode_payload(data)
+                    mark_stage("parse")
+                    rejected = logs_service.export_json(payload, tenant_header, fingerprint)
                 else:
-                    raise HTTPException(status_code=415, detail="Compression not supported")
-            elif encoding:
-                raise HTTPException(
-                    status_code=415, detail=f"Unsupported Content-Encoding: {encoding}"
-                )
-            else:
-                pass  # No compression
-
-            logs_data = logs_service_pb2.ExportLogsServiceRequest()
-            logs_data.ParseFromString(data)
-            logs_service = LogsService(snowflake_conn)
-            logs_service.process_logs(logs_data)
-            response = logs_service_pb2.ExportLogsServiceResponse()
-            return Response(content=response.SerializeToString(), media_type="application/x-protobuf")
-        except Exception as e:
-            logger.error(f"Error processing logs: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+                    logs_data = logs_service_pb2.ExportLogsServiceRequest()
+                    logs_data.ParseFromString(data)
+                    mark_stage("parse")
+                    rejected = logs_service.export(logs_data, tenant_header, fingerprint)
+                mark_stage("sinks")
+                return encode_response(logs_response(rejected), content_type)
+            except TenantThrottled as e:
+                raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+            except otlp_json.InvalidPayload as e:
+                # Malformed OTLP/JSON: bad syntax or structure, hex ids or integer strings
+                raise HTTPException(status_code=400, detail=str(e))
+            except Exception as e:
+                logger.error(f"Error processing logs: {e}")
+                raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    @app.get("/v1/status/writers")
+    async def writer_status():
+        # Current operating point of every tenant writer and why the controller chose it
+        return {"tenants": router.stats(), "memory": budget.stats() if budget is not None else None}
+
+    @app.get("/v1/status/sinks")
+    async def sink_status():
+        pipeline = trace_service.pipeline
+        return pipeline.stats() if pipeline is not None else {}
 
+    @app.get("/v1/status/ring")
+    async def ring_status():
+        # Trace affinity ring membership and forwarding volume per peer
+        forwarder = trace_service.forwarder
+        return forwarder.stats() if forwarder is not None else {}
+
+    @app.get("/v1/status/cardinality")
+    async def cardinality_status(top: int = 20):
+        # Metrics with the most distinct attribute sets and their highest-cardinality keys
+        cardinality = metrics_service.cardinality
+        return cardinality.stats(top) if cardinality is not None else {}
+
+    @app.get("/v1/status/log_index")
+    async def log_index_status():
+        # Postings written for log search next to the message bytes they index
+        log_index = logs_service.log_index
+        return log_index.stats() if log_index is not None else {}
+
+    @app.get("/v1/status/codec")
+    async def codec_status():
+        # Hit rate of the span/log attribute JSON cache
+        return attribute_codec.stats()
+
+    @app.get("/v1/status/drain")
+    async def drain_status():
+        return drain_coordinator.stats()
+
+    @app.get("/v1/status/dedup")
+    async def dedup_status():
+        # Retried requests acknowledged without a second write
+        dedup = trace_service.dedup
+        return dedup.stats() if dedup is not None else {}
+
+    @app.get("/healthz")
+    async def healthz():
+        # Liveness only: the event loop is answering
+        return {"status": "ok"}
+
+    @app.get("/readyz")
+    async def readyz():
+        ready, details = readiness() if readiness is not None else (True, {})
+        return JSONResponse(dict(details, ready=ready), status_code=200 if ready else 503)
+
+    def require_admin(request):
+        if not ADMIN_TOKEN:
+            raise HTTPException(status_code=404, detail="Not Found")
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+            raise HTTPException(status_code=401, detail="Unauthorized")
+
+    @app.get("/admin/profile/cpu")
+    async def profile_cpu(request: Request, seconds: float = 10.0, interval: float = 0.01):
+        # Collapsed stacks of all threads, e.g. curl ... > out.folded && flamegraph.pl out.folded
+        require_admin(request)
+        seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+        try:
+            stacks, samples = await asyncio.to_thread(sample_stacks, seconds, max(interval, 0.001))
+        except ProfilerBusy as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        logger.info(f"Captured {samples} CPU samples over {seconds}s")
+        return Response(content=stacks, media_type="text/plain")
+
+    @app.get("/admin/profile/memory")
+    async def profile_memory(request: Request, seconds: float = 10.0, top: int = 25):
+        require_admin(request)
+        seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+        try:
+            return await asyncio.to_thread(allocation_snapshot, seconds, top)
+        except ProfilerBusy as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    @app.get("/admin/profile/requests")
+    async def profile_requests(request: Request, limit: int = 50):
+        require_admin(request)
+        return {"requests": request_timings.recent(limit)}
+
+    server = uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=4318))
+    # Stopped last in a drain so /readyz keeps answering while the writers flush
+    drain_coordinator.on_stop("HTTP server", lambda timeout: setattr(server, "should_exit", True))
     logger.info("HTTP server started on port 4318")
-    uvicorn.run(app, host="0.0.0.0", port=4318)
+    server.run()
+
+def drain_and_stop(grpc_server, router, pipeline, forwarder, flush_stop, flushers, timeout):
+    started = time.monotonic()
+    deadline = started + timeout
+    remaining = lambda: max(deadline - time.monotonic(), 0)
+    drain_coordinator.begin()
+    logger.info(f"Draining for up to {timeout:.0f}s: readiness failing, new exports refused")
+    if not drain_coordinator.wait_idle(timeout):
+        logger.warning(f"{drain_coordinator.in_flight} export requests still running at the drain deadline")
+    if grpc_server is not None:
+        grpc_server.stop(remaining()).wait()
+    if forwarder is not None:
+        # Spans still queued for peers are processed here if they cannot be delivered, so
+        # this runs while the writers and span metrics still accept rows
+        forwarder.stop(remaining() / 2)
+    # Span metrics and service graph write their open window
+    flush_stop.set()
+    for thread in flushers:
+        thread.join(remaining())
+    result = router.drain(remaining())
+    if not result["writers_finished"]:
+        logger.warning("Writer threads were still inserting at the drain deadline")
+    # The other sinks send what they have queued; the Snowflake writers are already stopped
+    pipeline.stop(remaining())
+    drain_coordinator.stop(deadline)
+    logger.info(
+        f"Drained in {time.monotonic() - started:.2f}s: {result['rows_flushed']} rows flushed, "
+        f"{result['rows_persisted']} rows persisted to the spill store, {result['rows_lost']} rows lost"
+    )
+    return result
 
 def main():
     SPCS=os.getenv('SPCS')
@@ -344,22 +970,79 @@ def main():
    
 
     if SPCS=="True":
-        snowflake_conn = connect_to_snowflake_spcs()
-        http_thread = Thread(target=start_http_server, args=(snowflake_conn,))
+        connect = connect_to_snowflake_spcs
+    else:
+        connect = connect_to_snowflake
+    # Log in on a background thread; writers connect on their own threads as well
+    warmup = ConnectionWarmup(connect)
+    budget = MemoryBudget(MEMORY_BUDGET_BYTES, MEMORY_BUDGET_SIGNAL_BYTES)
+    dedup = RequestDeduplicator(DEDUP_MAX_ENTRIES, DEDUP_TTL) if ENABLE_DEDUP else None
+    router = load_tenant_router(connect, TENANT_ROUTING_CONFIG, WRITER_DEFAULTS, budget, dedup)
+
+    admission = None
+    if ENABLE_LOAD_SHEDDING:
+        admission = AdmissionController(
+            ADMISSION_QUEUE_THRESHOLDS, ADMISSION_LATENCY_TARGET, latency_half_life=ADMISSION_LATENCY_HALF_LIFE,
+        )
+        if ADMISSION_CORE_METRICS is not None:
+            admission.core_metric_prefixes = tuple(p for p in ADMISSION_CORE_METRICS.split(",") if p)
+
+    flush_stop = Event()
+    flushers = []
+    span_metrics = None
+    if ENABLE_SPAN_METRICS:
+        span_metrics = SpanMetricsAggregator()
+        warmup.on_connected(lambda conn: flushers.append(
+            start_span_metrics_flusher(span_metrics, conn, SPAN_METRICS_FLUSH_INTERVAL, flush_stop, connect)
+        ))
+
+    service_graph = None
+    if ENABLE_SERVICE_GRAPH:
+        service_graph = ServiceGraphAggregator(SERVICE_GRAPH_MAX_SPANS, SERVICE_GRAPH_SPAN_TTL)
+        warmup.on_connected(lambda conn: flushers.append(
+            start_service_graph_flusher(service_graph, conn, SERVICE_GRAPH_FLUSH_INTERVAL, flush_stop, connect)
+        ))
+    warmup.start()
+
+    trace_service = TraceService(router, span_metrics, service_graph, admission)
+    cardinality = None
+    if METRIC_MAX_SERIES:
+        cardinality = CardinalityLimiter(
+            METRIC_MAX_SERIES, METRIC_CARDINALITY_MODE, METRIC_MAX_VALUES_PER_KEY,
+            window_seconds=METRIC_CARDINALITY_WINDOW,
+        )
+    metrics_service = MetricsService(router, admission, cardinality)
+    log_index = LogIndexer(LOG_INDEX_ATTRIBUTES, LOG_INDEX_BUCKET_SECONDS) if ENABLE_LOG_INDEX else None
+    logs_service = LogsService(router, admission, log_index)
+    pipeline = load_export_pipeline(SnowflakeSink(trace_service, metrics_service, logs_service), SINKS_CONFIG)
+    trace_service.pipeline = metrics_service.pipeline = logs_service.pipeline = pipeline
+    trace_service.dedup = metrics_service.dedup = logs_service.dedup = dedup
+    trace_service.forwarder = build_trace_forwarder(
+        TRACE_AFFINITY_PEERS, TRACE_AFFINITY_DNS, TRACE_AFFINITY_SELF,
+        refresh_seconds=TRACE_AFFINITY_REFRESH, tenant_header_name=router.header,
+        # Spans a peer cannot take are processed here as if they had been forwarded to us
+        fallback=lambda trace_data, tenant_header: trace_service.deliver(trace_data, tenant_header, forwarded=True),
+    )
+    services = (trace_service, metrics_service, logs_service)
+    readiness = lambda: check_readiness(warmup, router, READY_MAX_FILL_RATIO, drain_coordinator)
+    stop_requested = Event()
+    install_signal_handlers(stop_requested)
+
+    grpc_server = None
+    if SPCS=="True":
+        http_thread = Thread(target=start_http_server, args=services + (budget, readiness))
         http_thread.start()
     else:
-        snowflake_conn = connect_to_snowflake()
-        http_thread = Thread(target=start_http_server, args=(snowflake_conn,))
+        http_thread = Thread(target=start_http_server, args=services + (budget, readiness))
         http_thread.start()
         # Start the gRPC server
-        grpc_server = start_grpc_server(snowflake_conn)
-        
-        try:
-            grpc_server.wait_for_termination()
-        except KeyboardInterrupt:
-            grpc_server.stop(None)
-        
-        logger.info("Servers stopped.")
+        grpc_server = start_grpc_server(*services)
+
+    while not stop_requested.wait(1.0):
+        pass
+    drain_and_stop(grpc_server, router, pipeline, trace_service.forwarder, flush_stop, flushers, DRAIN_TIMEOUT)
+    http_thread.join(5.0)
+    logger.info("Servers stopped.")
 
 
 if __name__ == "__main__":
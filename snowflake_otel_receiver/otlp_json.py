@@ -0,0 +1,171 @@
+import base64
+import json
+import time
+from contextlib import contextmanager
+
+from attribute_codec import encode_dict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# OTLP/JSON (https://opentelemetry.io/docs/specs/otlp/#json-protobuf-encoding) differs from
+# protobuf's JSON mapping in that trace and span ids are hex strings. 64-bit integers may be
+# strings or numbers, enums are integers and field names are lowerCamelCase.
+ID_KEYS = ("traceId", "spanId", "parentSpanId")
+
+
+class InvalidPayload(ValueError):
+    """Raised for a body that is not an OTLP/JSON export request."""
+
+
+def decode_payload(data):
+    # An empty body is an empty request, as it is for protobuf
+    if not data:
+        return {}
+    try:
+        payload = orjson.loads(data) if orjson is not None else json.loads(data)
+    except ValueError as e:
+        raise InvalidPayload(f"Invalid JSON: {e}")
+    if not isinstance(payload, dict):
+        raise InvalidPayload("OTLP/JSON request must be a JSON object")
+    return payload
+
+
+@contextmanager
+def structure_errors():
+    # A well-formed JSON body of the wrong shape (a string where the spans array belongs, a span
+    # that is not an object) fails while it is converted with TypeError, AttributeError or
+    # ValueError; those are a bad request, not a server error
+    try:
+        yield
+    except InvalidPayload:
+        raise
+    except (TypeError, AttributeError, ValueError) as e:
+        raise InvalidPayload(f"Malformed OTLP/JSON request: {e}")
+
+
+def hex_ids_to_base64(value):
+    # OTLP/JSON encodes ids as hex while protobuf's JSON mapping expects base64 for bytes
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in ID_KEYS and isinstance(item, str):
+                value[key] = base64.b64encode(bytes.fromhex(item)).decode()
+            else:
+                hex_ids_to_base64(item)
+    elif isinstance(value, list):
+        for item in value:
+            hex_ids_to_base64(item)
+    return value
+
+
+def parse_request(payload, message):
+    # Full protobuf message, for sinks and forwarding that need one
+    from google.protobuf import json_format
+    try:
+        return json_format.ParseDict(hex_ids_to_base64(payload), message, ignore_unknown_fields=True)
+    except json_format.ParseError as e:
+        raise InvalidPayload(str(e))
+    except (TypeError, AttributeError, ValueError) as e:
+        raise InvalidPayload(f"Malformed OTLP/JSON request: {e}")
+
+
+def decode_id(value):
+    try:
+        return bytes.fromhex(value) if value else b""
+    except (TypeError, ValueError):
+        raise InvalidPayload(f"Invalid hex id: {value!r}")
+
+
+def decode_int(value):
+    # int64/uint64/fixed64 fields arrive as strings or numbers
+    try:
+        return int(value) if value else 0
+    except (TypeError, ValueError):
+        raise InvalidPayload(f"Invalid integer: {value!r}")
+
+
+def decode_double(value):
+    # Numbers, or the strings "NaN", "Infinity" and "-Infinity"
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise InvalidPayload(f"Invalid number: {value!r}")
+
+
+def _array(value):
+    return [decode_any_value(item) for item in value.get("values", ())]
+
+
+def _kvlist(value):
+    return decode_attributes(value.get("values", ()))
+
+
+# AnyValue JSON key -> decoder, the counterpart of attribute_codec.DECODERS
+DECODERS = {
+    "stringValue": lambda value: value,
+    "boolValue": lambda value: value,
+    "intValue": decode_int,
+    "doubleValue": decode_double,
+    "arrayValue": _array,
+    "kvlistValue": _kvlist,
+    # Written base64 encoded, as attribute_codec writes bytes values
+    "bytesValue": lambda value: value,
+}
+
+
+def decode_any_value(any_value):
+    for key, value in any_value.items():
+        decoder = DECODERS.get(key)
+        if decoder is not None:
+            return decoder(value)
+    return None
+
+
+def decode_attributes(attributes):
+    return {kv.get("key", ""): decode_any_value(kv.get("value") or {}) for kv in attributes}
+
+
+def resource_attribute(resource, key):
+    for kv in (resource or {}).get("attributes", ()):
+        if kv.get("key") == key:
+            return (kv.get("value") or {}).get("stringValue")
+    return None
+
+
+def get_service_name(resource):
+    return resource_attribute(resource, "service.name") or "unknown"
+
+
+# Row builders matching the receiver's append_*_row for protobuf requests
+def append_span_row(rows, span):
+    start_time = decode_int(span.get("startTimeUnixNano")) or time.time_ns()
+    end_time = decode_int(span.get("endTimeUnixNano")) or time.time_ns()
+    attributes = encode_dict(decode_attributes(span.get("attributes", ())))
+    rows.append(
+        decode_id(span.get("traceId")), decode_id(span.get("spanId")), span.get("name") or "unknown",
+        start_time, end_time, attributes,
+    )
+
+
+def metric_value_and_attributes(metric):
+    points = (metric.get("gauge") or metric.get("sum") or {}).get("dataPoints")
+    if not points:
+        return None, {}
+    point = points[0]
+    if "asDouble" in point:
+        value = decode_double(point["asDouble"])
+    else:
+        value = decode_int(point.get("asInt"))
+    return value, decode_attributes(point.get("attributes", ()))
+
+
+def append_log_row(rows, log):
+    timestamp = decode_int(log.get("timeUnixNano")) or time.time_ns()
+    body = log.get("body") or {}
+    message = body["stringValue"] if "stringValue" in body else "No message"
+    attributes = decode_attributes(log.get("attributes", ()))
+    rows.append(timestamp, log.get("severityText") or "INFO", message, encode_dict(attributes))
+    # The decoded attributes go on to the log index
+    return timestamp, message, attributes
@@ -0,0 +1,154 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from contextlib import contextmanager
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is still being captured."""
+
+
+class RequestTimer:
+    __slots__ = ("signal", "transport", "started_at", "started", "last", "stages")
+
+    def __init__(self, signal, transport):
+        self.signal = signal
+        self.transport = transport
+        self.started_at = time.time()
+        self.started = self.last = time.perf_counter()
+        self.stages = []
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+
+class RequestTimings:
+    """
+    Wall-clock time spent in each stage (read, decompress, parse, flatten, submit, ...) of
+    the last max_requests export requests. A request costs a handful of perf_counter() calls
+    and one deque append, so this stays on all the time.
+    """
+
+    def __init__(self, max_requests=200):
+        self.requests = deque(maxlen=max_requests)
+
+    @contextmanager
+    def request(self, signal, transport):
+        timer = RequestTimer(signal, transport)
+        token = current_request.set(timer)
+        status = "ok"
+        try:
+            yield timer
+        except BaseException as e:
+            status = type(e).__name__
+            raise
+        finally:
+            timer.mark("respond")
+            current_request.reset(token)
+            self.requests.append((timer, status))
+
+    def recent(self, limit=None):
+        requests = list(self.requests)
+        if limit:
+            requests = requests[-limit:]
+        return [
+            {
+                "signal": timer.signal,
+                "transport": timer.transport,
+                "started_at": timer.started_at,
+                "status": status,
+                "total_ms": round((timer.last - timer.started) * 1e3, 3),
+                "stages_ms": {stage: round(seconds * 1e3, 3) for stage, seconds in timer.stages},
+            }
+            for timer, status in requests
+        ]
+
+
+def mark_stage(stage):
+    # Closes the named stage of the request being handled on this thread or task, if any
+    timer = current_request.get()
+    if timer is not None:
+        timer.mark(stage)
+
+
+profile_lock = threading.Lock()
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+def sample_stacks(seconds, interval=0.01):
+    """
+    Samples the stack of every thread (HTTP event loop, gRPC pool, batch writers, flushers)
+    every interval seconds and returns them in the collapsed format read by flamegraph.pl
+    and speedscope: one "thread;outer;...;inner count" line per distinct stack. Nothing is
+    hooked into the interpreter, so there is no cost outside of a capture.
+    """
+    if not profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already being captured")
+    try:
+        own_ident = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        samples = 0
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}"))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(interval)
+        lines = [f"{stack} {count}" for stack, count in stacks.most_common()]
+        return "\n".join(lines) + "\n", samples
+    finally:
+        profile_lock.release()
+
+
+def allocation_snapshot(seconds, top=25, frames=10):
+    """
+    Top allocation sites by live size. If tracemalloc is not already running it is started
+    for the capture window only and stopped again afterwards.
+    """
+    if not profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already being captured")
+    started_here = not tracemalloc.is_tracing()
+    try:
+        if started_here:
+            tracemalloc.start(frames)
+            time.sleep(seconds)
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        statistics = snapshot.statistics("traceback")[:top]
+        return {
+            "traced_current_bytes": current,
+            "traced_peak_bytes": peak,
+            "window_seconds": seconds if started_here else None,
+            "top": [
+                {
+                    "size_bytes": stat.size,
+                    "count": stat.count,
+                    "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                }
+                for stat in statistics
+            ],
+        }
+    finally:
+        if started_here:
+            tracemalloc.stop()
+        profile_lock.release()
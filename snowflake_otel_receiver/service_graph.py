@@ -0,0 +1,134 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from span_metrics import LATENCY_BUCKETS_MS, LatencyHistogram, insert_window, merge_histograms, start_flusher
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceGraphAggregator:
+    """
+    Joins child spans to their parent's service.name through a bounded, time-limited index of
+    recent spans keyed by span_id and aggregates caller -> callee edges between flushes.
+
+    Children usually finish, and are therefore exported, before their parent. A child whose
+    parent has not been seen yet is parked in a second bounded index keyed by parent_span_id
+    and joined when the parent arrives.
+    """
+
+    def __init__(self, max_spans=100000, span_ttl_seconds=120, table_name="service_graph_edges"):
+        self.max_spans = max_spans
+        self.span_ttl_seconds = span_ttl_seconds
+        self.table_name = table_name
+        self.lock = threading.Lock()
+        # span_id -> (expires_at, service_name)
+        self.spans = OrderedDict()
+        # parent_span_id -> (expires_at, [(service_name, duration_ms, is_error), ...])
+        self.pending = OrderedDict()
+        self.edges = {}
+        self.expired_unmatched = 0
+        self.window_start = datetime.now()
+
+    def record(self, span_id, parent_span_id, service_name, duration_ms, is_error):
+        now = time.monotonic()
+        with self.lock:
+            self.evict(now)
+            if span_id:
+                self.spans[span_id] = (now + self.span_ttl_seconds, service_name)
+                self.spans.move_to_end(span_id)
+                if len(self.spans) > self.max_spans:
+                    self.spans.popitem(last=False)
+                waiting = self.pending.pop(span_id, None)
+                if waiting is not None:
+                    for child_service, child_duration_ms, child_is_error in waiting[1]:
+                        self.add_edge(service_name, child_service, child_duration_ms, child_is_error)
+            if not parent_span_id:
+                return
+            parent = self.spans.get(parent_span_id)
+            if parent is not None:
+                self.add_edge(parent[1], service_name, duration_ms, is_error)
+            else:
+                waiting = self.pending.get(parent_span_id)
+                if waiting is None:
+                    waiting = self.pending[parent_span_id] = (now + self.span_ttl_seconds, [])
+                    if len(self.pending) > self.max_spans:
+                        self.pending.popitem(last=False)
+                        self.expired_unmatched += 1
+                waiting[1].append((service_name, duration_ms, is_error))
+
+    def add_edge(self, caller, callee, duration_ms, is_error):
+        # Only calls that cross a service boundary are edges of the service map
+        if caller == callee:
+            return
+        histogram = self.edges.get((caller, callee))
+        if histogram is None:
+            histogram = self.edges[(caller, callee)] = LatencyHistogram()
+        histogram.observe(duration_ms, is_error)
+
+    def evict(self, now):
+        # Both indexes are in insertion order, so expired entries are always at the front
+        while self.spans:
+            span_id, (expires_at, _) = next(iter(self.spans.items()))
+            if expires_at > now:
+                break
+            del self.spans[span_id]
+        while self.pending:
+            parent_span_id, (expires_at, _) = next(iter(self.pending.items()))
+            if expires_at > now:
+                break
+            del self.pending[parent_span_id]
+            self.expired_unmatched += 1
+
+    def drain(self):
+        with self.lock:
+            edges, self.edges = self.edges, {}
+            window_start, self.window_start = self.window_start, datetime.now()
+        return window_start, self.window_start, edges
+
+    def restore(self, window_start, edges):
+        with self.lock:
+            merge_histograms(self.edges, edges)
+            self.window_start = window_start
+
+    def flush(self, snowflake_conn):
+        window_start, window_end, edges = self.drain()
+        if not edges:
+            return 0
+        insert_sql = f"""
+            INSERT INTO {self.table_name} (window_start, window_end, caller, callee, call_count, error_count,
+                duration_sum_ms, duration_min_ms, duration_max_ms, bucket_bounds_ms, bucket_counts)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        bounds = json.dumps(LATENCY_BUCKETS_MS)
+        rows = [
+            (
+                window_start,
+                window_end,
+                caller,
+                callee,
+                histogram.count,
+                histogram.error_count,
+                histogram.sum_ms,
+                histogram.min_ms,
+                histogram.max_ms,
+                bounds,
+                json.dumps(histogram.bucket_counts),
+            )
+            for (caller, callee), histogram in edges.items()
+        ]
+        insert_window(snowflake_conn, insert_sql, rows, lambda: self.restore(window_start, edges))
+        logger.debug(
+            f"Flushed {len(rows)} service graph edges, {len(self.spans)} spans indexed, "
+            f"{len(self.pending)} children waiting, {self.expired_unmatched} expired unmatched"
+        )
+        return len(rows)
+
+
+def start_service_graph_flusher(aggregator, snowflake_conn, interval_seconds, stop_event=None, connect=None):
+    return start_flusher(
+        aggregator.flush, snowflake_conn, interval_seconds, stop_event or threading.Event(), "service graph", connect
+    )
@@ -0,0 +1,90 @@
+import logging
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Draining(Exception):
+    """Raised for an export request that arrives after shutdown has begun."""
+
+    def __init__(self, message="Receiver is shutting down", retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DrainCoordinator:
+    """
+    Coordinates a graceful shutdown. Once begin() is called /readyz fails and new export
+    requests are refused with 503/UNAVAILABLE so clients retry them on another replica,
+    while the requests already in flight run to completion; wait_idle() returns once they
+    have. Servers register a stop callback with on_stop and are stopped in order by stop().
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.draining = False
+        self.began_at = None
+        self.in_flight = 0
+        self.refused = 0
+        self.stoppers = []
+
+    @contextmanager
+    def request(self):
+        with self.cond:
+            if self.draining:
+                self.refused += 1
+                raise Draining()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.in_flight -= 1
+                if not self.in_flight:
+                    self.cond.notify_all()
+
+    def begin(self):
+        with self.cond:
+            if self.draining:
+                return False
+            self.draining = True
+            self.began_at = time.monotonic()
+            return True
+
+    def wait_idle(self, timeout=None):
+        # True once no request is in flight, False if some are still running at the timeout
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.in_flight, timeout)
+
+    def on_stop(self, name, stop):
+        # stop(timeout) is called with the time left until the drain deadline
+        self.stoppers.append((name, stop))
+
+    def stop(self, deadline):
+        for name, stop in self.stoppers:
+            try:
+                stop(max(deadline - time.monotonic(), 0))
+            except Exception as e:
+                logger.error(f"Error stopping {name}: {e}")
+
+    def stats(self):
+        with self.cond:
+            return {
+                "draining": self.draining,
+                "draining_seconds": round(time.monotonic() - self.began_at, 3) if self.draining else None,
+                "requests_in_flight": self.in_flight,
+                "requests_refused": self.refused,
+            }
+
+
+def install_signal_handlers(stop_requested):
+    # SIGTERM (container stop, SPCS service upgrade) and Ctrl-C both start a graceful drain
+    def handle(signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name}, shutting down")
+        stop_requested.set()
+
+    signal.signal(signal.SIGTERM, handle)
+    signal.signal(signal.SIGINT, handle)
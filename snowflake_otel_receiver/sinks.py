@@ -0,0 +1,414 @@
+import gzip
+import http.client
+import json
+import logging
+import os
+import queue
+import random
+import struct
+import threading
+import time
+from threading import Thread
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+SIGNALS = ("traces", "metrics", "logs")
+SIGNAL_PATHS = {"traces": "/v1/traces", "metrics": "/v1/metrics", "logs": "/v1/logs"}
+
+
+class PermanentSinkError(Exception):
+    """Raised by a sink when retrying the same data can never succeed."""
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=5, initial_backoff=0.5, max_backoff=30.0, multiplier=2.0):
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.multiplier = multiplier
+
+    def call(self, fn, stop_event):
+        backoff = self.initial_backoff
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return fn()
+            except PermanentSinkError:
+                raise
+            except Exception:
+                if attempt == self.max_attempts or stop_event.is_set():
+                    raise
+                # Full jitter keeps retries from several sinks or replicas from lining up
+                stop_event.wait(random.uniform(0, backoff))
+                backoff = min(backoff * self.multiplier, self.max_backoff)
+
+
+class Sink:
+    """
+    Destination for accepted export requests. export() is called on the request path and
+    returns the number of items the sink rejected; it must not block on slow I/O.
+    """
+
+    name = None
+
+    def export(self, signal, request, tenant_header=None):
+        raise NotImplementedError
+
+    def stop(self, timeout=None):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class SnowflakeSink(Sink):
+    """Flattens requests into rows for the tenant batch writers through the OTLP services."""
+
+    def __init__(self, trace_service, metrics_service, logs_service, name="snowflake"):
+        self.name = name
+        self.trace_service = trace_service
+        self.metrics_service = metrics_service
+        self.logs_service = logs_service
+
+    def export(self, signal, request, tenant_header=None):
+        if signal == "traces":
+            return self.trace_service.process_trace(request, tenant_header)
+        if signal == "metrics":
+            return self.metrics_service.process_metrics(request, tenant_header)
+        return self.logs_service.process_logs(request, tenant_header)
+
+    def stop(self, timeout=None):
+        self.trace_service.router.stop(timeout)
+
+    def stats(self):
+        return self.trace_service.router.stats()
+
+
+class QueuedSink(Sink):
+    """
+    Base for sinks that do their own I/O: requests go into a bounded per-sink queue and a
+    worker thread sends them in batches of up to max_batch requests under a RetryPolicy.
+    When the queue is full the request is dropped for this sink only. Requests that still
+    fail after the last retry go to on_failure(signal, requests) if one is given.
+    """
+
+    def __init__(self, name, queue_size=1000, max_batch=64, flush_interval=1.0, retry=None, on_failure=None):
+        self.name = name
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.retry = retry or RetryPolicy()
+        self.on_failure = on_failure
+        self.stop_event = threading.Event()
+        self.requests_sent = 0
+        self.requests_dropped = 0
+        self.requests_failed = 0
+        self.thread = Thread(target=self.run, name=f"sink-{name}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def export(self, signal, request, tenant_header=None):
+        if not self.try_export(signal, request):
+            self.requests_dropped += 1
+        return 0
+
+    def try_export(self, signal, request):
+        try:
+            self.queue.put_nowait((signal, request))
+            return True
+        except queue.Full:
+            return False
+
+    def take_batch(self):
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            batch = self.take_batch()
+            by_signal = {}
+            for signal, request in batch:
+                by_signal.setdefault(signal, []).append(request)
+            for signal, requests in by_signal.items():
+                try:
+                    self.retry.call(lambda: self.send(signal, requests), self.stop_event)
+                    self.requests_sent += len(requests)
+                except Exception as e:
+                    self.requests_failed += len(requests)
+                    if self.on_failure is None:
+                        logger.error(f"Sink '{self.name}' dropped {len(requests)} {signal} requests: {e}")
+                        continue
+                    logger.warning(f"Sink '{self.name}' could not send {len(requests)} {signal} requests: {e}")
+                    self.on_failure(signal, requests)
+        self.close()
+
+    def send(self, signal, requests):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+    def take_unsent(self):
+        # Requests still queued, e.g. after stop() timed out; they are no longer sent
+        unsent = []
+        while True:
+            try:
+                unsent.append(self.queue.get_nowait())
+            except queue.Empty:
+                return unsent
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "requests_sent": self.requests_sent,
+            "requests_dropped": self.requests_dropped,
+            "requests_failed": self.requests_failed,
+        }
+
+
+class FileSink(QueuedSink):
+    """
+    Archives requests to rotating local files, one stream per signal, in the collector file
+    exporter's proto format: each serialized export request is prefixed with its length as a
+    4-byte big-endian integer. Files rotate by size or age and only the newest max_files per
+    signal are kept.
+    """
+
+    def __init__(self, name, directory, max_bytes=256 * 1024 ** 2, max_age_seconds=3600, max_files=24,
+                 **kwargs):
+        super().__init__(name, **kwargs)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.max_files = max_files
+        # signal -> (file, path, opened_at)
+        self.files = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def current_file(self, signal):
+        current = self.files.get(signal)
+        if current is not None:
+            f, path, opened_at = current
+            if f.tell() < self.max_bytes and time.monotonic() - opened_at < self.max_age_seconds:
+                return f
+            f.close()
+            self.prune(signal)
+        path = os.path.join(self.directory, f"{signal}-{time.time_ns()}.binpb")
+        f = open(path, "ab")
+        self.files[signal] = (f, path, time.monotonic())
+        return f
+
+    def prune(self, signal):
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith(f"{signal}-") and n.endswith(".binpb"))
+        for name in names[:-self.max_files]:
+            os.remove(os.path.join(self.directory, name))
+
+    def send(self, signal, requests):
+        f = self.current_file(signal)
+        for request in requests:
+            data = request.SerializeToString()
+            f.write(struct.pack(">I", len(data)))
+            f.write(data)
+        f.flush()
+
+    def close(self):
+        for f, _, _ in self.files.values():
+            f.close()
+
+
+class OtlpHttpSink(QueuedSink):
+    """
+    Forwards requests to another OTLP/HTTP endpoint over one keep-alive connection, merging
+    each batch into a single gzip-compressed export request per signal.
+    """
+
+    def __init__(self, name, endpoint, headers=None, timeout=10.0, **kwargs):
+        super().__init__(name, **kwargs)
+        url = urlsplit(endpoint)
+        self.secure = url.scheme == "https"
+        self.netloc = url.netloc
+        self.base_path = url.path.rstrip("/")
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self.connection = None
+
+    def send(self, signal, requests):
+        merged = type(requests[0])()
+        for request in requests:
+            merged.MergeFrom(request)
+        body = gzip.compress(merged.SerializeToString())
+        headers = dict(self.headers, **{"Content-Type": "application/x-protobuf", "Content-Encoding": "gzip"})
+        if self.connection is None:
+            connection_class = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
+            self.connection = connection_class(self.netloc, timeout=self.timeout)
+        try:
+            self.connection.request("POST", self.base_path + SIGNAL_PATHS[signal], body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+        except Exception:
+            self.connection.close()
+            self.connection = None
+            raise
+        if response.status in (429, 502, 503, 504):
+            raise IOError(f"{self.netloc} answered {response.status}")
+        if response.status >= 400:
+            raise PermanentSinkError(f"{self.netloc} answered {response.status}")
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+class MemorySink(Sink):
+    """Keeps every exported request in memory, for tests and local debugging."""
+
+    def __init__(self, name="memory"):
+        self.name = name
+        self.lock = threading.Lock()
+        self.requests = {signal: [] for signal in SIGNALS}
+
+    def export(self, signal, request, tenant_header=None):
+        with self.lock:
+            self.requests[signal].append((request, tenant_header))
+        return 0
+
+    def stats(self):
+        with self.lock:
+            return {signal: len(requests) for signal, requests in self.requests.items()}
+
+
+class ExportPipeline:
+    """
+    Fans each accepted request out to the sinks routed for its signal. The primary sink
+    (Snowflake) runs first on the request path and decides throttling and partial success;
+    the other sinks only enqueue, so a slow one never holds up the rest.
+    """
+
+    def __init__(self, sinks, routes, primary="snowflake"):
+        self.sinks = sinks
+        self.primary = primary
+        self.routes = {
+            signal: sorted((sinks[name] for name in routes.get(signal, ())), key=lambda s: s.name != primary)
+            for signal in SIGNALS
+        }
+
+    def export(self, signal, request, tenant_header=None):
+        rejected = 0
+        for sink in self.routes[signal]:
+            result = sink.export(signal, request, tenant_header)
+            if sink.name == self.primary:
+                rejected = result
+        return rejected
+
+    def primary_only(self, signal):
+        # True when the signal goes to the primary sink alone, which can take rows from OTLP/JSON directly
+        sinks = self.routes[signal]
+        return len(sinks) == 1 and sinks[0].name == self.primary
+
+    def stop(self, timeout=None):
+        for sink in self.sinks.values():
+            sink.stop(timeout)
+
+    def stats(self):
+        return {
+            "routes": {signal: [sink.name for sink in sinks] for signal, sinks in self.routes.items()},
+            "sinks": {name: sink.stats() for name, sink in self.sinks.items()},
+        }
+
+
+def build_sink(name, config):
+    sink_type = config.get("type")
+    retry = RetryPolicy(
+        max_attempts=int(config.get("max_attempts", 5)),
+        initial_backoff=float(config.get("initial_backoff", 0.5)),
+        max_backoff=float(config.get("max_backoff", 30.0)),
+    )
+    queue_options = {
+        "queue_size": int(config.get("queue_size", 1000)),
+        "max_batch": int(config.get("max_batch", 64)),
+        "flush_interval": float(config.get("flush_interval", 1.0)),
+        "retry": retry,
+    }
+    if sink_type == "file":
+        return FileSink(
+            name,
+            config["directory"],
+            max_bytes=int(config.get("max_bytes", 256 * 1024 ** 2)),
+            max_age_seconds=float(config.get("max_age_seconds", 3600)),
+            max_files=int(config.get("max_files", 24)),
+            **queue_options,
+        ).start()
+    if sink_type == "otlp_http":
+        return OtlpHttpSink(
+            name, config["endpoint"], headers=config.get("headers"), timeout=float(config.get("timeout", 10.0)),
+            **queue_options,
+        ).start()
+    if sink_type == "memory":
+        return MemorySink(name)
+    raise ValueError(f"Unknown sink type '{sink_type}' for sink '{name}'")
+
+
+def failover(sinks, name, target_name):
+    # on_failure callback that hands a queued sink's failed requests to another sink
+    if target_name == name or target_name not in sinks:
+        raise ValueError(f"on_failure of sink '{name}' names an unknown sink '{target_name}'")
+    if not isinstance(sinks[name], QueuedSink):
+        raise ValueError(f"Sink '{name}' does not retry, so it cannot have an on_failure sink")
+    target = sinks[target_name]
+
+    def on_failure(signal, requests):
+        try:
+            for request in requests:
+                target.export(signal, request)
+        except Exception as e:
+            logger.error(f"Sink '{target_name}' did not take the failed {signal} requests of '{name}': {e}")
+    return on_failure
+
+
+def load_export_pipeline(snowflake_sink, config_path=None):
+    """
+    Builds the pipeline from a JSON file such as:
+
+        {"sinks": {"archive": {"type": "file", "directory": "/data/otlp", "max_files": 48},
+                   "mirror": {"type": "otlp_http", "endpoint": "http://collector:4318",
+                              "queue_size": 5000, "max_attempts": 8}},
+         "routes": {"traces": ["snowflake", "archive", "mirror"], "metrics": ["snowflake"],
+                    "logs": ["snowflake", "archive"]}}
+
+    Signals without a route, and every signal when there is no file, go to the Snowflake
+    sink only. A queued sink can name another sink in "on_failure", e.g. "archive", to take
+    the requests it could not send after its last retry.
+    """
+    config = {}
+    if config_path:
+        with open(config_path) as f:
+            config = json.load(f)
+    sinks = {snowflake_sink.name: snowflake_sink}
+    for name, sink_config in config.get("sinks", {}).items():
+        sinks[name] = build_sink(name, sink_config)
+    for name, sink_config in config.get("sinks", {}).items():
+        if sink_config.get("on_failure"):
+            sinks[name].on_failure = failover(sinks, name, sink_config["on_failure"])
+    routes = {signal: config.get("routes", {}).get(signal, [snowflake_sink.name]) for signal in SIGNALS}
+    pipeline = ExportPipeline(sinks, routes, primary=snowflake_sink.name)
+    logger.info(f"Export routes: {pipeline.stats()['routes']}")
+    return pipeline
@@ -0,0 +1,198 @@
+import json
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Fixed latency bucket upper bounds in milliseconds; one extra overflow bucket is kept
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# OTLP Status.StatusCode values
+STATUS_CODE_NAMES = {0: "UNSET", 1: "OK", 2: "ERROR"}
+
+
+def bucket_index(duration_ms, bounds=LATENCY_BUCKETS_MS):
+    for i, bound in enumerate(bounds):
+        if duration_ms <= bound:
+            return i
+    return len(bounds)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with count, sum, min and max."""
+
+    __slots__ = ("bucket_counts", "count", "error_count", "sum_ms", "min_ms", "max_ms")
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.error_count = 0
+        self.sum_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+
+    def observe(self, duration_ms, is_error=False):
+        self.bucket_counts[bucket_index(duration_ms)] += 1
+        self.count += 1
+        if is_error:
+            self.error_count += 1
+        self.sum_ms += duration_ms
+        if self.min_ms is None or duration_ms < self.min_ms:
+            self.min_ms = duration_ms
+        if self.max_ms is None or duration_ms > self.max_ms:
+            self.max_ms = duration_ms
+
+    def merge(self, other):
+        for i, count in enumerate(other.bucket_counts):
+            self.bucket_counts[i] += count
+        self.count += other.count
+        self.error_count += other.error_count
+        self.sum_ms += other.sum_ms
+        if other.min_ms is not None and (self.min_ms is None or other.min_ms < self.min_ms):
+            self.min_ms = other.min_ms
+        if other.max_ms is not None and (self.max_ms is None or other.max_ms > self.max_ms):
+            self.max_ms = other.max_ms
+
+
+def merge_histograms(into, histograms):
+    for key, histogram in histograms.items():
+        current = into.get(key)
+        if current is None:
+            into[key] = histogram
+        else:
+            current.merge(histogram)
+
+
+def insert_window(snowflake_conn, insert_sql, rows, restore):
+    # A window whose INSERT fails is handed back through restore(), which merges it into the
+    # window recorded since, so the next flush writes both instead of losing it
+    try:
+        cursor = snowflake_conn.cursor()
+        try:
+            cursor.executemany(insert_sql, rows)
+        finally:
+            cursor.close()
+    except Exception:
+        restore()
+        raise
+
+
+class SpanMetricsAggregator:
+    """
+    Keeps per (service, span name, kind, status) request counters and latency histograms
+    in memory and periodically flushes them as rows into the span_metrics table.
+    """
+
+    def __init__(self, table_name="span_metrics"):
+        self.table_name = table_name
+        self.lock = threading.Lock()
+        self.series = {}
+        self.window_start = datetime.now()
+
+    def record(self, service_name, span_name, span_kind, status_code, duration_ms):
+        key = (service_name, span_name, span_kind, STATUS_CODE_NAMES.get(status_code, "UNSET"))
+        with self.lock:
+            histogram = self.series.get(key)
+            if histogram is None:
+                histogram = self.series[key] = LatencyHistogram()
+            histogram.observe(duration_ms, status_code == 2)
+
+    def drain(self):
+        # Swap out the current window so recording never waits on a Snowflake round trip
+        with self.lock:
+            series, self.series = self.series, {}
+            window_start, self.window_start = self.window_start, datetime.now()
+        return window_start, self.window_start, series
+
+    def restore(self, window_start, series):
+        with self.lock:
+            merge_histograms(self.series, series)
+            self.window_start = window_start
+
+    def rows(self, window_start, window_end, series):
+        bounds = json.dumps(LATENCY_BUCKETS_MS)
+        for (service_name, span_name, span_kind, status), histogram in series.items():
+            yield (
+                window_start,
+                window_end,
+                service_name,
+                span_name,
+                span_kind,
+                status,
+                histogram.count,
+                histogram.error_count,
+                histogram.sum_ms,
+                histogram.min_ms,
+                histogram.max_ms,
+                bounds,
+                json.dumps(histogram.bucket_counts),
+            )
+
+    def flush(self, snowflake_conn):
+        window_start, window_end, series = self.drain()
+        if not series:
+            return 0
+        insert_sql = f"""
+            INSERT INTO {self.table_name} (window_start, window_end, service_name, span_name, span_kind,
+                status_code, call_count, error_count, duration_sum_ms, duration_min_ms, duration_max_ms,
+                bucket_bounds_ms, bucket_counts)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        rows = list(self.rows(window_start, window_end, series))
+        insert_window(snowflake_conn, insert_sql, rows, lambda: self.restore(window_start, series))
+        logger.debug(f"Flushed {len(rows)} span metric rows for window {window_start} - {window_end}")
+        return len(rows)
+
+
+def run_periodic_flush(flush, snowflake_conn, interval_seconds, stop_event, name, connect=None):
+    # flush(conn) writes one window. A failed flush usually means the session is gone (dropped
+    # connection, expired token), so with connect given the next flush logs in again.
+    owned = False
+
+    def flush_once():
+        nonlocal snowflake_conn, owned
+        if snowflake_conn is None:
+            snowflake_conn, owned = connect(), True
+        try:
+            return flush(snowflake_conn)
+        except Exception:
+            if connect is not None:
+                # The warmup connection is shared with the other flusher, so only close our own
+                if owned:
+                    try:
+                        snowflake_conn.close()
+                    except Exception:
+                        pass
+                snowflake_conn, owned = None, False
+            raise
+
+    while not stop_event.wait(interval_seconds):
+        try:
+            flush_once()
+        except Exception as e:
+            logger.error(f"Error flushing {name}: {e}")
+    # Stopped at shutdown: write the window collected so far
+    try:
+        flushed = flush_once()
+        logger.info(f"Flushed {flushed} {name} rows at shutdown")
+    except Exception as e:
+        logger.error(f"Error flushing {name} at shutdown: {e}")
+
+
+def start_flusher(flush, snowflake_conn, interval_seconds, stop_event, name, connect=None):
+    thread = threading.Thread(
+        target=run_periodic_flush,
+        args=(flush, snowflake_conn, interval_seconds, stop_event, name, connect),
+        name=name.replace(" ", "-") + "-flusher",
+        daemon=True,
+    )
+    thread.start()
+    logger.info(f"{name.capitalize()} flusher started with a {interval_seconds}s interval")
+    return thread
+
+
+def start_span_metrics_flusher(aggregator, snowflake_conn, interval_seconds, stop_event=None, connect=None):
+    return start_flusher(
+        aggregator.flush, snowflake_conn, interval_seconds, stop_event or threading.Event(), "span metrics", connect
+    )
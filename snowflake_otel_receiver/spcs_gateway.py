@@ -0,0 +1,330 @@
+# Local OTLP/HTTP gateway to the receiver's public SPCS endpoint.
+#
+# To run this on the command line, enter:
+#   python3 spcs_gateway.py --account <account> --user <user> --private_key_file_path <rsa_key.p8> \
+#       --endpoint <xxxx.snowflakecomputing.app> --role <role>
+#
+# and point the collector's otlphttp exporter at http://127.0.0.1:4318 without any headers.
+# The gateway keeps one exchanged Snowflake token and refreshes it before it expires, batches
+# the requests it receives per signal and forwards them over pooled keep-alive connections,
+# compressed with zstd (when the zstandard package is installed) or gzip, retrying on
+# throttling, server errors and expired tokens. Against a receiver that answers 415 to zstd
+# the gateway switches to gzip.
+
+import argparse
+import gzip
+import logging
+import queue
+import sys
+import threading
+import time
+from datetime import timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from generateJWT import JWTGenerator
+from sinks import PermanentSinkError, RetryPolicy, SIGNAL_PATHS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+class TokenExpired(Exception):
+    """Raised when the ingress rejects the exchanged token."""
+
+
+class TokenExchangeError(Exception):
+    """Raised when Snowflake does not exchange the key pair JWT for a token."""
+
+
+def exchange_token(jwt, endpoint, role=None, snowflake_account_url=None, snowflake_account=None, timeout=30.0):
+    # The OAuth exchange of access-via-keypair.py without its logging: neither the JWT
+    # assertion nor the exchanged token is ever printed or logged
+    scope = f"session:role:{role} {endpoint}" if role is not None else endpoint
+    url = f"https://{snowflake_account}.snowflakecomputing.com/oauth/token"
+    if snowflake_account_url:
+        url = f"{snowflake_account_url}/oauth/token"
+    response = requests.post(
+        url,
+        data={"grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer", "scope": scope, "assertion": jwt},
+        timeout=timeout,
+    )
+    if response.status_code != 200:
+        raise TokenExchangeError(f"Token exchange at {url} failed with HTTP {response.status_code} {response.reason}")
+    return response.text
+
+
+class ExchangedToken:
+    """
+    Snowflake token for the ingress endpoint, exchanged from a key pair JWT. A background
+    thread exchanges a new one every refresh_seconds, well before the old one expires, so
+    requests never wait for a login; refresh() forces an exchange after a 401.
+    """
+
+    def __init__(self, args, refresh_seconds):
+        self.args = args
+        self.refresh_seconds = refresh_seconds
+        self.generator = JWTGenerator(
+            args.account, args.user, args.private_key_file_path, timedelta(minutes=args.lifetime),
+            timedelta(minutes=args.renewal_delay),
+        )
+        self.lock = threading.Lock()
+        self.token = None
+        self.exchanged_at = 0.0
+        self.exchanges = 0
+        self.stop_event = threading.Event()
+
+    def start(self):
+        self.refresh()
+        threading.Thread(target=self.run, name="token-refresh", daemon=True).start()
+        return self
+
+    def run(self):
+        while not self.stop_event.wait(5.0):
+            if time.monotonic() - self.exchanged_at >= self.refresh_seconds:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    # The current token usually still has a few minutes left; try again shortly
+                    logger.error(f"Token refresh failed: {e}")
+
+    def refresh(self, rejected=None):
+        with self.lock:
+            if rejected is not None and self.header() != rejected:
+                # Another thread already replaced the token the ingress rejected
+                return
+            token = exchange_token(
+                self.generator.get_token(), endpoint=self.args.endpoint, role=self.args.role,
+                snowflake_account_url=self.args.snowflake_account_url, snowflake_account=self.args.account,
+            )
+            self.token = token
+            self.exchanged_at = time.monotonic()
+            self.exchanges += 1
+        logger.info("Exchanged a new Snowflake token for the ingress endpoint")
+
+    def header(self):
+        return f'Snowflake Token="{self.token}"'
+
+
+def compress(body, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return gzip.compress(body, compresslevel=5)
+
+
+class SignalForwarder:
+    """
+    Batches the serialized export requests of one signal and posts them to the ingress.
+    Serialized protobuf messages of the same type concatenate into one valid message with
+    all repeated fields appended, so batching needs no parsing.
+    """
+
+    def __init__(self, signal, url, session, token, encoding, max_batch_bytes, flush_interval, queue_size,
+                 retry):
+        self.signal = signal
+        self.url = url
+        self.session = session
+        self.token = token
+        self.encoding = encoding
+        self.max_batch_bytes = max_batch_bytes
+        self.flush_interval = flush_interval
+        self.retry = retry
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.requests_forwarded = 0
+        self.batches_sent = 0
+        self.batches_failed = 0
+        self.bytes_sent = 0
+        self.thread = threading.Thread(target=self.run, name=f"forward-{signal}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def offer(self, body):
+        try:
+            self.queue.put_nowait(body)
+            return True
+        except queue.Full:
+            return False
+
+    def take_batch(self):
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        size = len(first)
+        deadline = time.monotonic() + self.flush_interval
+        while size < self.max_batch_bytes:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                body = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(body)
+            size += len(body)
+        return batch
+
+    def run(self):
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            batch = self.take_batch()
+            if not batch:
+                continue
+            data = b"".join(batch)
+            try:
+                sent = self.retry.call(lambda: self.send(data), self.stop_event)
+                self.requests_forwarded += len(batch)
+                self.batches_sent += 1
+                self.bytes_sent += sent
+            except Exception as e:
+                self.batches_failed += 1
+                logger.error(f"Dropped {len(batch)} {self.signal} requests: {e}")
+
+    def send(self, data):
+        # Returns the number of compressed bytes sent
+        encoding = self.encoding
+        body = compress(data, encoding)
+        authorization = self.token.header()
+        headers = {
+            "Authorization": authorization,
+            "Content-Type": "application/x-protobuf",
+            "Content-Encoding": encoding,
+        }
+        response = self.session.post(self.url, data=body, headers=headers, timeout=30)
+        if response.status_code == 415 and encoding != "gzip":
+            # A receiver without the zstandard package only accepts gzip
+            logger.warning(f"Receiver does not accept {encoding}, compressing {self.signal} with gzip")
+            self.encoding = "gzip"
+            raise IOError(f"ingress answered 415 to {encoding}")
+        if response.status_code in (401, 403):
+            self.token.refresh(rejected=authorization)
+            raise TokenExpired(f"ingress answered {response.status_code}")
+        if response.status_code in (429, 502, 503, 504):
+            raise IOError(f"ingress answered {response.status_code}")
+        if response.status_code >= 400:
+            raise PermanentSinkError(f"ingress answered {response.status_code}: {response.text[:200]}")
+        return len(body)
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "requests_forwarded": self.requests_forwarded,
+            "batches_sent": self.batches_sent,
+            "batches_failed": self.batches_failed,
+            "bytes_sent": self.bytes_sent,
+        }
+
+
+def build_session(connections):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=connections)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def start_local_server(forwarders, token, host, port):
+    from fastapi import FastAPI, HTTPException, Request
+    from fastapi.responses import Response
+    import uvicorn
+
+    app = FastAPI()
+
+    def route(signal):
+        async def receive(request: Request):
+            if request.headers.get("Content-Type") != "application/x-protobuf":
+                raise HTTPException(status_code=400, detail="Unsupported Media Type")
+            body = await request.body()
+            if request.headers.get("Content-Encoding", "").lower() == "gzip":
+                body = gzip.decompress(body)
+            if not forwarders[signal].offer(body):
+                raise HTTPException(status_code=429, detail="Gateway queue is full", headers={"Retry-After": "1"})
+            # An empty body is a valid export response with no partial success
+            return Response(content=b"", media_type="application/x-protobuf")
+        return receive
+
+    for signal, path in SIGNAL_PATHS.items():
+        app.post(path)(route(signal))
+
+    @app.get("/v1/status/gateway")
+    async def gateway_status():
+        return {
+            "token_exchanges": token.exchanges,
+            "token_age_seconds": round(time.monotonic() - token.exchanged_at, 1),
+            "signals": {signal: forwarder.stats() for signal, forwarder in forwarders.items()},
+        }
+
+    logger.info(f"Gateway listening on {host}:{port}")
+    uvicorn.run(app, host=host, port=port)
+
+
+def main():
+    args = _parse_args()
+    encoding = args.compression
+    if encoding == "zstd" and zstandard is None:
+        logger.warning("zstandard is not installed, compressing with gzip")
+        encoding = "gzip"
+    token = ExchangedToken(args, args.token_refresh * 60).start()
+    session = build_session(args.connections)
+    base_url = f"https://{args.endpoint}{args.endpoint_path.rstrip('/')}"
+    retry = RetryPolicy(max_attempts=args.max_attempts)
+    forwarders = {
+        signal: SignalForwarder(
+            signal, base_url + path, session, token, encoding, args.max_batch_bytes, args.flush_interval,
+            args.queue_size, retry,
+        ).start()
+        for signal, path in SIGNAL_PATHS.items()
+    }
+    try:
+        start_local_server(forwarders, token, args.host, args.port)
+    finally:
+        for forwarder in forwarders.values():
+            forwarder.stop(30)
+
+
+def _parse_args():
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    cli_parser = argparse.ArgumentParser(description="Authenticated local gateway to the SPCS ingress endpoint.")
+    cli_parser.add_argument('--account', required=True,
+                            help='The account identifier (for example, "myorganization-myaccount").')
+    cli_parser.add_argument('--user', required=True, help='The user name.')
+    cli_parser.add_argument('--private_key_file_path', required=True,
+                            help='Path to the private key file used for signing the JWT.')
+    cli_parser.add_argument('--lifetime', type=int, default=59,
+                            help='The number of minutes that the JWT should be valid for.')
+    cli_parser.add_argument('--renewal_delay', type=int, default=54,
+                            help='The number of minutes before the JWT generator should produce a new JWT.')
+    cli_parser.add_argument('--token_refresh', type=float, default=45,
+                            help='Minutes after which the exchanged token is proactively replaced.')
+    cli_parser.add_argument('--role', help='The role to use for the session, otherwise the default role.')
+    cli_parser.add_argument('--endpoint', required=True, help='The ingress endpoint of the service')
+    cli_parser.add_argument('--endpoint-path', default='/', help='The url path for the ingress endpoint')
+    cli_parser.add_argument('--snowflake_account_url', default=None,
+                            help='The account url, e.g. https://myorganization-myaccount.snowflakecomputing.com')
+    cli_parser.add_argument('--host', default='127.0.0.1', help='Local address to accept OTLP/HTTP on.')
+    cli_parser.add_argument('--port', type=int, default=4318, help='Local port to accept OTLP/HTTP on.')
+    cli_parser.add_argument('--compression', choices=('zstd', 'gzip'), default='zstd')
+    cli_parser.add_argument('--connections', type=int, default=4, help='Keep-alive connections in the pool.')
+    cli_parser.add_argument('--max_batch_bytes', type=int, default=4 * 1024 * 1024,
+                            help='Uncompressed bytes merged into one forwarded request.')
+    cli_parser.add_argument('--flush_interval', type=float, default=1.0,
+                            help='Seconds to wait for more requests before forwarding a batch.')
+    cli_parser.add_argument('--queue_size', type=int, default=10000, help='Requests buffered per signal.')
+    cli_parser.add_argument('--max_attempts', type=int, default=8, help='Attempts per batch before dropping it.')
+    return cli_parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionWarmup:
+    """
+    Opens the receiver's own Snowflake connection (used by the span metrics and service
+    graph flushers) on a background thread so the ports open before login completes.
+    Callbacks registered with on_connected run once the connection exists.
+    """
+
+    def __init__(self, connect, max_backoff=30.0):
+        self.connect = connect
+        self.max_backoff = max_backoff
+        self.connected = threading.Event()
+        self.conn = None
+        self.callbacks = []
+        self.started = time.monotonic()
+        self.connect_seconds = None
+        self.last_error = None
+
+    def on_connected(self, callback):
+        self.callbacks.append(callback)
+
+    def start(self):
+        threading.Thread(target=self.run, name="snowflake-warmup", daemon=True).start()
+        return self
+
+    def run(self):
+        delay = 1.0
+        while self.conn is None:
+            try:
+                self.conn = self.connect()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Could not connect to Snowflake, retrying in {delay:.0f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        self.connect_seconds = time.monotonic() - self.started
+        self.last_error = None
+        logger.info(f"Connected to Snowflake after {self.connect_seconds:.2f}s")
+        self.connected.set()
+        for callback in self.callbacks:
+            callback(self.conn)
+
+
+def check_readiness(warmup, router, max_fill_ratio, drain=None):
+    # Ready once Snowflake is reachable and no tenant writer is close to shedding or spilling,
+    # and no longer ready once shutdown has begun
+    writers = {name: tenant.writer.fill_ratio() for name, tenant in router.tenants.items()}
+    backed_up = sorted(name for name, ratio in writers.items() if ratio >= max_fill_ratio)
+    draining = drain is not None and drain.draining
+    ready = warmup.connected.is_set() and not backed_up and not draining
+    return ready, {
+        "draining": draining,
+        "connected": warmup.connected.is_set(),
+        "connect_seconds": warmup.connect_seconds,
+        "last_error": warmup.last_error,
+        "writer_fill_ratio": {name: round(ratio, 3) for name, ratio in writers.items()},
+        "backed_up": backed_up,
+    }
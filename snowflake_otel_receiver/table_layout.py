@@ -0,0 +1,156 @@
+# Lifecycle of the receiver tables: clustering, retention and pruning reports.
+#
+# To run this on the command line, enter:
+#   python3 table_layout.py apply
+#   python3 table_layout.py retention --days metrics=30 --days logs=14
+#   python3 table_layout.py report --hours 24
+#
+# Connection settings are the receiver's (SPCS or SNOWFLAKE_* environment variables).
+#
+# Every table is clustered on the date of its time column first, so time-window filters from
+# the dashboards prune whole days, followed by the key dashboards filter on next. The receiver
+# writes each batch sorted by the same key (CompactRows.sort_columns). Retention deletes whole
+# days, which on a date-clustered table removes complete micro-partitions instead of
+# rewriting them.
+
+import argparse
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# table -> (time column, clustering key, default retention in days)
+TABLE_LAYOUTS = {
+    "traces": ("start_time", "TO_DATE(start_time), name, SUBSTR(trace_id, 1, 2)", 14),
+    "metrics": ("timestamp", "TO_DATE(timestamp), metric_name", 30),
+    "logs": ("timestamp", "TO_DATE(timestamp), log_level", 14),
+    "log_tokens": ("bucket", "TO_DATE(bucket), token", 14),
+    "span_metrics": ("window_start", "TO_DATE(window_start), service_name", 90),
+    "service_graph_edges": ("window_start", "TO_DATE(window_start), caller", 90),
+}
+
+
+def execute(conn, sql, params=None):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def apply_clustering(conn, tables):
+    for table in tables:
+        _, cluster_key, _ = TABLE_LAYOUTS[table]
+        execute(conn, f"ALTER TABLE {table} CLUSTER BY ({cluster_key})")
+        logger.info(f"{table}: clustered by ({cluster_key})")
+
+
+def enforce_retention(conn, retention_days, dry_run=False):
+    # Cut-offs are local midnight, like the timestamps the receiver writes, so every delete
+    # covers whole days, i.e. whole date partitions
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    deleted = {}
+    for table, days in retention_days.items():
+        time_column, _, _ = TABLE_LAYOUTS[table]
+        cutoff = today - timedelta(days=days)
+        if dry_run:
+            count = execute(conn, f"SELECT COUNT(*) FROM {table} WHERE {time_column} < %s", (cutoff,))[0][0]
+        else:
+            count = execute(conn, f"DELETE FROM {table} WHERE {time_column} < %s", (cutoff,))[0][0]
+        deleted[table] = count
+        logger.info(f"{table}: {'would delete' if dry_run else 'deleted'} {count} rows before {cutoff:%Y-%m-%d}")
+    return deleted
+
+
+def pruning_report(conn, tables, hours, max_queries):
+    """
+    Pruning per table from the query profiles (GET_QUERY_OPERATOR_STATS) of recent queries
+    that read it, next to the table's clustering depth.
+    """
+    report = {}
+    for table in tables:
+        query_ids = [
+            row[0] for row in execute(
+                conn,
+                "SELECT query_id FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY("
+                "END_TIME_RANGE_START => DATEADD('hour', -%s, CURRENT_TIMESTAMP()), RESULT_LIMIT => 10000)) "
+                "WHERE query_type = 'SELECT' AND execution_status = 'SUCCESS' AND query_text ILIKE %s "
+                "ORDER BY start_time DESC LIMIT %s",
+                (hours, f"%{table}%", max_queries),
+            )
+        ]
+        scanned = total = queries = 0
+        for query_id in query_ids:
+            for stats, attributes in execute(
+                conn,
+                "SELECT operator_statistics, operator_attributes FROM TABLE(GET_QUERY_OPERATOR_STATS(%s)) "
+                "WHERE operator_type = 'TableScan'",
+                (query_id,),
+            ):
+                attributes = json.loads(attributes) if isinstance(attributes, str) else attributes or {}
+                # table_name is fully qualified; "metrics" must not match SPAN_METRICS
+                if str(attributes.get("table_name", "")).split(".")[-1].strip('"').lower() != table.lower():
+                    continue
+                stats = json.loads(stats) if isinstance(stats, str) else stats or {}
+                pruning = stats.get("pruning", {})
+                scanned += pruning.get("partitions_scanned", 0)
+                total += pruning.get("partitions_total", 0)
+                queries += 1
+        clustering = json.loads(execute(conn, f"SELECT SYSTEM$CLUSTERING_INFORMATION('{table}')")[0][0])
+        report[table] = {
+            "table_scans": queries,
+            "partitions_scanned": scanned,
+            "partitions_total": total,
+            "partitions_pruned_ratio": round(1 - scanned / total, 4) if total else None,
+            "clustering_key": clustering.get("cluster_by_keys"),
+            "average_depth": clustering.get("average_depth"),
+            "total_partition_count": clustering.get("total_partition_count"),
+        }
+    return report
+
+
+def connect():
+    import otel_server_python_http_tcp_snowflake_fastapi as receiver
+    if os.getenv("SPCS") == "True":
+        return receiver.connect_to_snowflake_spcs()
+    return receiver.connect_to_snowflake()
+
+
+def main():
+    args = _parse_args()
+    tables = args.tables or list(TABLE_LAYOUTS)
+    conn = connect()
+    try:
+        if args.command == "apply":
+            apply_clustering(conn, tables)
+        elif args.command == "retention":
+            retention_days = {table: TABLE_LAYOUTS[table][2] for table in tables}
+            for setting in args.days or ():
+                table, days = setting.split("=")
+                retention_days[table] = int(days)
+            enforce_retention(conn, retention_days, args.dry_run)
+        else:
+            print(json.dumps(pruning_report(conn, tables, args.hours, args.max_queries), indent=2))
+    finally:
+        conn.close()
+
+
+def _parse_args():
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    cli_parser = argparse.ArgumentParser(description="Manage the receiver tables.")
+    cli_parser.add_argument("command", choices=("apply", "retention", "report"))
+    cli_parser.add_argument("--tables", nargs="+", choices=sorted(TABLE_LAYOUTS), help="Default: all tables.")
+    cli_parser.add_argument("--days", action="append",
+                            help="Retention override as table=days, may be repeated.")
+    cli_parser.add_argument("--dry-run", action="store_true", help="Count the rows retention would delete.")
+    cli_parser.add_argument("--hours", type=int, default=24, help="Query history window for the report.")
+    cli_parser.add_argument("--max-queries", type=int, default=50, help="Queries profiled per table.")
+    return cli_parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack
+from functools import partial
+
+from adaptive_batching import AdaptiveBatchController
+from batch_writer import BatchWriter, WriterBusy
+from memory_budget import SpillStore
+from otlp_json import resource_attribute
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+
+
+class TenantThrottled(Exception):
+    """Raised when a tenant is over its rate limit, byte quota or queue capacity."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second, burst):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    def try_acquire(self, amount):
+        # Returns 0 when granted, otherwise the number of seconds until it would be
+        with self.lock:
+            self.refill(time.monotonic())
+            if amount <= self.tokens:
+                self.tokens -= amount
+                return 0
+            return (min(amount, self.burst) - self.tokens) / self.rate_per_second
+
+    def release(self, amount):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + amount)
+
+
+class TenantBatch:
+    __slots__ = ("rows", "nbytes")
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.nbytes = 0
+
+
+class Tenant:
+    def __init__(self, name, writer, max_rows_per_second=None, max_bytes_per_minute=None):
+        self.name = name
+        self.writer = writer
+        self.row_limit = TokenBucket(max_rows_per_second, max_rows_per_second) if max_rows_per_second else None
+        self.byte_quota = TokenBucket(max_bytes_per_minute / 60, max_bytes_per_minute) if max_bytes_per_minute else None
+        self.rows_throttled = 0
+
+    def admit(self, rows, nbytes):
+        retry_after = 0
+        if self.row_limit is not None:
+            retry_after = self.row_limit.try_acquire(rows)
+        if not retry_after and self.byte_quota is not None:
+            retry_after = self.byte_quota.try_acquire(nbytes)
+            if retry_after and self.row_limit is not None:
+                self.row_limit.release(rows)
+        return retry_after
+
+    def refund(self, rows, nbytes):
+        if self.row_limit is not None:
+            self.row_limit.release(rows)
+        if self.byte_quota is not None:
+            self.byte_quota.release(nbytes)
+
+
+class TenantRouter:
+    """
+    Maps each export request (by header) or resource (by resource attribute) to a tenant.
+    Every tenant owns its own BatchWriter, connections and quotas, so a throttled or slow
+    tenant only ever fills its own queue.
+    """
+
+    def __init__(self, tenants, header=None, resource_attribute=None, default_tenant=DEFAULT_TENANT):
+        self.tenants = tenants
+        self.header = header
+        self.resource_attribute = resource_attribute
+        self.default_tenant = default_tenant
+
+    def http_header_value(self, headers):
+        return headers.get(self.header) if self.header else None
+
+    def grpc_header_value(self, metadata):
+        if not self.header:
+            return None
+        header = self.header.lower()
+        for key, value in metadata or ():
+            if key == header:
+                return value
+        return None
+
+    def resolve(self, header_value, resource):
+        if header_value and header_value in self.tenants:
+            return header_value
+        if self.resource_attribute:
+            for kv in resource.attributes:
+                if kv.key == self.resource_attribute:
+                    if kv.value.string_value in self.tenants:
+                        return kv.value.string_value
+                    break
+        return self.default_tenant
+
+    def resolve_json(self, header_value, resource):
+        # resolve() for a decoded OTLP/JSON resource
+        if header_value and header_value in self.tenants:
+            return header_value
+        if self.resource_attribute:
+            value = resource_attribute(resource, self.resource_attribute)
+            if value in self.tenants:
+                return value
+        return self.default_tenant
+
+    def writer_for(self, tenant_name):
+        return self.tenants[tenant_name].writer
+
+    def submit(self, insert_sql, batches, fingerprint=None):
+        # Check every tenant's quota before queueing anything so a request is either
+        # accepted for all of its tenants or rejected as a whole and retried by the client
+        admitted = []
+        for tenant_name, batch in batches.items():
+            tenant = self.tenants[tenant_name]
+            retry_after = tenant.admit(len(batch.rows), batch.nbytes)
+            if retry_after:
+                for admitted_tenant, admitted_batch in admitted:
+                    admitted_tenant.refund(len(admitted_batch.rows), admitted_batch.nbytes)
+                tenant.rows_throttled += len(batch.rows)
+                raise TenantThrottled(f"Tenant '{tenant_name}' is over its quota", max(1, int(retry_after + 0.999)))
+            admitted.append((tenant, batch))
+        # The same for writer capacity: with every writer locked (in a fixed order) no writer
+        # thread can take rows already queued, so a busy tenant takes back the others' rows
+        writers = {id(tenant.writer): tenant.writer for tenant, _ in admitted}
+        offered = []
+        with ExitStack() as locks:
+            for writer in sorted(writers.values(), key=lambda writer: writer.name):
+                locks.enter_context(writer.cond)
+            for tenant, batch in admitted:
+                try:
+                    offered.append((tenant, batch, tenant.writer.offer(insert_sql, batch.rows, fingerprint)))
+                except WriterBusy as e:
+                    for offered_tenant, offered_batch, reservation in offered:
+                        offered_tenant.writer.cancel(offered_batch.rows, reservation)
+                    for admitted_tenant, admitted_batch in admitted:
+                        admitted_tenant.refund(len(admitted_batch.rows), admitted_batch.nbytes)
+                    tenant.rows_throttled += len(batch.rows)
+                    raise TenantThrottled(str(e))
+        # Spill files are written once the writers are unlocked
+        for tenant, batch, reservation in offered:
+            if reservation is not None:
+                tenant.writer.commit_spill(reservation, batch.rows)
+
+    def stop(self, timeout=None):
+        for tenant in self.tenants.values():
+            tenant.writer.stop(timeout)
+
+    def drain(self, timeout):
+        # All writers flush in parallel until the shared deadline, then persist what is left
+        deadline = time.monotonic() + timeout
+        writers = [tenant.writer for tenant in self.tenants.values()]
+        counters = lambda: [sum(getattr(writer, name) for writer in writers)
+                            for name in ("rows_written", "rows_spilled", "rows_lost")]
+        before = counters()
+        for writer in writers:
+            writer.begin_stop()
+        finished = True
+        for writer in writers:
+            finished = writer.join(max(deadline - time.monotonic(), 0)) and finished
+        for writer in writers:
+            writer.persist_pending()
+        # Writer threads persist themselves what they cannot write, so count from the totals
+        written, spilled, lost = (after - start for after, start in zip(counters(), before))
+        return {
+            "rows_flushed": written,
+            "rows_persisted": spilled,
+            "rows_lost": lost,
+            "writers_finished": finished,
+        }
+
+    def stats(self):
+        return {
+            name: dict(tenant.writer.stats(), rows_throttled=tenant.rows_throttled)
+            for name, tenant in self.tenants.items()
+        }
+
+
+def build_controller(settings):
+    if not settings.get("adaptive"):
+        return None
+    return AdaptiveBatchController(
+        min_batch_size=int(settings["min_batch_size"]),
+        max_batch_size=int(settings["max_batch_size"]),
+        min_flush_interval=float(settings["min_flush_interval"]),
+        max_flush_interval=float(settings["max_flush_interval"]),
+        min_connections=int(settings["connections"]),
+        max_connections=int(settings["max_connections"]),
+        latency_target_seconds=float(settings["latency_target"]),
+        batch_size=int(settings["batch_size"]),
+        flush_interval=float(settings["flush_interval"]),
+    )
+
+
+def build_tenant(name, config, connect, defaults, budget=None, dedup=None):
+    settings = dict(defaults, **config)
+    spill = None
+    if settings.get("spill_dir"):
+        spill = SpillStore(os.path.join(settings["spill_dir"], name), int(settings["spill_max_bytes"]))
+    writer = BatchWriter(
+        name,
+        partial(
+            connect,
+            database=settings.get("database"),
+            schema=settings.get("schema"),
+            warehouse=settings.get("warehouse"),
+        ),
+        batch_size=int(settings["batch_size"]),
+        flush_interval=float(settings["flush_interval"]),
+        max_queued_rows=int(settings["max_queued_rows"]),
+        connections=int(settings["connections"]),
+        controller=build_controller(settings),
+        budget=budget,
+        spill=spill,
+        dedup=dedup,
+        max_in_flight=int(settings.get("max_in_flight", 1)),
+        max_in_flight_per_table=int(settings.get("max_in_flight_per_table", 0)),
+        poll_interval=float(settings.get("poll_interval", 0.1)),
+        max_attempts=int(settings.get("max_attempts", 5)),
+        retry_backoff=float(settings.get("retry_backoff", 1.0)),
+        max_retry_backoff=float(settings.get("max_retry_backoff", 30.0)),
+    )
+    return Tenant(
+        name,
+        writer,
+        max_rows_per_second=settings.get("max_rows_per_second"),
+        max_bytes_per_minute=settings.get("max_bytes_per_minute"),
+    )
+
+
+def load_tenant_router(connect, config_path=None, defaults=None, budget=None, dedup=None):
+    """
+    Builds the router from a JSON file such as:
+
+        {"header": "X-Tenant", "resource_attribute": "service.namespace",
+         "tenants": {"payments": {"database": "PAYMENTS", "schema": "OTEL", "warehouse": "PAY_WH",
+                                  "connections": 2, "max_rows_per_second": 20000,
+                                  "max_bytes_per_minute": 500000000}}}
+
+    Requests that match no tenant go to the "default" tenant, which writes through the
+    receiver's own database/schema/warehouse settings. Without a file only the default
+    tenant exists. All tenants share one memory budget and each spills to its own
+    subdirectory of spill_dir.
+    """
+    config = {}
+    if config_path:
+        with open(config_path) as f:
+            config = json.load(f)
+    defaults = dict(defaults or {}, **config.get("defaults", {}))
+    tenant_configs = dict(config.get("tenants", {}))
+    tenant_configs.setdefault(DEFAULT_TENANT, {})
+    tenants = {
+        name: build_tenant(name, tenant_config, connect, defaults, budget, dedup)
+        for name, tenant_config in tenant_configs.items()
+    }
+    for tenant in tenants.values():
+        tenant.writer.start()
+    logger.info(f"Routing telemetry to tenants: {', '.join(sorted(tenants))}")
+    return TenantRouter(
+        tenants,
+        header=config.get("header"),
+        resource_attribute=config.get("resource_attribute"),
+    )
@@ -0,0 +1,22 @@
+from adaptive_batching import AdaptiveBatchController
+from batch_writer import BatchWriter
+from tenant_routing import build_controller
+
+SETTINGS = {
+    "adaptive": True, "min_batch_size": 100, "max_batch_size": 20000, "min_flush_interval": 0.2,
+    "max_flush_interval": 5.0, "connections": 1, "max_connections": 4, "latency_target": 2.0,
+}
+
+
+def test_writer_starts_with_the_configured_batch_size_and_flush_interval():
+    controller = build_controller(dict(SETTINGS, batch_size=1000, flush_interval=1.0))
+    writer = BatchWriter("adaptive", None, controller=controller)
+    assert writer.batch_size == 1000
+    assert writer.flush_interval == 1.0
+
+
+def test_configured_settings_are_clamped_to_the_controller_bounds():
+    controller = AdaptiveBatchController(min_batch_size=100, max_batch_size=500, min_flush_interval=0.5,
+                                         max_flush_interval=2.0, batch_size=1000, flush_interval=0.01)
+    assert controller.batch_size == 500
+    assert controller.flush_interval == 0.5
@@ -0,0 +1,43 @@
+import gzip
+import os
+import struct
+
+from backfill import Checkpoint, iter_chunks
+
+
+def framed(record):
+    return struct.pack(">I", len(record)) + record
+
+
+def chunks(path):
+    return list(iter_chunks([path], Checkpoint(None), 100, "logs"))
+
+
+def test_truncated_proto_record_ends_the_file(tmp_path):
+    path = str(tmp_path / "logs.binpb")
+    with open(path, "wb") as f:
+        f.write(framed(b"first") + framed(b"second") + framed(b"third")[:-2])
+    [(_, offset, _, _, records, done)] = chunks(path)
+    assert records == [b"first", b"second"]
+    assert offset == len(framed(b"first") + framed(b"second"))
+    assert done
+
+
+def test_truncated_gzip_stream_ends_the_file(tmp_path):
+    path = str(tmp_path / "logs.binpb.gz")
+    data = gzip.compress(framed(b"first" * 1000) + framed(b"second" * 1000))
+    with open(path, "wb") as f:
+        f.write(data[:len(data) // 2])
+    [(_, _, _, _, records, done)] = chunks(path)
+    assert len(records) <= 1
+    assert done
+
+
+def test_checkpoint_is_replaced_atomically(tmp_path):
+    path = str(tmp_path / "backfill.checkpoint.json")
+    checkpoint = Checkpoint(path)
+    checkpoint.files["logs.binpb"] = {"offset": 12, "done": False}
+    checkpoint.rows_loaded = 3
+    checkpoint.save()
+    assert os.listdir(tmp_path) == ["backfill.checkpoint.json"]
+    assert Checkpoint(path).files == {"logs.binpb": {"offset": 12, "done": False}}
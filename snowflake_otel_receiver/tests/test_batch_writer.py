@@ -0,0 +1,59 @@
+import threading
+import time
+
+from adaptive_batching import AdaptiveBatchController
+from batch_writer import BatchWriter
+from compact_rows import LogRows
+
+INSERT_SQL = "INSERT INTO logs (timestamp, log_level, message, attributes) VALUES (%s, %s, %s, %s)"
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def executemany(self, sql, rows):
+        # Slow enough that rows are still queued when the drain starts
+        time.sleep(0.02)
+        with self.conn.lock:
+            self.conn.rows_written += len(rows)
+
+    def execute(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    lock = threading.Lock()
+    rows_written = 0
+
+    def cursor(self):
+        return FakeCursor(FakeConnection)
+
+    def close(self):
+        pass
+
+
+def log_rows(count):
+    rows = LogRows()
+    for _ in range(count):
+        rows.append(time.time_ns(), "INFO", "message", "{}")
+    return rows
+
+
+def test_drain_writes_every_queued_row_with_idle_connections():
+    FakeConnection.rows_written = 0
+    # Adaptive default: one of four connections active, the other threads idle
+    controller = AdaptiveBatchController(min_batch_size=100, max_batch_size=100, min_connections=1,
+                                         max_connections=4, batch_size=100)
+    writer = BatchWriter("drain", FakeConnection, controller=controller, flush_interval=60.0).start()
+    for _ in range(10):
+        writer.submit(INSERT_SQL, log_rows(100))
+    writer.begin_stop()
+    assert writer.join(10.0)
+    writer.persist_pending()
+    assert FakeConnection.rows_written == 1000
+    assert writer.rows_written == 1000
+    assert writer.rows_lost == 0
@@ -0,0 +1,25 @@
+import pickle
+
+from compact_rows import MetricRows, materialize_batch
+
+BIG = 2 ** 53 + 1
+
+
+def test_int64_metric_values_keep_every_digit():
+    rows = MetricRows()
+    rows.append(1, "requests", 1.5, "{}")
+    rows.append(2, "bytes", BIG, "{}")
+    rows.append(3, "bytes", 2 ** 63 - 1, "{}")
+    assert [row[2] for row in rows.materialize()] == [1.5, BIG, 2 ** 63 - 1]
+    # Sorted by the clustering key, metric name first
+    assert [row[2] for row in materialize_batch([rows])] == [BIG, 2 ** 63 - 1, 1.5]
+    assert [row[2] for row in rows.slice(1, 2).materialize()] == [BIG]
+    assert [row[2] for row in pickle.loads(pickle.dumps(rows)).materialize()] == [1.5, BIG, 2 ** 63 - 1]
+
+
+def test_values_a_double_holds_stay_in_the_array():
+    rows = MetricRows()
+    rows.append(1, "requests", 42, "{}")
+    rows.append(2, "latency", 0.25, "{}")
+    assert rows.columns[2].typecode == "d"
+    assert rows.nbytes > 0
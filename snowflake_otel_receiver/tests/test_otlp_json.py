@@ -0,0 +1,28 @@
+import pytest
+from opentelemetry.proto.collector.logs.v1 import logs_service_pb2
+
+import otlp_json
+from batch_writer import BatchWriter
+from otel_server_python_http_tcp_snowflake_fastapi import LogsService, MetricsService, TraceService
+from tenant_routing import DEFAULT_TENANT, Tenant, TenantRouter
+
+
+def router():
+    return TenantRouter({DEFAULT_TENANT: Tenant(DEFAULT_TENANT, BatchWriter(DEFAULT_TENANT, None))})
+
+
+@pytest.mark.parametrize("service, payload", [
+    (TraceService, {"resourceSpans": "not a list"}),
+    (TraceService, {"resourceSpans": [{"scopeSpans": [{"spans": ["not an object"]}]}]}),
+    (TraceService, {"resourceSpans": [{"scopeSpans": [{"spans": [{"status": "OK"}]}]}]}),
+    (MetricsService, {"resourceMetrics": [{"scopeMetrics": [{"metrics": [{"gauge": "x"}]}]}]}),
+    (LogsService, {"resourceLogs": [{"scopeLogs": [{"logRecords": [{"attributes": {"a": 1}}]}]}]}),
+])
+def test_wrongly_structured_json_is_an_invalid_payload(service, payload):
+    with pytest.raises(otlp_json.InvalidPayload):
+        service(router()).export_json(payload)
+
+
+def test_wrongly_structured_json_is_invalid_for_the_protobuf_path():
+    with pytest.raises(otlp_json.InvalidPayload):
+        otlp_json.parse_request({"resourceLogs": "not a list"}, logs_service_pb2.ExportLogsServiceRequest())
@@ -0,0 +1,75 @@
+import json
+import time
+
+import pytest
+from opentelemetry.proto.collector.logs.v1 import logs_service_pb2
+
+from sinks import ExportPipeline, MemorySink, QueuedSink, RetryPolicy, load_export_pipeline
+
+
+class FailingSink(QueuedSink):
+    def send(self, signal, requests):
+        raise IOError("endpoint unreachable")
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_failing_sink_does_not_hold_up_the_others():
+    primary, archive = MemorySink("snowflake"), MemorySink("archive")
+    failing = FailingSink("mirror", flush_interval=0.01, retry=RetryPolicy(max_attempts=2, initial_backoff=0.01))
+    pipeline = ExportPipeline(
+        {sink.name: sink for sink in (primary, failing.start(), archive)},
+        {"logs": ["mirror", "archive", "snowflake"]},
+    )
+    for i in range(3):
+        assert pipeline.export("logs", f"request {i}", "tenant") == 0
+    pipeline.stop(5)
+    assert primary.stats()["logs"] == 3
+    assert archive.stats()["logs"] == 3
+    assert failing.stats()["requests_failed"] == 3
+    # The primary sink always runs first
+    assert [sink.name for sink in pipeline.routes["logs"]][0] == "snowflake"
+
+
+def test_full_queue_drops_for_that_sink_only():
+    primary = MemorySink("snowflake")
+    # Not started, so nothing leaves the queue
+    stuck = FailingSink("mirror", queue_size=1)
+    pipeline = ExportPipeline({"snowflake": primary, "mirror": stuck}, {"logs": ["snowflake", "mirror"]})
+    for i in range(3):
+        pipeline.export("logs", f"request {i}")
+    assert primary.stats()["logs"] == 3
+    assert stuck.stats()["requests_dropped"] == 2
+
+
+def test_failed_requests_go_to_the_on_failure_sink(tmp_path):
+    config_path = tmp_path / "sinks.json"
+    config_path.write_text(json.dumps({
+        "sinks": {
+            "mirror": {"type": "otlp_http", "endpoint": "http://127.0.0.1:1", "max_attempts": 1,
+                       "flush_interval": 0.01, "on_failure": "dead_letter"},
+            "dead_letter": {"type": "memory"},
+        },
+        "routes": {"logs": ["snowflake", "mirror"]},
+    }))
+    pipeline = load_export_pipeline(MemorySink("snowflake"), str(config_path))
+    request = logs_service_pb2.ExportLogsServiceRequest()
+    pipeline.export("logs", request)
+    dead_letter = pipeline.sinks["dead_letter"]
+    assert wait_for(lambda: dead_letter.stats()["logs"] == 1)
+    assert dead_letter.requests["logs"][0][0] is request
+    pipeline.stop(5)
+
+
+def test_on_failure_must_name_another_sink(tmp_path):
+    config_path = tmp_path / "sinks.json"
+    config_path.write_text(json.dumps({
+        "sinks": {"mirror": {"type": "otlp_http", "endpoint": "http://127.0.0.1:1", "on_failure": "archive"}},
+    }))
+    with pytest.raises(ValueError):
+        load_export_pipeline(MemorySink("snowflake"), str(config_path))
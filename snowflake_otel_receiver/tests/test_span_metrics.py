@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from service_graph import ServiceGraphAggregator
+from span_metrics import SpanMetricsAggregator, run_periodic_flush
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def executemany(self, sql, rows):
+        if self.conn.fail:
+            raise IOError("connection reset")
+        self.conn.rows.extend(rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.rows = []
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+def test_failed_flush_merges_the_window_into_the_next_one():
+    aggregator = SpanMetricsAggregator()
+    aggregator.record("checkout", "GET /cart", "SERVER", 0, 10.0)
+    with pytest.raises(IOError):
+        aggregator.flush(FakeConnection(fail=True))
+    aggregator.record("checkout", "GET /cart", "SERVER", 0, 30.0)
+
+    conn = FakeConnection()
+    assert aggregator.flush(conn) == 1
+    row = conn.rows[0]
+    # call_count, error_count, duration_sum_ms, duration_min_ms, duration_max_ms
+    assert row[6:11] == (2, 0, 40.0, 10.0, 30.0)
+
+
+def test_periodic_flush_reconnects_after_a_failure():
+    aggregator = SpanMetricsAggregator()
+    aggregator.record("checkout", "GET /cart", "SERVER", 0, 10.0)
+    broken = FakeConnection(fail=True)
+    fresh = FakeConnection()
+    stop_event = threading.Event()
+
+    def flush(conn):
+        try:
+            return aggregator.flush(conn)
+        finally:
+            stop_event.set()
+
+    run_periodic_flush(flush, broken, 0.01, stop_event, "span metrics", connect=lambda: fresh)
+    # The shared connection is replaced but not closed, and the final flush writes the window
+    assert not broken.closed
+    assert len(fresh.rows) == 1
+
+
+def test_failed_service_graph_flush_keeps_the_edges():
+    aggregator = ServiceGraphAggregator()
+    aggregator.record("a1", None, "frontend", 50.0, False)
+    aggregator.record("b1", "a1", "checkout", 20.0, False)
+    with pytest.raises(IOError):
+        aggregator.flush(FakeConnection(fail=True))
+
+    conn = FakeConnection()
+    assert aggregator.flush(conn) == 1
+    assert conn.rows[0][2:5] == ("frontend", "checkout", 1)
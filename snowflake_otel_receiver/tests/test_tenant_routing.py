@@ -0,0 +1,58 @@
+import tempfile
+
+import pytest
+
+from batch_writer import BatchWriter
+from compact_rows import LogRows
+from memory_budget import SpillStore
+from tenant_routing import Tenant, TenantBatch, TenantRouter, TenantThrottled
+
+INSERT_SQL = "INSERT INTO logs (timestamp, log_level, message, attributes) VALUES (%s, %s, %s, %s)"
+
+
+def tenant_batch(count):
+    rows = LogRows()
+    for i in range(count):
+        rows.append(i + 1, "INFO", "message", "{}")
+    batch = TenantBatch(rows)
+    batch.nbytes = rows.nbytes
+    return batch
+
+
+def router(busy_spill=None):
+    # Writers are not started, so queued rows stay queued
+    tenants = {
+        "a": Tenant("a", BatchWriter("a", None, max_queued_rows=1000)),
+        "b": Tenant("b", BatchWriter("b", None, max_queued_rows=10, spill=busy_spill), max_rows_per_second=1000),
+    }
+    return TenantRouter(tenants)
+
+
+def test_busy_tenant_rejects_the_whole_request():
+    tenant_router = router()
+    with pytest.raises(TenantThrottled):
+        tenant_router.submit(INSERT_SQL, {"a": tenant_batch(5), "b": tenant_batch(50)})
+    a, b = tenant_router.tenants["a"], tenant_router.tenants["b"]
+    assert a.writer.queued_rows == 0 and not a.writer.pending
+    assert a.writer.rows_submitted == 0
+    assert b.rows_throttled == 50
+    # The rate limit of b was refunded as well
+    assert b.row_limit.try_acquire(1000) == 0
+
+
+def test_busy_tenant_with_spill_store_accepts_the_request():
+    spill = SpillStore(tempfile.mkdtemp(), 10 ** 8)
+    tenant_router = router(spill)
+    tenant_router.submit(INSERT_SQL, {"a": tenant_batch(5), "b": tenant_batch(50)})
+    assert tenant_router.tenants["a"].writer.queued_rows == 5
+    assert tenant_router.tenants["b"].writer.rows_spilled == 50
+    assert spill.stats()["files"] == 1
+
+
+def test_full_spill_store_takes_back_every_tenant():
+    spill = SpillStore(tempfile.mkdtemp(), 1)
+    tenant_router = router(spill)
+    with pytest.raises(TenantThrottled):
+        tenant_router.submit(INSERT_SQL, {"a": tenant_batch(5), "b": tenant_batch(50)})
+    assert tenant_router.tenants["a"].writer.queued_rows == 0
+    assert spill.stats() == {"files": 0, "bytes": 0, "quarantined": 0}
@@ -0,0 +1,212 @@
+import bisect
+import hashlib
+import logging
+import socket
+import threading
+import time
+from functools import partial
+
+from sinks import OtlpHttpSink
+
+logger = logging.getLogger(__name__)
+
+# Set on requests one replica forwards to another so the owner never forwards them again,
+# even while the two still disagree about ring membership
+FORWARDED_HEADER = "X-Otel-Forwarded"
+
+
+def span_count(trace_data):
+    return sum(len(ss.spans) for rs in trace_data.resource_spans for ss in rs.scope_spans)
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes; a peer joining or leaving moves ~1/N of trace ids."""
+
+    def __init__(self, peers, vnodes=64):
+        self.peers = tuple(sorted(peers))
+        points = sorted(
+            (ring_hash(f"{peer}#{i}".encode()), peer) for peer in self.peers for i in range(vnodes)
+        )
+        self.hashes = [point for point, _ in points]
+        self.owners = [peer for _, peer in points]
+
+    def owner(self, trace_id):
+        if not self.hashes:
+            return None
+        index = bisect.bisect(self.hashes, ring_hash(trace_id)) % len(self.hashes)
+        return self.owners[index]
+
+
+class PeerDiscovery:
+    """
+    Ring members from a static "host:port,host:port" list, or from the addresses a DNS name
+    resolves to (in SPCS, instances.<service DNS name> lists every instance of the service),
+    re-resolved every refresh_seconds.
+    """
+
+    def __init__(self, static_peers=None, dns_name=None, port=4318, refresh_seconds=15.0):
+        self.static_peers = [p.strip() for p in (static_peers or "").split(",") if p.strip()]
+        self.dns_name = dns_name
+        self.port = port
+        self.refresh_seconds = refresh_seconds
+
+    def peers(self):
+        if self.static_peers:
+            return set(self.static_peers)
+        addresses = socket.getaddrinfo(self.dns_name, self.port, proto=socket.IPPROTO_TCP)
+        return {f"{address[4][0]}:{self.port}" for address in addresses}
+
+
+class TraceForwarder:
+    """
+    Splits each trace export request by the ring owner of every span's trace_id. Spans this
+    replica owns are returned for local processing; the rest are sent to their owner as
+    OTLP/HTTP protobuf over one batched, gzip-compressed keep-alive connection per peer
+    (and tenant header). If a peer's queue is full, or a peer cannot be reached once its
+    retries run out (it left the ring, or is shutting down), its spans are handed to
+    fallback(trace_data, tenant_header) and processed locally instead of being dropped.
+    """
+
+    def __init__(self, discovery, self_peer, tenant_header_name=None, vnodes=64, queue_size=1000, fallback=None):
+        self.discovery = discovery
+        self.self_peer = self_peer
+        self.tenant_header_name = tenant_header_name
+        self.fallback = fallback
+        self.vnodes = vnodes
+        self.queue_size = queue_size
+        self.ring = HashRing([self_peer], vnodes)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        # (peer, tenant header value) -> OtlpHttpSink
+        self.sinks = {}
+        self.spans_local = 0
+        self.spans_forwarded = {}
+        self.spans_kept_on_full = 0
+        self.spans_kept_on_failure = 0
+        self.spans_lost = 0
+        self.ring_changes = 0
+        self.last_refresh_error = None
+
+    def start(self):
+        self.refresh()
+        threading.Thread(target=self.run, name="peer-discovery", daemon=True).start()
+        return self
+
+    def run(self):
+        while not self.stop_event.wait(self.discovery.refresh_seconds):
+            self.refresh()
+
+    def refresh(self):
+        try:
+            peers = self.discovery.peers() | {self.self_peer}
+            self.last_refresh_error = None
+        except Exception as e:
+            self.last_refresh_error = str(e)
+            logger.error(f"Could not resolve receiver peers, keeping the current ring: {e}")
+            return
+        if set(self.ring.peers) != peers:
+            self.ring = HashRing(peers, self.vnodes)
+            self.ring_changes += 1
+            logger.info(f"Trace affinity ring: {', '.join(self.ring.peers)} (self {self.self_peer})")
+
+    def sink_for(self, peer, tenant_header):
+        key = (peer, tenant_header)
+        with self.lock:
+            sink = self.sinks.get(key)
+            if sink is None:
+                headers = {FORWARDED_HEADER: self.self_peer}
+                if tenant_header and self.tenant_header_name:
+                    headers[self.tenant_header_name] = tenant_header
+                sink = self.sinks[key] = OtlpHttpSink(
+                    f"peer-{peer}", f"http://{peer}", headers=headers, queue_size=self.queue_size,
+                    flush_interval=0.2, on_failure=partial(self.keep_local, tenant_header),
+                ).start()
+            return sink
+
+    def keep_local(self, tenant_header, signal, requests):
+        # Called on a peer sink's thread with the requests it could not deliver
+        for request in requests:
+            count = span_count(request)
+            try:
+                if self.fallback is None:
+                    raise RuntimeError("no local fallback")
+                self.fallback(request, tenant_header)
+                self.spans_kept_on_failure += count
+            except Exception as e:
+                self.spans_lost += count
+                logger.error(f"Could not process {count} spans locally after forwarding failed: {e}")
+
+    def forward(self, trace_data, tenant_header=None):
+        ring = self.ring
+        if len(ring.peers) == 1:
+            self.spans_local += span_count(trace_data)
+            return trace_data
+        parts = {}
+        for resource_span in trace_data.resource_spans:
+            for scope_span in resource_span.scope_spans:
+                by_owner = {}
+                for span in scope_span.spans:
+                    by_owner.setdefault(ring.owner(span.trace_id), []).append(span)
+                for owner, spans in by_owner.items():
+                    part = parts.get(owner)
+                    if part is None:
+                        part = parts[owner] = type(trace_data)()
+                    out_resource = part.resource_spans.add(
+                        resource=resource_span.resource, schema_url=resource_span.schema_url
+                    )
+                    out_scope = out_resource.scope_spans.add(scope=scope_span.scope, schema_url=scope_span.schema_url)
+                    out_scope.spans.extend(spans)
+        local = parts.pop(self.self_peer, None) or type(trace_data)()
+        for peer, part in parts.items():
+            count = span_count(part)
+            if self.sink_for(peer, tenant_header).try_export("traces", part):
+                self.spans_forwarded[peer] = self.spans_forwarded.get(peer, 0) + count
+            else:
+                self.spans_kept_on_full += count
+                local.MergeFrom(part)
+        self.spans_local += span_count(local)
+        return local
+
+    def stop(self, timeout=None):
+        # Peers get until the timeout to take what is queued for them; whatever they cannot
+        # take, including requests still queued at the timeout, is processed locally
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.stop_event.set()
+        sinks = list(self.sinks.items())
+        for _, sink in sinks:
+            sink.stop_event.set()
+        for _, sink in sinks:
+            sink.stop(None if deadline is None else max(deadline - time.monotonic(), 0))
+        for (_, tenant_header), sink in sinks:
+            for signal, request in sink.take_unsent():
+                self.keep_local(tenant_header, signal, [request])
+
+    def stats(self):
+        return {
+            "self": self.self_peer,
+            "members": list(self.ring.peers),
+            "ring_changes": self.ring_changes,
+            "last_refresh_error": self.last_refresh_error,
+            "spans_local": self.spans_local,
+            "spans_forwarded": dict(self.spans_forwarded),
+            "spans_kept_on_full": self.spans_kept_on_full,
+            "spans_kept_on_failure": self.spans_kept_on_failure,
+            "spans_lost": self.spans_lost,
+            "peer_channels": {
+                f"{peer}|{tenant or ''}": sink.stats() for (peer, tenant), sink in list(self.sinks.items())
+            },
+        }
+
+
+def build_trace_forwarder(static_peers, dns_name, self_peer=None, port=4318, refresh_seconds=15.0,
+                          tenant_header_name=None, fallback=None):
+    if not static_peers and not dns_name:
+        return None
+    if not self_peer:
+        self_peer = f"{socket.gethostbyname(socket.gethostname())}:{port}"
+    discovery = PeerDiscovery(static_peers, dns_name, port, refresh_seconds)
+    return TraceForwarder(discovery, self_peer, tenant_header_name, fallback=fallback).start()
@@ -0,0 +1,152 @@
+# Shared by the dashboards in this directory. In Snowflake, upload this file to the app's
+# stage next to the dashboard's main file so it can be imported.
+
+import re
+import streamlit as st
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+# Metric rollup tables maintained by metric_rollups.sql, coarsest first, with their bucket size in hours
+METRIC_ROLLUPS = (
+    ("ecs_schema.metrics_1d", 24),
+    ("ecs_schema.metrics_1h", 1),
+    ("ecs_schema.metrics_1m", 1 / 60),
+)
+# Points per series a chart should get at least before a finer resolution is used
+MIN_CHART_POINTS = 60
+ROLLUP_ROW_LIMIT = 10000
+
+# Pick the coarsest metrics table that still gives MIN_CHART_POINTS buckets over the window
+def metrics_source(time_window_hours):
+    window_hours = abs(time_window_hours)
+    for table, bucket_hours in METRIC_ROLLUPS:
+        if window_hours / bucket_hours >= MIN_CHART_POINTS:
+            return table
+    return "ecs_schema.metrics"
+
+# Columns of the ECS tables, and the ones the charts need
+TABLE_COLUMNS = {
+    "logs": ["@timestamp", "log.level", "message", "attributes"],
+    "metrics": ["@timestamp", "metricset.name", "metric.value", "attributes"],
+    "traces": ["span.start", "span.end", "span.duration", "span.name", "trace.id", "span.id", "attributes"],
+}
+CHART_COLUMNS = {
+    "logs": ["@timestamp"],
+    "metrics": ["@timestamp", "metricset.name", "metric.value"],
+    "traces": ["span.start", "span.duration"],
+}
+
+# Log search tokenizer, a copy of snowflake_otel_receiver/log_index.py (the app cannot import
+# the receiver in Snowflake): search terms must be tokenized exactly like the indexed records,
+# so change both together
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9_\-]*[a-z0-9]")
+MIN_TOKEN_LENGTH = 3
+MAX_TOKEN_LENGTH = 64
+MAX_TOKENS_PER_RECORD = 64
+STOPWORDS = frozenset((
+    "and", "are", "but", "for", "from", "has", "have", "into", "not", "the", "this", "that",
+    "was", "were", "will", "with",
+))
+# Number of LOG_INDEX_ATTRIBUTES the receiver indexes, 6 by default
+LOG_INDEX_ATTRIBUTE_COUNT = 6
+
+# The receiver keeps only the MAX_TOKENS_PER_RECORD longest tokens of a record, so a term can be
+# missing from the index for a long message. That needs more message tokens than the postings
+# left after the attribute tokens, each at least MIN_TOKEN_LENGTH plus a separator long.
+TRUNCATED_MESSAGE_LENGTH = (MAX_TOKENS_PER_RECORD - LOG_INDEX_ATTRIBUTE_COUNT) * (MIN_TOKEN_LENGTH + 1)
+
+def message_tokens(message):
+    tokens = set()
+    for token in TOKEN_PATTERN.findall(message.lower()):
+        if MIN_TOKEN_LENGTH <= len(token) <= MAX_TOKEN_LENGTH and token not in STOPWORDS:
+            tokens.add(token)
+    return tokens
+
+def attribute_token(key, value):
+    return f"{key}={value}".lower()[:MAX_TOKEN_LENGTH * 2]
+
+# Row browser: keyset pagination newest first on (timestamp, id), so every page is a range
+# query on the clustered timestamp column instead of a growing LIMIT/OFFSET. Without an id
+# column a hash of the row breaks timestamp ties. Only the selected columns are fetched, and
+# the next page is fetched in the background while the current one is shown.
+PAGE_SIZE = 100
+MAX_CACHED_PAGES = 5
+
+@st.cache_resource
+def page_fetcher():
+    return ThreadPoolExecutor(max_workers=2)
+
+def page_query(source_sql, timestamp_column, id_column, columns, cursor):
+    row_id = f'"{id_column}"' if id_column else 'HASH(*)'
+    projection = ", ".join(f'"{column}"' for column in dict.fromkeys([timestamp_column] + list(columns)))
+    keyset = ""
+    if cursor is not None:
+        last_timestamp, last_id = cursor
+        timestamp = f"'{pd.Timestamp(last_timestamp).isoformat(sep=' ')}'::TIMESTAMP_NTZ"
+        last_id = "'" + str(last_id).replace("'", "''") + "'" if id_column else int(last_id)
+        keyset = f"""WHERE "{timestamp_column}" < {timestamp}
+       OR ("{timestamp_column}" = {timestamp} AND "row_id" < {last_id})"""
+    return f"""
+    SELECT {projection}, "row_id"
+    FROM (SELECT *, {row_id} AS "row_id" FROM ({source_sql}))
+    {keyset}
+    ORDER BY "{timestamp_column}" DESC, "row_id" DESC
+    LIMIT {PAGE_SIZE}
+    """
+
+def fetch_page(session, source_sql, timestamp_column, id_column, columns, cursor):
+    # Every page runs on a cursor of its own. The Snowflake connector lets cursors of one
+    # connection run on different threads; the Snowpark Session object makes no such promise,
+    # so the prefetch thread never goes through it.
+    sql = page_query(source_sql, timestamp_column, id_column, columns, cursor)
+    sql_cursor = session.connection.cursor()
+    try:
+        return sql_cursor.execute(sql).fetch_pandas_all()
+    finally:
+        sql_cursor.close()
+
+def browse_rows(session, key, source_sql, timestamp_column, columns, id_column=None):
+    selected = st.multiselect(
+        "Columns", columns, default=[column for column in columns if column != "attributes"], key=f"{key}_columns"
+    )
+    state = st.session_state.setdefault(key, {})
+    query = (source_sql, tuple(selected))
+    if state.get("query") != query:
+        state.clear()
+        state.update(query=query, cursors=[None], pages={}, prefetched={})
+    cursors, pages, prefetched = state["cursors"], state["pages"], state["prefetched"]
+
+    def load(cursor):
+        # Pages already seen are kept, so "Newer" does not go back to Snowflake
+        if cursor not in pages:
+            future = prefetched.pop(cursor, None)
+            pages[cursor] = (
+                future.result() if future is not None
+                else fetch_page(session, source_sql, timestamp_column, id_column, selected, cursor)
+            )
+            while len(pages) > MAX_CACHED_PAGES:
+                pages.pop(next(iter(pages)))
+        return pages[cursor]
+
+    def next_cursor(page):
+        if len(page) < PAGE_SIZE:
+            return None
+        return page[timestamp_column].iloc[-1], page["row_id"].iloc[-1]
+
+    newer, older = st.columns(2)
+    if newer.button("Newer", key=f"{key}_newer", disabled=len(cursors) == 1):
+        cursors.pop()
+    page = load(cursors[-1])
+    if older.button("Older", key=f"{key}_older", disabled=next_cursor(page) is None):
+        cursors.append(next_cursor(page))
+        page = load(cursors[-1])
+    st.caption(f"Page {len(cursors)}, {len(page)} rows")
+    st.dataframe(page.drop(columns=["row_id"], errors="ignore"), use_container_width=True)
+
+    # Prefetch the next older page so "Older" does not wait for Snowflake
+    cursor = next_cursor(page)
+    if cursor is not None and cursor not in pages and cursor not in prefetched:
+        prefetched.clear()
+        prefetched[cursor] = page_fetcher().submit(
+            fetch_page, session, source_sql, timestamp_column, id_column, selected, cursor
+        )
@@ -4,9 +4,17 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+import math
+import time
 from snowflake.snowpark.session import Session
 from snowflake.snowpark.functions import col, dateadd, current_timestamp, lit
 
+from dashboard_common import (
+    CHART_COLUMNS, MAX_TOKEN_LENGTH, MAX_TOKENS_PER_RECORD, ROLLUP_ROW_LIMIT, TABLE_COLUMNS, TOKEN_PATTERN,
+    TRUNCATED_MESSAGE_LENGTH, attribute_token, browse_rows, message_tokens, metrics_source,
+)
+
 # Title of the dashboard
 st.title("Elastic Common Schema Data Dashboard")
 
@@ -17,7 +25,7 @@ def create_session():
 
 session = create_session()
 
-# Function to load data from Snowflake
+# Function to load the chart data from Snowflake
 @st.cache_data(ttl=10)
 def load_data(table_name, time_window_hours):
     # Import necessary functions
@@ -32,18 +40,164 @@ def load_data(table_name, time_window_hours):
     else:
         timestamp_col = '"@timestamp"'
 
+    # Metrics come from the coarsest adequate rollup, averaged per bucket
+    if table_name == 'metrics':
+        source = metrics_source(time_window_hours)
+        if source != "ecs_schema.metrics":
+            sql_query = f"""
+            SELECT "@timestamp", "metricset.name",
+                   "metric.sum" / NULLIF("metric.count", 0) AS "metric.value",
+                   "metric.min", "metric.max", "metric.count",
+                   APPROX_PERCENTILE_ESTIMATE("metric.sketch", 0.95) AS "metric.p95"
+            FROM {source}
+            WHERE "@timestamp" >= DATEADD('hour', {int(time_window_hours)}, CURRENT_TIMESTAMP())
+            ORDER BY "@timestamp" DESC
+            LIMIT {ROLLUP_ROW_LIMIT}
+            """
+            return session.sql(sql_query).to_pandas()
+
     # Query data using Snowpark
     df = session.table(f"ecs_schema.{table_name}") \
         .filter(col(timestamp_col) >= time_threshold) \
+        .select(*[col(f'"{column}"') for column in CHART_COLUMNS[table_name]]) \
         .sort(col(timestamp_col).desc()) \
         .limit(1000) \
         .to_pandas()
     return df
 
+# Function to load service map edges pre-aggregated by the receiver
+@st.cache_data(ttl=10)
+def load_service_graph(time_window_hours):
+    sql_query = f"""
+    SELECT caller, callee,
+           SUM(call_count) AS call_count,
+           SUM(error_count) AS error_count,
+           SUM(duration_sum_ms) / NULLIF(SUM(call_count), 0) AS avg_duration_ms
+    FROM otelschema.service_graph_edges
+    WHERE window_end >= DATEADD('hour', {int(time_window_hours)}, CURRENT_TIMESTAMP())
+    GROUP BY caller, callee
+    """
+    return session.sql(sql_query).to_pandas()
+
+# Log search resolves its terms through the receiver's token index (otelschema.log_tokens)
+# and then reads only the matching time buckets of otelschema.logs. Terms are tokenized like
+# the receiver does (dashboard_common.message_tokens). The bucket size must match
+# LOG_INDEX_BUCKET_SECONDS. Records long enough to have had tokens dropped from the index are
+# searched with LIKE as well, so a term is not missed because it was not indexed.
+LOG_INDEX_BUCKET_SECONDS = 300
+SEARCH_ROW_LIMIT = 1000
+
+def search_terms(query):
+    # Returns the terms to look up in the index and the terms every row must contain. Stopwords
+    # and short words are dropped; words longer than MAX_TOKEN_LENGTH are never indexed, so
+    # they are only checked on the rows.
+    index_terms, row_terms = set(), set()
+    for word in query.lower().split():
+        if "=" in word:
+            # key=value matches an indexed attribute such as user.id=42
+            index_terms.add(attribute_token(*word.split("=", 1)))
+            row_terms.add(word)
+        else:
+            tokens = message_tokens(word)
+            index_terms.update(tokens)
+            row_terms.update(tokens)
+            row_terms.update(token for token in TOKEN_PATTERN.findall(word) if len(token) > MAX_TOKEN_LENGTH)
+    # Like LogIndexer.index, keep the longest terms; the rest are still checked on the rows
+    index_terms = sorted(index_terms, key=len, reverse=True)[:MAX_TOKENS_PER_RECORD]
+    return sorted(index_terms), sorted(row_terms)
+
+def sql_string(value):
+    return "'" + value.replace("\\", "\\\\").replace("'", "''") + "'"
+
+def term_filter(term):
+    # Exact check on the log rows, which also drops records sharing a timestamp with a hit
+    if "=" in term:
+        key, value = term.split("=", 1)
+        return f"LOWER(GET(PARSE_JSON(attributes), {sql_string(key)})::STRING) = {sql_string(value)}"
+    return f"message ILIKE {sql_string('%' + term + '%')}"
+
+def search_logs_indexed(terms, row_terms, time_window_hours):
+    started = time.perf_counter()
+    # Records (timestamp locators) carrying every term, newest first
+    hits = session.sql(f"""
+    SELECT bucket, log_timestamp
+    FROM otelschema.log_tokens
+    WHERE token IN ({', '.join(sql_string(term) for term in terms)})
+      AND bucket >= DATEADD('hour', {int(time_window_hours)}, CURRENT_TIMESTAMP())
+    GROUP BY bucket, log_timestamp
+    HAVING COUNT(DISTINCT token) = {len(terms)}
+    ORDER BY log_timestamp DESC
+    LIMIT {SEARCH_ROW_LIMIT}
+    """).to_pandas()
+    if hits.empty:
+        return pd.DataFrame(columns=["TIMESTAMP", "LOG_LEVEL", "MESSAGE", "ATTRIBUTES"]), 0, time.perf_counter() - started
+    buckets = sorted(set(hits['BUCKET']))
+    bucket_ranges = " OR ".join(
+        f"(timestamp >= '{bucket}'::TIMESTAMP_NTZ "
+        f"AND timestamp < DATEADD('second', {LOG_INDEX_BUCKET_SECONDS}, '{bucket}'::TIMESTAMP_NTZ))"
+        for bucket in buckets
+    )
+    timestamps = ", ".join(f"'{timestamp}'::TIMESTAMP_NTZ" for timestamp in hits['LOG_TIMESTAMP'])
+    df = session.sql(f"""
+    SELECT timestamp, log_level, message, attributes
+    FROM otelschema.logs
+    WHERE ({bucket_ranges})
+      AND timestamp IN ({timestamps})
+      AND {' AND '.join(term_filter(term) for term in row_terms)}
+    ORDER BY timestamp DESC
+    LIMIT {SEARCH_ROW_LIMIT}
+    """).to_pandas()
+    return df, len(buckets), time.perf_counter() - started
+
+def search_logs_scan(terms, time_window_hours, min_message_length=0):
+    # Brute-force LIKE over the whole time window, for comparison, or over the messages of at
+    # least min_message_length characters
+    started = time.perf_counter()
+    long_messages = f"AND LENGTH(message) >= {int(min_message_length)}" if min_message_length else ""
+    df = session.sql(f"""
+    SELECT timestamp, log_level, message, attributes
+    FROM otelschema.logs
+    WHERE timestamp >= DATEADD('hour', {int(time_window_hours)}, CURRENT_TIMESTAMP())
+      {long_messages}
+      AND {' AND '.join(term_filter(term) for term in terms)}
+    ORDER BY timestamp DESC
+    LIMIT {SEARCH_ROW_LIMIT}
+    """).to_pandas()
+    return df, time.perf_counter() - started
+
+# Function to draw the service map with services laid out on a circle
+def service_graph_figure(edges_df):
+    services = sorted(set(edges_df['CALLER']) | set(edges_df['CALLEE']))
+    positions = {
+        service: (math.cos(2 * math.pi * i / len(services)), math.sin(2 * math.pi * i / len(services)))
+        for i, service in enumerate(services)
+    }
+    fig = go.Figure()
+    for _, edge in edges_df.iterrows():
+        x0, y0 = positions[edge['CALLER']]
+        x1, y1 = positions[edge['CALLEE']]
+        fig.add_annotation(
+            x=x1, y=y1, ax=x0, ay=y0, xref='x', yref='y', axref='x', ayref='y',
+            showarrow=True, arrowhead=2, arrowwidth=1 + math.log10(1 + edge['CALL_COUNT']),
+            arrowcolor='red' if edge['ERROR_COUNT'] > 0 else 'gray',
+            hovertext=f"{edge['CALLER']} -> {edge['CALLEE']}: {edge['CALL_COUNT']} calls, "
+                      f"{edge['ERROR_COUNT']} errors, {edge['AVG_DURATION_MS']:.1f} ms avg",
+        )
+    fig.add_trace(go.Scatter(
+        x=[positions[s][0] for s in services],
+        y=[positions[s][1] for s in services],
+        mode='markers+text', text=services, textposition='top center',
+        marker=dict(size=20),
+    ))
+    fig.update_layout(title='Service Map', showlegend=False)
+    fig.update_xaxes(visible=False)
+    fig.update_yaxes(visible=False)
+    return fig
+
 # Sidebar for table selection
 table_option = st.sidebar.selectbox(
     "Select ECS Table",
-    ("logs", "metrics", "traces")
+    ("logs", "metrics", "traces", "service map")
 )
 
 # Sidebar for time window selection
@@ -55,22 +209,43 @@ time_window_hours = st.sidebar.number_input(
 )
 time_window_hours = -abs(time_window_hours)  # Ensure it's negative for dateadd
 
+if table_option == "logs":
+    search_query = st.sidebar.text_input("Search logs (words or key=value)", "")
+    compare_scan = st.sidebar.checkbox("Compare with LIKE scan")
+else:
+    search_query = ""
+
 # Button to refresh data
 if st.sidebar.button('Refresh Data'):
     st.cache_data.clear()
 
 # Load data based on selection
 data_load_state = st.text('Loading data...')
-df = load_data(table_option, time_window_hours)
+if table_option == "service map":
+    df = load_service_graph(time_window_hours)
+else:
+    df = load_data(table_option, time_window_hours)
 data_load_state.text('Loading data...done!')
 
 # Check if DataFrame is empty
 if df.empty:
     st.warning(f"No data available for the selected time window in {table_option} table.")
+elif table_option == "service map":
+    st.subheader("Service dependencies")
+    st.write(df)
+    st.plotly_chart(service_graph_figure(df), use_container_width=True)
 else:
-    # Display data
+    # Browse the rows of the time window page by page
     st.subheader(f"Latest data from {table_option} table")
-    st.write(df)
+    timestamp_column = "span.start" if table_option == "traces" else "@timestamp"
+    browse_rows(
+        session, f"{table_option}_rows",
+        f'SELECT * FROM ecs_schema.{table_option} '
+        f'WHERE "{timestamp_column}" >= DATEADD(\'hour\', {int(time_window_hours)}, CURRENT_TIMESTAMP())',
+        timestamp_column,
+        TABLE_COLUMNS[table_option],
+        id_column="span.id" if table_option == "traces" else None,
+    )
 
     # Visualization
     st.subheader("Visualization")
@@ -86,6 +261,7 @@ else:
         st.plotly_chart(fig, use_container_width=True)
 
     elif table_option == "metrics":
+        st.caption(f"Resolution: {metrics_source(time_window_hours)}")
         # Parse '@timestamp' to datetime
         df['@timestamp'] = pd.to_datetime(df['@timestamp'])
 
@@ -138,3 +314,39 @@ else:
                 fig.update_yaxes(title='Average Duration (ms)')
                 st.plotly_chart(fig, use_container_width=True)
 
+# Log search through the token index
+if search_query:
+    st.subheader("Log search")
+    terms, row_terms = search_terms(search_query)
+    if not terms:
+        st.warning("Search terms need a word of at least three letters or digits that is not a stopword, or key=value.")
+    else:
+        if compare_scan:
+            # Time the queries themselves, not Snowflake's result cache
+            session.sql("ALTER SESSION SET USE_CACHED_RESULT = FALSE").collect()
+        results, buckets_read, index_seconds = search_logs_indexed(terms, row_terms, time_window_hours)
+        st.caption(f"Token index: {len(results)} rows from {buckets_read} time buckets in {index_seconds:.2f}s")
+        # Only the longest tokens of a record are indexed; long messages are checked with LIKE
+        long_results, long_seconds = search_logs_scan(row_terms, time_window_hours, TRUNCATED_MESSAGE_LENGTH)
+        st.caption(
+            f"LIKE on messages of {TRUNCATED_MESSAGE_LENGTH}+ characters, whose index entries may be "
+            f"truncated to {MAX_TOKENS_PER_RECORD} tokens: {len(long_results)} rows in {long_seconds:.2f}s"
+        )
+        if not long_results.empty:
+            results = (
+                pd.concat([results, long_results])
+                .drop_duplicates(subset=["TIMESTAMP", "MESSAGE"])
+                .sort_values("TIMESTAMP", ascending=False)
+                .head(SEARCH_ROW_LIMIT)
+            )
+        if compare_scan:
+            scan_results, scan_seconds = search_logs_scan(row_terms, time_window_hours)
+            st.caption(
+                f"LIKE scan: {len(scan_results)} rows in {scan_seconds:.2f}s "
+                f"({scan_seconds / max(index_seconds, 1e-6):.1f}x the index). "
+                "The index matches whole tokens, LIKE also matches inside words."
+            )
+        if results.empty:
+            st.warning("No log records match all search terms.")
+        else:
+            st.write(results)
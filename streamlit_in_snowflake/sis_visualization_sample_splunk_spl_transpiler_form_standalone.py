@@ -8,6 +8,8 @@ import re
 from snowflake.snowpark.session import Session
 from snowflake.snowpark.functions import col, dateadd, current_timestamp, lit
 
+from dashboard_common import browse_rows
+
 # Title of the dashboard
 st.title("Elastic Common Schema Data Dashboard")
 
@@ -18,7 +20,8 @@ def create_session():
 
 session = create_session()
 
-def transpile_spl_to_sql(spl_query):
+def transpile_spl_to_source(spl_query):
+    # The transpiled query without ordering and limit, and whether it aggregates
     select_clause = "SELECT *"
     where_clause = ""
     group_by_clause = ""
@@ -58,22 +61,22 @@ def transpile_spl_to_sql(spl_query):
                 select_clause = f'''SELECT \"attributes\"[\"{group_by_field}\"]::STRING AS {group_by_field}, AVG(\"{metric}\") AS avg_value"
                 group_by_clause = f'GROUP BY {group_by_field}'''
 
-    sql_query =f'''
+    source_query = f'''
     {select_clause}
     FROM {table_name}
     {where_clause}
-    {group_by_clause}
+    {group_by_clause}'''
+    return source_query.strip(), bool(stats_match)
+
+def transpile_spl_to_sql(spl_query):
+    source_query, _ = transpile_spl_to_source(spl_query)
+    sql_query = f'''
+    {source_query}
     ORDER BY "@timestamp" DESC
     LIMIT 1000'''
     
     return sql_query.strip()
 
-
-
-
-
-
-
 # Function to execute the SPL query
 def execute_spl_query(spl_query):
     sql_query = transpile_spl_to_sql(spl_query)
@@ -93,7 +96,13 @@ if execute_spl_query_button and spl_query:
     st.subheader("SPL Query Results")
     df = execute_spl_query(spl_query)
     if df is not None and not df.empty:
-        st.write(df)
+        source_query, aggregated = transpile_spl_to_source(spl_query)
+        columns = [] if aggregated else [name.strip('"') for name in session.sql(source_query).columns]
+        if "@timestamp" in columns:
+            # Page through all matching rows rather than only the newest 1000
+            browse_rows(session, "spl_rows", source_query, "@timestamp", columns)
+        else:
+            st.write(df)
         # Optional: Add visualization if relevant fields are present
         if "@timestamp" in df.columns and "metric.value" in df.columns:
             df['@timestamp'] = pd.to_datetime(df['@timestamp'])
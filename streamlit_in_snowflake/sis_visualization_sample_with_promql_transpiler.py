@@ -8,6 +8,8 @@ import re
 from snowflake.snowpark.session import Session
 from snowflake.snowpark.functions import col, dateadd, current_timestamp, lit
 
+from dashboard_common import CHART_COLUMNS, ROLLUP_ROW_LIMIT, TABLE_COLUMNS, browse_rows, metrics_source
+
 # Title of the dashboard
 st.title("Elastic Common Schema Data Dashboard")
 
@@ -18,7 +20,7 @@ def create_session():
 
 session = create_session()
 
-def load_data_promql(promql_query, time_window_hours):
+def promql_where_clause(promql_query, time_window_hours):
     # Ensure time_window_hours is an integer
     time_window_hours = int(time_window_hours)
 
@@ -52,15 +54,27 @@ def load_data_promql(promql_query, time_window_hours):
     where_clauses.append(f'"@timestamp" >= DATEADD(\'hour\', {time_window_hours}, CURRENT_TIMESTAMP())')
 
     # Combine WHERE clauses
-    where_clause = ' AND '.join(where_clauses)
+    return ' AND '.join(where_clauses)
 
-    # Construct SQL query
+def load_data_promql(promql_query, time_window_hours):
+    where_clause = promql_where_clause(promql_query, time_window_hours)
+    if where_clause is None:
+        return None
+
+    # Construct SQL query against the coarsest adequate resolution
+    source = metrics_source(time_window_hours)
+    if source == "ecs_schema.metrics":
+        value_column = '"metric.value"'
+        row_limit = 1000
+    else:
+        value_column = '"metric.sum" / NULLIF("metric.count", 0) AS "metric.value"'
+        row_limit = ROLLUP_ROW_LIMIT
     sql_query = f"""
-    SELECT "@timestamp", "metric.value", "attributes"
-    FROM ecs_schema.metrics
+    SELECT "@timestamp", {value_column}
+    FROM {source}
     WHERE {where_clause}
     ORDER BY "@timestamp" DESC
-    LIMIT 1000
+    LIMIT {row_limit}
     """
 
     # Execute SQL query
@@ -87,9 +101,26 @@ def load_data(table_name, time_window_hours):
     else:
         timestamp_col = '"@timestamp"'
 
+    # Metrics come from the coarsest adequate rollup, averaged per bucket
+    if table_name == 'metrics':
+        source = metrics_source(time_window_hours)
+        if source != "ecs_schema.metrics":
+            sql_query = f"""
+            SELECT "@timestamp", "metricset.name",
+                   "metric.sum" / NULLIF("metric.count", 0) AS "metric.value",
+                   "metric.min", "metric.max", "metric.count",
+                   APPROX_PERCENTILE_ESTIMATE("metric.sketch", 0.95) AS "metric.p95"
+            FROM {source}
+            WHERE "@timestamp" >= DATEADD('hour', {int(time_window_hours)}, CURRENT_TIMESTAMP())
+            ORDER BY "@timestamp" DESC
+            LIMIT {ROLLUP_ROW_LIMIT}
+            """
+            return session.sql(sql_query).to_pandas()
+
     # Query data using Snowpark
     df = session.table(f"ecs_schema.{table_name}") \
         .filter(col(timestamp_col) >= time_threshold) \
+        .select(*[col(f'"{column}"') for column in CHART_COLUMNS[table_name]]) \
         .sort(col(timestamp_col).desc()) \
         .limit(1000) \
         .to_pandas()
@@ -112,7 +143,14 @@ if execute_query and promql_query:
     st.subheader("PromQL Query Results")
     df = load_data_promql(promql_query, promql_time_window_hours)
     if df is not None and not df.empty:
-        st.write(df)
+        st.caption(f"Resolution: {metrics_source(promql_time_window_hours)}")
+        # Raw data points of the selected series, page by page
+        browse_rows(
+            session, "promql_rows",
+            f"SELECT * FROM ecs_schema.metrics WHERE {promql_where_clause(promql_query, promql_time_window_hours)}",
+            "@timestamp",
+            TABLE_COLUMNS["metrics"],
+        )
         # Visualization
         df['@timestamp'] = pd.to_datetime(df['@timestamp'])
         fig = px.line(df, x='@timestamp', y='metric.value', title='Metric Value Over Time')
@@ -154,9 +192,17 @@ else:
     if df.empty:
         st.warning(f"No data available for the selected time window in {table_option} table.")
     else:
-        # Display data
+        # Browse the rows of the time window page by page
         st.subheader(f"Latest data from {table_option} table")
-        st.write(df)
+        timestamp_column = "span.start" if table_option == "traces" else "@timestamp"
+        browse_rows(
+            session, f"{table_option}_rows",
+            f'SELECT * FROM ecs_schema.{table_option} '
+            f'WHERE "{timestamp_column}" >= DATEADD(\'hour\', {int(dashboard_time_window_hours)}, CURRENT_TIMESTAMP())',
+            timestamp_column,
+            TABLE_COLUMNS[table_option],
+            id_column="span.id" if table_option == "traces" else None,
+        )
 
         # Visualization
         st.subheader("Visualization")
@@ -173,6 +219,7 @@ else:
             st.plotly_chart(fig, use_container_width=True)
 
         elif table_option == "metrics":
+            st.caption(f"Resolution: {metrics_source(dashboard_time_window_hours)}")
             # Parse '@timestamp' to datetime
             df['@timestamp'] = pd.to_datetime(df['@timestamp'], errors='coerce')
             df = df.dropna(subset=['@timestamp'])